@@ -0,0 +1,42 @@
+import argparse
+import time
+import typing as t
+
+from pphoto.annots.md5 import compute_md5
+from pphoto.annots.text import ImageInput, Models
+from pphoto.db.types import NoCache
+from pphoto.utils.files import get_paths, supported_media_class, SupportedMediaClass
+
+
+def benchmark(models: Models, inputs: t.List[ImageInput], batch_size: int) -> float:
+    """Returns images per second when processing inputs in batches of given size."""
+    start = time.monotonic()
+    for i in range(0, len(inputs), batch_size):
+        models.process_image_batch_impl(inputs[i : i + batch_size], 0.2, 0.1)
+    return len(inputs) / (time.monotonic() - start)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Images per second of image to text models by batch size")
+    parser.add_argument("directory")
+    parser.add_argument("--images", type=int, default=64)
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[1, 2, 4, 8, 16])
+    args = parser.parse_args()
+    images = (
+        path
+        for path in get_paths([], [args.directory])
+        if supported_media_class(path) == SupportedMediaClass.IMAGE
+    )
+    paths = [path for path, _ in zip(images, range(args.images))]
+    inputs: t.List[ImageInput] = []
+    for path in paths:
+        with open(path, "rb") as f:
+            inputs.append((compute_md5(path), f.read(), None))
+    models = Models(NoCache(), None)
+    models.load()
+    for batch_size in args.batch_sizes:
+        print(f"batch size {batch_size:3d}: {benchmark(models, inputs, batch_size):.2f} images/s")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,12 +1,22 @@
+import asyncio
+import concurrent.futures as cfut
 import datetime
+import sys
 import typing as t
 
 from pphoto.annots.date import PathDateExtractor
 from pphoto.annots.dimensions import Dimensions
 from pphoto.annots.exif import Exif, ImageExif
-from pphoto.annots.face import FaceEmbeddingsAnnotator
+from pphoto.annots.face import FaceEmbeddingsAnnotator, warm_up_pool_models as warm_up_face_models
 from pphoto.annots.geo import Geolocator, GeoAddress
-from pphoto.annots.text import Models, ImageClassification
+from pphoto.annots.image import (
+    FACE_MODELS_MEMORY_MB,
+    TEXT_MODELS_MEMORY_MB,
+    VideoFrameExtractor,
+    fit_to_memory_budget,
+    image_models_pool,
+)
+from pphoto.annots.text import Models, ImageClassification, warm_up_pool_models as warm_up_text_models
 from pphoto.data_model.config import DirectoryMatchingConfig, DBFilesConfig
 from pphoto.data_model.base import WithMD5, PathWithMd5, Error, StorableData
 from pphoto.data_model.dimensions import ImageDimensions
@@ -18,12 +28,21 @@ from pphoto.data_model.manual import (
     ManualIdentities,
     Position,
 )
-from pphoto.data_model.face import FaceEmbeddings
+from pphoto.data_model.face import FaceEmbeddings, migrate_json_to_binary
 from pphoto.remote_jobs.types import RemoteTask, ManualAnnotationTask
 from pphoto.db.cache import SQLiteCache
+from pphoto.db.face_index import FaceIndex
 from pphoto.db.features_table import FeaturesTable
 from pphoto.db.identity_table import IdentityTable
-from pphoto.communication.server import RemoteExecutorQueue
+from pphoto.communication.server import RemoteExecutors
+from pphoto.utils import Lazy
+
+# Face index is compacted at startup, when this fraction of its rows is no longer referenced
+_FACE_INDEX_MIN_UNREFERENCED = 0.2
+
+
+def _close_pool(pool: cfut.ProcessPoolExecutor) -> None:
+    pool.shutdown(wait=False, cancel_futures=False)
 
 
 class Annotator:
@@ -33,20 +52,110 @@ class Annotator:
         files_config: DBFilesConfig,
         features: FeaturesTable,
         identities_table: IdentityTable,
-        remote_annotator_queue: t.Optional[RemoteExecutorQueue],
+        remote_executors: t.Optional[RemoteExecutors],
+        cheap_features_workers: int = 0,
+        image_to_text_batch_size: int = 1,
+        image_to_text_batch_wait: datetime.timedelta = datetime.timedelta(milliseconds=50),
+        remote_downscale: bool = True,
+        text_model_workers: int = 1,
+        face_model_workers: int = 1,
+        model_memory_budget_mb: t.Optional[int] = None,
+        models_keep_alive: t.Optional[t.Callable[[], bool]] = None,
+        face_index: t.Optional[FaceIndex] = None,
     ):
+        """
+        With `cheap_features_workers` > 0, exif and dimensions are extracted in process pool. With
+        `remote_downscale`, images are downscaled to sizes used by models before sending them to remote workers.
+        Model pools are reduced to fit into `model_memory_budget_mb` and kept while `models_keep_alive`.
+        Face embeddings missing in `face_index` are indexed at startup, new ones when they are computed.
+        """
+        self._cheap_features_pool: t.Optional[Lazy[cfut.ProcessPoolExecutor]] = None
+        if cheap_features_workers > 0:
+            self._cheap_features_pool = Lazy(
+                # pylint: disable-next = consider-using-with
+                lambda: cfut.ProcessPoolExecutor(max_workers=cheap_features_workers),
+                ttl=datetime.timedelta(seconds=20 * 60),
+                destructor=_close_pool,
+            )
         self.path_to_date = PathDateExtractor(directory_matching)
+        self._features = features
         models_cache = SQLiteCache(
             features,
             ImageClassification,
             ImageClassification.from_json_bytes,
             files_config.image_to_text_jsonl,
         )
-        self.models = Models(models_cache, remote_annotator_queue)
+        if text_model_workers <= 1 and face_model_workers <= 1:
+            # Models share the process, so that each image is decoded once for all of them
+            (text_model_workers, face_model_workers) = (1, 1)
+            text_models_pool = image_models_pool(
+                warm_up=[warm_up_text_models, warm_up_face_models], keep_alive=models_keep_alive
+            )
+            face_models_pool = text_models_pool
+        else:
+            (text_model_workers, face_model_workers) = fit_to_memory_budget(
+                [(text_model_workers, TEXT_MODELS_MEMORY_MB), (face_model_workers, FACE_MODELS_MEMORY_MB)],
+                model_memory_budget_mb,
+            )
+            text_models_pool = image_models_pool(
+                text_model_workers, warm_up=[warm_up_text_models], keep_alive=models_keep_alive
+            )
+            face_models_pool = image_models_pool(
+                face_model_workers, warm_up=[warm_up_face_models], keep_alive=models_keep_alive
+            )
+        print(
+            "Model pools with",
+            text_model_workers,
+            "text and",
+            face_model_workers,
+            "face workers",
+            file=sys.stderr,
+        )
+        self._model_pools = [text_models_pool, face_models_pool]
+        # Both annotators process the same videos, frames are extracted once for both of them
+        video_frames = VideoFrameExtractor()
+        self.models = Models(
+            models_cache,
+            remote_executors,
+            batch_size=image_to_text_batch_size,
+            batch_max_wait=image_to_text_batch_wait,
+            pool=text_models_pool,
+            remote_downscale=remote_downscale,
+            pool_workers=text_model_workers,
+            video_frames=video_frames,
+        )
+        migrated = features.migrate_payloads(
+            FaceEmbeddings.__name__, 0, FaceEmbeddings.current_version(), migrate_json_to_binary
+        )
+        if migrated:
+            print("Migrated face embeddings to binary form:", migrated, file=sys.stderr)
+        if face_index is not None:
+            indexed = face_index.sync()
+            if indexed:
+                print("Indexed face embeddings of files:", indexed, file=sys.stderr)
+            # Faces indexed again leave their old rows in the file
+            unreferenced = face_index.unreferenced()
+            if unreferenced:
+                print("Unreferenced rows in face index:", unreferenced, file=sys.stderr)
+                removed = face_index.compact(_FACE_INDEX_MIN_UNREFERENCED)
+                if removed:
+                    print("Compacted face index, removed rows:", removed, file=sys.stderr)
         face_embeddings_cache = SQLiteCache(
-            features, FaceEmbeddings, FaceEmbeddings.from_json_bytes, files_config.face_embeddings_jsonl
+            features,
+            FaceEmbeddings,
+            FaceEmbeddings.from_bytes,
+            files_config.face_embeddings_jsonl,
+            dumper=FaceEmbeddings.to_bytes,
+        )
+        self.face = FaceEmbeddingsAnnotator(
+            face_embeddings_cache,
+            remote_executors,
+            pool=face_models_pool,
+            remote_downscale=remote_downscale,
+            pool_workers=face_model_workers,
+            video_frames=video_frames,
+            index=face_index,
         )
-        self.face = FaceEmbeddingsAnnotator(face_embeddings_cache, remote_annotator_queue)
         exif_cache = SQLiteCache(features, ImageExif, ImageExif.from_json_bytes, files_config.exif_jsonl)
         self.exif = Exif(exif_cache)
         dimm_cache = SQLiteCache(
@@ -73,6 +182,11 @@ class Annotator:
         self.cheap_features_types: t.List[t.Type[StorableData]] = [ImageExif, ImageDimensions, GeoAddress]
         self.image_to_text_types: t.List[t.Type[StorableData]] = [ImageClassification, FaceEmbeddings]
 
+    def warm_up_models(self) -> None:
+        """Starts model pools, so that models are loaded before first image arrives"""
+        for pool in self._model_pools:
+            pool.get()
+
     def update_manual_identity(
         self, task: RemoteTask[t.List[ManualIdentity]]
     ) -> t.Tuple[t.Optional[WithMD5[ManualIdentities]], t.Tuple[str, t.List[ManualIdentity]]]:
@@ -93,17 +207,17 @@ class Annotator:
         for identity in task.payload:
             if identity.identity is not None:
                 self._identities.add(identity.identity, None, None, True)
-        return (
-            self.manual_identities.add(
-                WithMD5(
-                    task.id_.md5,
-                    ManualIdentities.current_version(),
-                    ManualIdentities(list(identities.values())),
-                    None,
-                )
-            ),
-            (task.id_.md5, new_identities),
+        ret = self.manual_identities.add(
+            WithMD5(
+                task.id_.md5,
+                ManualIdentities.current_version(),
+                ManualIdentities(list(identities.values())),
+                None,
+            )
         )
+        # Manual annotations can't be recomputed, so they must be durable before task is finished
+        self._features.flush()
+        return (ret, (task.id_.md5, new_identities))
 
     def manual_features(
         self, task: RemoteTask[ManualAnnotationTask]
@@ -135,17 +249,42 @@ class Annotator:
                     old_desc = set(t_pay.description)
                     t_pay.description.extend(x for x in old_pay.payload.p.description if x not in old_desc)
             mt = self.manual_text.add(WithMD5(task.id_.md5, ManualText.current_version(), t_pay, None))
+        self._features.flush()
         return (ml, md, mt)
 
-    def cheap_features(self, path: PathWithMd5, recompute_location: bool) -> t.Tuple[
+    async def _cheap_features_in_pool(
+        self, path: PathWithMd5, pool_lazy: Lazy[cfut.ProcessPoolExecutor], retry: bool = True
+    ) -> t.Tuple[WithMD5[ImageExif], WithMD5[ImageDimensions]]:
+        """If worker dies, e.g. killed by OOM killer, pool is replaced and file is retried once"""
+        pool = pool_lazy.get()
+        exif_item, dimensions_item = await asyncio.gather(
+            self.exif.process_file_in_pool(path, pool),
+            self.dimensions.process_file_in_pool(path, pool),
+            return_exceptions=True,
+        )
+        if any(isinstance(x, cfut.process.BrokenProcessPool) for x in (exif_item, dimensions_item)):
+            print("Replacing broken process pool for cheap features", path, file=sys.stderr)
+            pool_lazy.discard(pool)
+            if retry:
+                return await self._cheap_features_in_pool(path, pool_lazy, retry=False)
+        if isinstance(exif_item, BaseException):
+            raise exif_item
+        if isinstance(dimensions_item, BaseException):
+            raise dimensions_item
+        return (exif_item, dimensions_item)
+
+    async def cheap_features(self, path: PathWithMd5, recompute_location: bool) -> t.Tuple[
         PathWithMd5,
         WithMD5[ImageExif],
         WithMD5[ImageDimensions],
         WithMD5[GeoAddress],
         t.Optional[datetime.datetime],
     ]:
-        exif_item = self.exif.process_file(path)
-        dimensions_item = self.dimensions.process_file(path)
+        if self._cheap_features_pool is None:
+            exif_item = self.exif.process_file(path)
+            dimensions_item = self.dimensions.process_file(path)
+        else:
+            exif_item, dimensions_item = await self._cheap_features_in_pool(path, self._cheap_features_pool)
         manual_location = self.manual_location.get(path.md5)
         if (
             manual_location is not None
@@ -1,51 +1,89 @@
 from __future__ import annotations
 
+import asyncio
+import concurrent.futures as cfut
 import os
 import sys
 import traceback
+import typing as t
 
 from PIL import Image, ImageFile
 from ffmpeg import probe
 
 from pphoto.data_model.base import WithMD5, PathWithMd5, Error
 from pphoto.data_model.dimensions import ImageDimensions
-from pphoto.db.types import Cache
+from pphoto.db.types import Cache, NoCache
 from pphoto.utils.files import supported_media_class, SupportedMediaClass
-from pphoto.utils import assert_never
+from pphoto.utils import Lazy, assert_never
 
 ImageFile.LOAD_TRUNCATED_IMAGES = True
 
+_POOL_DIMENSIONS = Lazy(lambda: Dimensions(NoCache()))
+
+
+def _process_file_in_pool(inp: PathWithMd5) -> WithMD5[ImageDimensions]:
+    return _POOL_DIMENSIONS.get().process_file_impl(inp)
+
 
 class Dimensions:
     def __init__(self, cache: Cache[ImageDimensions]) -> None:
         self._cache = cache
         self._version = ImageDimensions.current_version()
 
-    def process_file(self, inp: PathWithMd5) -> WithMD5[ImageDimensions]:
+    def _cached(self, inp: PathWithMd5) -> t.Optional[WithMD5[ImageDimensions]]:
         ret = self._cache.get(inp.md5)
         if ret is not None and ret.payload is not None:
             return ret.payload
+        return None
+
+    def process_file(self, inp: PathWithMd5) -> WithMD5[ImageDimensions]:
+        ret = self._cached(inp)
+        if ret is not None:
+            return ret
+        try:
+            ex = self.process_file_impl(inp)
+        # pylint: disable-next = broad-exception-caught
+        except Exception as e:
+            return self._file_error(inp, e)
+        return self._cache.add(ex)
+
+    async def process_file_in_pool(self, inp: PathWithMd5, pool: cfut.Executor) -> WithMD5[ImageDimensions]:
+        """Computes dimensions in the pool, result is stored to cache in the caller's process"""
+        ret = self._cached(inp)
+        if ret is not None:
+            return ret
+        try:
+            ex = await asyncio.get_running_loop().run_in_executor(pool, _process_file_in_pool, inp)
+        except cfut.process.BrokenProcessPool:
+            # Not an error of the file, caller replaces the pool
+            raise
+        # pylint: disable-next = broad-exception-caught
+        except Exception as e:
+            return self._file_error(inp, e)
+        return self._cache.add(ex)
+
+    def _file_error(self, inp: PathWithMd5, e: Exception) -> WithMD5[ImageDimensions]:
+        # File might be just temporarily unavailable, so this is not cached
+        traceback.print_exc()
+        print("Error while processing dimensions path in ", inp, e, file=sys.stderr)
+        return WithMD5(inp.md5, self._version, None, Error.from_exception(e))
+
+    def process_file_impl(self, inp: PathWithMd5) -> WithMD5[ImageDimensions]:
+        """Raises exception if file is not accessible"""
         media_class = supported_media_class(inp.path)
         if media_class is None:
             ex: WithMD5[ImageDimensions] = WithMD5(
                 inp.md5, self._version, None, Error("UnsupportedMedia", None, None)
             )
         else:
-            try:
-                file_size = os.path.getsize(inp.path)
-            # pylint: disable-next = broad-exception-caught
-            except Exception as e:
-                traceback.print_exc()
-                print("Error while processing dimensions path in ", inp, e, file=sys.stderr)
-                return WithMD5(inp.md5, self._version, None, Error.from_exception(e))
-
+            file_size = os.path.getsize(inp.path)
             if media_class == SupportedMediaClass.IMAGE:
                 ex = self.process_image_impl(inp, file_size)
             elif media_class == SupportedMediaClass.VIDEO:
                 ex = self.process_video_impl(inp, file_size)
             else:
                 assert_never(media_class)
-        return self._cache.add(ex)
+        return ex
 
     def process_image_impl(self: Dimensions, inp: PathWithMd5, file_size: int) -> WithMD5[ImageDimensions]:
         try:
@@ -1,6 +1,9 @@
 from __future__ import annotations
 
+import asyncio
+import concurrent.futures as cfut
 from datetime import datetime, timedelta
+import os
 import sys
 import traceback
 import typing as t
@@ -10,9 +13,10 @@ import exiftool
 
 from pphoto.data_model.base import WithMD5, PathWithMd5, Error
 from pphoto.data_model.exif import ImageExif, Date, Camera, GPSCoord, VideoInfo
-from pphoto.db.types import Cache
+from pphoto.db.types import Cache, NoCache
 from pphoto.utils.files import SupportedMedia, supported_media, supported_media_class, SupportedMediaClass
-from pphoto.utils import assert_never
+from pphoto.utils import Lazy, assert_never
+from pphoto.utils.batcher import Batcher
 
 IGNORED_IMAGE_TAGS = [
     "aperture_value",
@@ -569,16 +573,63 @@ def parse_datetime(s: t.Optional[str], offset: t.Optional[str]) -> t.Optional[da
     return None
 
 
+_POOL_EXIF = Lazy(lambda: Exif(NoCache()))
+
+
+def _process_file_in_pool(inp: PathWithMd5) -> WithMD5[ImageExif]:
+    return _POOL_EXIF.get().process_file_impl(inp)
+
+
+def _process_videos_in_pool(inps: t.List[PathWithMd5]) -> t.List[WithMD5[ImageExif]]:
+    return _POOL_EXIF.get().process_videos_impl(inps)
+
+
 class Exif:
-    def __init__(self, cache: Cache[ImageExif]) -> None:
+    def __init__(
+        self,
+        cache: Cache[ImageExif],
+        video_batch_size: int = 32,
+        video_batch_wait: timedelta = timedelta(milliseconds=100),
+    ) -> None:
         self._cache = cache
         self._version = ImageExif.current_version()
         self._exiftool = exiftool.ExifToolHelper()
+        self._video_batcher = Batcher(self._process_videos_in_pool, video_batch_size, video_batch_wait)
 
-    def process_file(self, inp: PathWithMd5) -> WithMD5[ImageExif]:
+    def _cached(self, inp: PathWithMd5) -> t.Optional[WithMD5[ImageExif]]:
         ret = self._cache.get(inp.md5)
         if ret is not None and ret.payload is not None and ret.version == self._version:
             return ret.payload
+        return None
+
+    def process_file(self, inp: PathWithMd5) -> WithMD5[ImageExif]:
+        ret = self._cached(inp)
+        if ret is not None:
+            return ret
+        return self._cache.add(self.process_file_impl(inp))
+
+    async def process_file_in_pool(self, inp: PathWithMd5, pool: cfut.Executor) -> WithMD5[ImageExif]:
+        """Extracts exif in the pool, result is stored to cache in the caller's process"""
+        ret = self._cached(inp)
+        if ret is not None:
+            return ret
+        if supported_media_class(inp.path) == SupportedMediaClass.VIDEO:
+            # Concurrent requests for videos are processed by one exiftool call
+            ex = await self._video_batcher.process((inp, pool))
+        else:
+            ex = await asyncio.get_running_loop().run_in_executor(pool, _process_file_in_pool, inp)
+        return self._cache.add(ex)
+
+    async def _process_videos_in_pool(
+        self, items: t.List[t.Tuple[PathWithMd5, cfut.Executor]]
+    ) -> t.List[WithMD5[ImageExif]]:
+        # Last item has the newest pool, in case broken pool was replaced while batching
+        pool = items[-1][1]
+        return await asyncio.get_running_loop().run_in_executor(
+            pool, _process_videos_in_pool, [inp for inp, _ in items]
+        )
+
+    def process_file_impl(self, inp: PathWithMd5) -> WithMD5[ImageExif]:
         media = supported_media(inp.path)
         media_class = supported_media_class(inp.path)
         if media_class is None or (
@@ -595,16 +646,35 @@ class Exif:
                 ex = self.process_video_impl(inp)
             else:
                 assert_never(media_class)
-        return self._cache.add(ex)
+        return ex
 
-    def process_video_impl(self: Exif, inp: PathWithMd5) -> WithMD5[ImageExif]:
+    def process_videos_impl(self: Exif, inps: t.List[PathWithMd5]) -> t.List[WithMD5[ImageExif]]:
         try:
-            video_tags = self._exiftool.get_metadata(inp.path, params=["-c", "%.10f"])[0]
+            videos_tags = self._exiftool.get_metadata([inp.path for inp in inps], params=["-c", "%.10f"])
+            # Exiftool can skip or reorder files, so results are matched by their path
+            by_path = {os.path.normpath(str(tags.get("SourceFile"))): tags for tags in videos_tags}
+            matched_tags = []
+            for inp in inps:
+                tags = by_path.get(os.path.normpath(inp.path))
+                if tags is None:
+                    raise ValueError(f"Exiftool returned no result for {inp.path}")
+                matched_tags.append(tags)
         # pylint: disable-next = broad-exception-caught
         except Exception as e:
-            traceback.print_exc()
-            print("Error while processing exif path in ", inp, e, file=sys.stderr)
-            return WithMD5(inp.md5, self._version, None, Error.from_exception(e))
+            if len(inps) == 1:
+                traceback.print_exc()
+                print("Error while processing exif path in ", inps[0], e, file=sys.stderr)
+                return [WithMD5(inps[0].md5, self._version, None, Error.from_exception(e))]
+            # Some file in the batch is broken, find out which one
+            return [self.process_video_impl(inp) for inp in inps]
+        return [self._exif_from_video_tags(inp, tags) for inp, tags in zip(inps, matched_tags)]
+
+    def process_video_impl(self: Exif, inp: PathWithMd5) -> WithMD5[ImageExif]:
+        return self.process_videos_impl([inp])[0]
+
+    def _exif_from_video_tags(
+        self: Exif, inp: PathWithMd5, video_tags: t.Dict[str, t.Any]
+    ) -> WithMD5[ImageExif]:
         d = UnparsedTags()
         for tag, value in video_tags.items():
             if tag in IGNORED_VIDEO_TAGS:
@@ -1,37 +1,44 @@
 from __future__ import annotations
 
 import asyncio
-import base64
 import concurrent.futures as cfut
-import datetime as dt
-import io
 import os
 import traceback
 import typing as t
 
-from PIL import Image as PILImage, ImageOps
 import numpy as np
 
+from pphoto.annots.image import (
+    DECODE_MAX_SIDE,
+    ImageData,
+    ScaledImage,
+    VideoFrameExtractor,
+    decode_image_cached,
+    encode_downscaled,
+    image_models_pool,
+    shared_image_data,
+)
 from pphoto.data_model.base import PathWithMd5, WithMD5, Error
 from pphoto.data_model.face import FaceEmbeddings, Face, ImageResolution, Position
 from pphoto.data_model.manual import ManualIdentity
 from pphoto.db.cache import Cache
-from pphoto.communication.server import RemoteExecutorQueue
+from pphoto.db.face_index import FaceIndex
+from pphoto.communication.scheduler import ExecutorLoad
+from pphoto.communication.server import RemoteExecutor, RemoteExecutors
 from pphoto.communication.types import FaceEmbeddingsRequest, FaceEmbeddingsWithMD5, RemoteAnnotatorRequest
 from pphoto.utils import Lazy, assert_never, log_error
 from pphoto.utils.files import supported_media_class, SupportedMediaClass
-from pphoto.utils.video import get_video_frames
 
 
-def _close_pool(pool: cfut.ProcessPoolExecutor) -> None:
-    pool.shutdown(wait=False, cancel_futures=False)
+# Latency of remote and local executors is tracked by kind of request
+_REQUEST_KIND = "FaceEmbeddingsRequest"
 
 
 def face_embeddings_endpoint(request: FaceEmbeddingsRequest) -> FaceEmbeddingsWithMD5:
     try:
         x = _process_image_impl(
             request.path,
-            base64.decodebytes(request.data_base64.encode("utf-8")),
+            request.data,
             request.pts,
             request.for_positions,
         )
@@ -48,8 +55,7 @@ def face_embeddings_endpoint(request: FaceEmbeddingsRequest) -> FaceEmbeddingsWi
         )
 
 
-async def fetch_ann(queue: RemoteExecutorQueue, request: FaceEmbeddingsRequest) -> WithMD5[FaceEmbeddings]:
-    annotator = await queue.get()
+async def fetch_ann(annotator: RemoteExecutor, request: FaceEmbeddingsRequest) -> WithMD5[FaceEmbeddings]:
     response = await annotator(RemoteAnnotatorRequest(request))
     if response.error is not None:
         raise response.error
@@ -67,27 +73,36 @@ async def fetch_ann(queue: RemoteExecutorQueue, request: FaceEmbeddingsRequest)
 
 
 class FaceEmbeddingsAnnotator:
-    def __init__(self, cache: Cache[FaceEmbeddings], remote: t.Optional[RemoteExecutorQueue]) -> None:
+    def __init__(
+        self,
+        cache: Cache[FaceEmbeddings],
+        remote: t.Optional[RemoteExecutors],
+        pool: t.Optional[Lazy[cfut.ProcessPoolExecutor]] = None,
+        remote_downscale: bool = True,
+        pool_workers: int = 1,
+        video_frames: t.Optional[VideoFrameExtractor] = None,
+        index: t.Optional[FaceIndex] = None,
+    ) -> None:
+        """
+        Pool can be shared with other image models, so that image decoded once is reused by them, it has
+        `pool_workers` processes. With `remote_downscale`, images are downscaled before they are sent to
+        remote workers. Video frames extractor can be shared too, so that each video is decoded once. Stored
+        embeddings are appended to `index`.
+        """
+        self._index = index
+        self._video_frames = VideoFrameExtractor() if video_frames is None else video_frames
         self._cache = cache
+        self._remote_downscale = remote_downscale
         self._version = FaceEmbeddings.current_version()
-        ttl = dt.timedelta(seconds=20 * 60)
-        self._pool = Lazy(
-            # pylint: disable-next = consider-using-with
-            lambda: cfut.ProcessPoolExecutor(max_workers=1),
-            ttl=ttl,
-            destructor=_close_pool,
-        )
+        self._pool = image_models_pool() if pool is None else pool
         self._remote = remote
-        self._last_remote_request = dt.datetime.now()
+        self._local = ExecutorLoad(pool_workers) if remote is None else remote.executor_load(pool_workers)
 
-    def _remote_can_be_available(self) -> bool:
-        if self._remote is None:
-            return False
-        if not self._remote.empty():
-            return True
-        if dt.datetime.now() - self._last_remote_request < dt.timedelta(seconds=300):
-            return True
-        return False
+    def _store(self, data: WithMD5[FaceEmbeddings]) -> WithMD5[FaceEmbeddings]:
+        stored = self._cache.add(data)
+        if self._index is not None and stored.p is not None and stored.version == self._version:
+            self._index.add(stored.md5, stored.p)
+        return stored
 
     async def add_faces(
         self, path: PathWithMd5, identities: t.List[ManualIdentity]
@@ -105,45 +120,16 @@ class FaceEmbeddingsAnnotator:
         if os.path.getsize(path.path) > 100_000_000:
             if existing is not None and existing.payload is not None:
                 return existing.payload
-            return self._cache.add(
-                WithMD5(path.md5, self._version, None, Error("SkippingHugeFile", None, None))
-            )
-        to_return_nullable: None | WithMD5[FaceEmbeddings] = None
-        if self._remote is not None and self._remote_can_be_available():
-            try:
-                with open(path.path, "rb") as f:
-                    data = base64.encodebytes(f.read())
-                ret = await asyncio.wait_for(
-                    fetch_ann(
-                        self._remote,
-                        FaceEmbeddingsRequest(
-                            "FaceEmbeddingsRequest",
-                            path,
-                            [x.position for x in to_compute],
-                            data.decode("utf-8"),
-                            None,  # TODO: is this correct?
-                        ),
-                    ),
-                    600,
-                )
-                self._last_remote_request = dt.datetime.now()
-                to_return_nullable = self._cache.add(ret)
-            # pylint: disable-next = bare-except
-            except:
-                traceback.print_exc()
-        if to_return_nullable is None:
-            to_return = await asyncio.get_running_loop().run_in_executor(
-                self._pool.get(), _process_image_impl, path, None, None, [x.position for x in to_compute]
-            )
-        else:
-            to_return = to_return_nullable
+            return self._store(WithMD5(path.md5, self._version, None, Error("SkippingHugeFile", None, None)))
+        # TODO: is pts None correct?
+        to_return = await self._process(path, None, None, [x.position for x in to_compute])
 
         if existing is None or existing.payload is None or existing.payload.p is None:
-            return self._cache.add(to_return)
+            return self._store(to_return)
 
         if to_return.p is not None:
             existing.payload.p.faces.extend(to_return.p.faces)
-        return self._cache.add(existing.payload)
+        return self._store(existing.payload)
 
     async def process_file(
         self,
@@ -158,11 +144,11 @@ class FaceEmbeddingsAnnotator:
             return x.payload
         media_class = supported_media_class(path.path)
         if media_class == SupportedMediaClass.IMAGE:
-            return self._cache.add(await self._process_image(path, None, None))
+            return self._store(await self._process_image(path, None, None))
         if media_class == SupportedMediaClass.VIDEO:
-            return self._cache.add(await self._process_video(path, frame_each_seconds, number_of_frames))
+            return self._store(await self._process_video(path, frame_each_seconds, number_of_frames))
         if media_class is None:
-            return self._cache.add(
+            return self._store(
                 WithMD5(path.md5, self._version, None, Error("UnsupportedMediaFile", None, None))
             )
         assert_never(media_class)
@@ -171,17 +157,10 @@ class FaceEmbeddingsAnnotator:
         self, path: PathWithMd5, frame_each_seconds: int, number_of_frames: int
     ) -> WithMD5[FaceEmbeddings]:
         annotations = []
-        for frame in get_video_frames(
-            path.path,
-            frame_each_seconds=frame_each_seconds,
-            number_of_frames=number_of_frames,
-        ):
+        for frame in await self._video_frames.get(path, frame_each_seconds, number_of_frames):
             # Intentionally doing this in serial, as otherwise we might fire too much annotation request (from each worker)
             # and overwhelm the system
-            buffer = io.BytesIO(b"")
-            frame.image.save(buffer, format="jpeg")
-            data = buffer.getvalue()
-            annotations.append(await self._process_image(path, data, frame.pts))
+            annotations.append(await self._process_image(path, frame.image, frame.pts))
 
         processed = []
         errors = []
@@ -202,66 +181,105 @@ class FaceEmbeddingsAnnotator:
             Error("NothingErrorOrSuccessWhileProcessingVideo", None, None),
         )
 
+    async def _fetch_remote(
+        self,
+        worker: RemoteExecutor,
+        path: PathWithMd5,
+        data: t.Optional[ImageData],
+        pts: t.Optional[int],
+        positions: t.Optional[t.List[Position]],
+    ) -> WithMD5[FaceEmbeddings]:
+        """Positions are in pixels of the original image, also in the returned embeddings"""
+        if data is None:
+            with open(path.path, "rb") as f:
+                data = f.read()
+        (sent_data, decoded) = await asyncio.get_running_loop().run_in_executor(
+            None, encode_downscaled, path, data, DECODE_MAX_SIDE if self._remote_downscale else None
+        )
+        sent: t.Optional[ScaledImage] = None
+        sent_positions = positions
+        if decoded is not None:
+            sent = decoded.transposed()
+            if positions is not None:
+                sent_positions = [_position_from_original(position, sent) for position in positions]
+        ret = await asyncio.wait_for(
+            fetch_ann(
+                worker,
+                FaceEmbeddingsRequest("FaceEmbeddingsRequest", path, sent_positions, pts, data=sent_data),
+            ),
+            600,
+        )
+        if sent is not None and ret.p is not None:
+            _faces_to_original(ret.p, sent, positions)
+        return ret
+
     async def _process_image(
-        self, path: PathWithMd5, data: t.Optional[bytes], pts: t.Optional[int]
+        self, path: PathWithMd5, data: t.Optional[ImageData], pts: t.Optional[int]
     ) -> WithMD5[FaceEmbeddings]:
         if data is None and os.path.getsize(path.path) > 100_000_000:
             return WithMD5(path.md5, self._version, None, Error("SkippingHugeFile", None, None))
-        if self._remote is not None and self._remote_can_be_available():
+        return await self._process(path, data, pts, None)
+
+    async def _process(
+        self,
+        path: PathWithMd5,
+        data: t.Optional[ImageData],
+        pts: t.Optional[int],
+        positions: t.Optional[t.List[Position]],
+    ) -> WithMD5[FaceEmbeddings]:
+        """Processes image on executor expected to be the fastest, falls back to local one on remote error"""
+        worker = None
+        if self._remote is not None:
+            worker = await self._remote.acquire(_REQUEST_KIND, self._local)
+        if worker is not None:
             try:
-                if data is None:
-                    with open(path.path, "rb") as f:
-                        data = base64.encodebytes(f.read())
-                else:
-                    data = base64.encodebytes(data)
-                ret = await asyncio.wait_for(
-                    fetch_ann(
-                        self._remote,
-                        FaceEmbeddingsRequest(
-                            "FaceEmbeddingsRequest",
-                            path,
-                            None,
-                            data.decode("utf-8"),
-                            pts,
-                        ),
-                    ),
-                    600,
-                )
-                self._last_remote_request = dt.datetime.now()
-                return ret
+                with worker.load.track(_REQUEST_KIND):
+                    return await self._fetch_remote(worker, path, data, pts, positions)
             # pylint: disable-next = bare-except
             except:
                 traceback.print_exc()
-        p = await asyncio.get_running_loop().run_in_executor(
-            self._pool.get(), _process_image_impl, path, data, pts, None
-        )
-        return p
+        with self._local.track(_REQUEST_KIND), shared_image_data(data) as shared_data:
+            return await asyncio.get_running_loop().run_in_executor(
+                self._pool.get(), _process_image_impl, path, shared_data, pts, positions
+            )
+
+
+def warm_up_pool_models() -> None:
+    """Loads models in pool process, used when the process starts"""
+    # pylint: disable-next = import-outside-toplevel,import-error
+    import face_recognition
+
+    image = np.zeros((64, 64, 3), dtype=np.uint8)
+    face_recognition.face_encodings(image, [(0, 64, 64, 0)])
 
 
 def _process_image_impl(
-    path: PathWithMd5, data: t.Optional[bytes], pts: t.Optional[int], positions: t.Optional[t.List[Position]]
+    path: PathWithMd5,
+    data: t.Optional[ImageData],
+    pts: t.Optional[int],
+    positions: t.Optional[t.List[Position]],
 ) -> WithMD5[FaceEmbeddings]:
     # pylint: disable-next = import-outside-toplevel,import-error
     import face_recognition
 
-    image = PILImage.open(path.path) if data is None else PILImage.open(io.BytesIO(data))
-    ImageOps.exif_transpose(image, in_place=True)
-    image = image.convert("RGB")
-    img = np.array(image)
-    (w, h) = image.size
+    # Positions are in pixels of the original image rotated by exif orientation
+    image = decode_image_cached(path, data, pts).transposed()
+    img = np.array(image.image)
+    (w, h) = image.original_size()
     resolution = ImageResolution(w, h)
     if positions is None:
-        positions = [
-            Position(left, top, right, bottom, pts)
-            for (top, right, bottom, left) in t.cast(
-                t.List[t.Tuple[int, int, int, int]], face_recognition.face_locations(img)
-            )
-        ]
+        positions = []
+        for top, right, bottom, left in t.cast(
+            t.List[t.Tuple[int, int, int, int]], face_recognition.face_locations(img)
+        ):
+            (left_o, top_o, right_o, bottom_o) = image.box_to_original([left, top, right, bottom])
+            positions.append(Position(round(left_o), round(top_o), round(right_o), round(bottom_o), pts))
+    locations = []
+    for p in positions:
+        (left_s, top_s, right_s, bottom_s) = image.box_from_original([p.left, p.top, p.right, p.bottom])
+        locations.append([round(top_s), round(right_s), round(bottom_s), round(left_s)])
     faces = []
-    for position, embedding_ndarray in zip(
-        positions,
-        face_recognition.face_encodings(img, [[p.top, p.right, p.bottom, p.left] for p in positions]),
-    ):
+    for position, embedding_ndarray in zip(positions, face_recognition.face_encodings(img, locations)):
         faces.append(
             Face(
                 position,
@@ -271,5 +289,30 @@ def _process_image_impl(
     return WithMD5(path.md5, FaceEmbeddings.current_version(), FaceEmbeddings(resolution, faces), None)
 
 
+def _position_from_original(position: Position, image: ScaledImage) -> Position:
+    (left, top, right, bottom) = image.box_from_original(
+        [position.left, position.top, position.right, position.bottom]
+    )
+    return Position(round(left), round(top), round(right), round(bottom), position.pts)
+
+
+def _faces_to_original(
+    embeddings: FaceEmbeddings, image: ScaledImage, positions: t.Optional[t.List[Position]]
+) -> None:
+    """
+    Maps faces found in downscaled image sent to remote worker to pixels of the original. Requested positions
+    are returned exactly as they were requested, so that they match manual identities.
+    """
+    (w, h) = image.original_size()
+    embeddings.resolution = ImageResolution(w, h)
+    for index, face in enumerate(embeddings.faces):
+        if positions is not None:
+            face.position = positions[index]
+            continue
+        p = face.position
+        (left, top, right, bottom) = image.box_to_original([p.left, p.top, p.right, p.bottom])
+        face.position = Position(round(left), round(top), round(right), round(bottom), p.pts)
+
+
 def _merge_face_embeddings_for_video(embeddings: t.Sequence[FaceEmbeddings]) -> FaceEmbeddings:
     return FaceEmbeddings(embeddings[0].resolution, [face for emb in embeddings for face in emb.faces])
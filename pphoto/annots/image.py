@@ -0,0 +1,327 @@
+from __future__ import annotations
+
+import asyncio
+import collections
+import contextlib
+import concurrent.futures as cfut
+import dataclasses
+import datetime
+import hashlib
+import io
+import typing as t
+from multiprocessing import shared_memory
+
+from PIL import ExifTags, Image, ImageFile
+
+from pphoto.data_model.base import PathWithMd5
+from pphoto.utils import Lazy, log_error
+from pphoto.utils.video import get_video_frames
+
+ImageFile.LOAD_TRUNCATED_IMAGES = True
+
+# Enough for face detection, models for text use smaller images
+DECODE_MAX_SIDE = 2048
+# Videos with extracted frames kept in memory, frames are shared by annotators processing the same file
+_VIDEO_FRAMES_CACHE_SIZE = 4
+# Rough resident memory of one process with loaded models, to fit pools into memory budget
+TEXT_MODELS_MEMORY_MB = 3000
+FACE_MODELS_MEMORY_MB = 500
+# Decoded images are reused by all models processing the same file in the process
+_DECODED_CACHE_SIZE = 32
+
+# Exif orientation -> transpose operations, same as in `PIL.ImageOps.exif_transpose`
+_ORIENTATION_TRANSPOSE: t.Dict[int, t.List[Image.Transpose]] = {
+    2: [Image.Transpose.FLIP_LEFT_RIGHT],
+    3: [Image.Transpose.ROTATE_180],
+    4: [Image.Transpose.FLIP_TOP_BOTTOM],
+    5: [Image.Transpose.TRANSPOSE],
+    6: [Image.Transpose.ROTATE_270],
+    7: [Image.Transpose.TRANSVERSE],
+    8: [Image.Transpose.ROTATE_90],
+}
+
+
+@dataclasses.dataclass
+class ScaledImage:
+    """Image downscaled from the original, `scale_x` and `scale_y` are original pixels per pixel of `image`"""
+
+    image: Image.Image
+    scale_x: float
+    scale_y: float
+
+    def original_size(self) -> t.Tuple[int, int]:
+        return (round(self.image.width * self.scale_x), round(self.image.height * self.scale_y))
+
+    def to_original(self, x: float, y: float) -> t.Tuple[float, float]:
+        return (x * self.scale_x, y * self.scale_y)
+
+    def from_original(self, x: float, y: float) -> t.Tuple[float, float]:
+        return (x / self.scale_x, y / self.scale_y)
+
+    def box_to_original(self, xyxy: t.Sequence[float]) -> t.List[float]:
+        return [*self.to_original(xyxy[0], xyxy[1]), *self.to_original(xyxy[2], xyxy[3])]
+
+    def box_from_original(self, xyxy: t.Sequence[float]) -> t.List[float]:
+        return [*self.from_original(xyxy[0], xyxy[1]), *self.from_original(xyxy[2], xyxy[3])]
+
+    def crop_original(self, xyxy: t.Sequence[float]) -> Image.Image:
+        """Crops box given in pixels of the original image"""
+        (left, top, right, bottom) = self.box_from_original(xyxy)
+        return self.image.crop((int(left), int(top), int(right), int(bottom)))
+
+    def resized(self, max_side: int) -> ScaledImage:
+        (w, h) = self.image.size
+        if max(w, h) <= max_side:
+            return self
+        ratio = max_side / max(w, h)
+        size = (max(1, round(w * ratio)), max(1, round(h * ratio)))
+        image = self.image.resize(size, Image.Resampling.BILINEAR)
+        return ScaledImage(image, self.scale_x * w / size[0], self.scale_y * h / size[1])
+
+
+@dataclasses.dataclass
+class DecodedImage:
+    """RGB image as stored in the file, i.e. not rotated by exif orientation"""
+
+    scaled: ScaledImage
+    orientation: int
+
+    def transposed(self) -> ScaledImage:
+        """Image rotated by exif orientation, coordinates map to the rotated original"""
+        ops = _ORIENTATION_TRANSPOSE.get(self.orientation, [])
+        image = self.scaled.image
+        for op in ops:
+            image = image.transpose(op)
+        if self.orientation in (5, 6, 7, 8):
+            return ScaledImage(image, self.scaled.scale_y, self.scaled.scale_x)
+        return ScaledImage(image, self.scaled.scale_x, self.scaled.scale_y)
+
+
+@dataclasses.dataclass
+class SharedScaledImage:
+    """Pixels of `ScaledImage` in shared memory, pool processes attach to it instead of unpickling pixels"""
+
+    name: str
+    mode: str
+    size: t.Tuple[int, int]
+    scale_x: float
+    scale_y: float
+
+    def load(self) -> ScaledImage:
+        # Pool processes share resource tracker of the owner, which unlinks the memory
+        memory = shared_memory.SharedMemory(name=self.name)
+        try:
+            image = Image.frombytes(self.mode, self.size, memory.buf)
+        finally:
+            memory.close()
+        return ScaledImage(image, self.scale_x, self.scale_y)
+
+
+# Encoded image, or already decoded one, e.g. video frame
+ImageData = t.Union[bytes, ScaledImage, SharedScaledImage]
+
+
+@contextlib.contextmanager
+def shared_image_data(data: t.Optional[ImageData]) -> t.Iterator[t.Optional[ImageData]]:
+    """
+    Moves pixels of decoded image to shared memory for the duration of the context, so that it can be passed
+    to process pool cheaply. Other data is returned as is.
+    """
+    if not isinstance(data, ScaledImage):
+        yield data
+        return
+    raw = data.image.tobytes()
+    memory = shared_memory.SharedMemory(create=True, size=max(1, len(raw)))
+    try:
+        memory.buf[: len(raw)] = raw
+        del raw
+        yield SharedScaledImage(memory.name, data.image.mode, data.image.size, data.scale_x, data.scale_y)
+    finally:
+        memory.close()
+        memory.unlink()
+
+
+def decode_image(
+    path: PathWithMd5, data: t.Optional[ImageData], max_side: t.Optional[int] = DECODE_MAX_SIDE
+) -> DecodedImage:
+    """
+    Decodes image at most `max_side` large. JPEG images are decoded directly in reduced size by draft mode,
+    which is much faster than decoding full image and resizing it.
+    """
+    if isinstance(data, SharedScaledImage):
+        data = data.load()
+    if isinstance(data, ScaledImage):
+        return DecodedImage(data if max_side is None else data.resized(max_side), 1)
+    image = Image.open(path.path) if data is None else Image.open(io.BytesIO(data))
+    (w, h) = image.size
+    if max_side is not None and max(w, h) > max_side:
+        ratio = max_side / max(w, h)
+        # Draft picks the smallest scale which is at least as large as requested
+        image.draft("RGB", (round(w * ratio), round(h * ratio)))
+    orientation = image.getexif().get(ExifTags.Base.Orientation, 1)
+    rgb = image.convert("RGB")
+    scaled = ScaledImage(rgb, w / rgb.width, h / rgb.height)
+    if max_side is not None:
+        scaled = scaled.resized(max_side)
+    return DecodedImage(scaled, orientation)
+
+
+def encode_downscaled(
+    path: PathWithMd5, data: ImageData, max_side: t.Optional[int], quality: int = 90
+) -> t.Tuple[bytes, t.Optional[DecodedImage]]:
+    """
+    Re-encodes image as JPEG at most `max_side` large, keeping exif orientation, so that it's decoded the
+    same way as the original. Returned decoded image maps pixels of the encoded image to the original, it's
+    None when the original is small enough and is returned as is.
+    """
+    if isinstance(data, bytes) and max_side is None:
+        return (data, None)
+    decoded = decode_image(path, data, max_side)
+    if isinstance(data, bytes) and decoded.scaled.scale_x == 1.0 and decoded.scaled.scale_y == 1.0:
+        return (data, None)
+    exif = Image.Exif()
+    if decoded.orientation != 1:
+        exif[ExifTags.Base.Orientation] = decoded.orientation
+    buffer = io.BytesIO()
+    decoded.scaled.image.save(buffer, format="jpeg", quality=quality, exif=exif)
+    return (buffer.getvalue(), decoded)
+
+
+_DecodedKey = t.Tuple[str, t.Optional[int], t.Optional[t.Tuple[t.Any, ...]]]
+_DECODED: collections.OrderedDict[_DecodedKey, DecodedImage] = collections.OrderedDict()
+
+
+def _data_key(data: t.Optional[ImageData]) -> t.Optional[t.Tuple[t.Any, ...]]:
+    """Identifies image data, requests can send the same file in different sizes, e.g. downscaled for text"""
+    if data is None:
+        return None
+    if isinstance(data, bytes):
+        return (len(data), hashlib.blake2b(data, digest_size=16).digest())
+    if isinstance(data, SharedScaledImage):
+        return (data.size, data.scale_x, data.scale_y)
+    return (data.image.size, data.scale_x, data.scale_y)
+
+
+def decode_image_cached(path: PathWithMd5, data: t.Optional[ImageData], pts: t.Optional[int]) -> DecodedImage:
+    """Like `decode_image`, but reuses recently decoded image of the same md5, video frame and data"""
+    key = (path.md5, pts, _data_key(data))
+    decoded = _DECODED.get(key)
+    if decoded is not None:
+        _DECODED.move_to_end(key)
+        return decoded
+    decoded = decode_image(path, data)
+    _DECODED[key] = decoded
+    while len(_DECODED) > _DECODED_CACHE_SIZE:
+        _DECODED.popitem(last=False)
+    return decoded
+
+
+class ScaledVideoFrame(t.NamedTuple):
+    image: ScaledImage
+    pts: int
+
+
+def _extract_video_frames(
+    path: str, frame_each_seconds: int, number_of_frames: int
+) -> t.List[ScaledVideoFrame]:
+    return [
+        ScaledVideoFrame(
+            ScaledImage(frame.image.convert("RGB"), 1.0, 1.0).resized(DECODE_MAX_SIDE), frame.pts
+        )
+        for frame in get_video_frames(path, frame_each_seconds, number_of_frames)
+    ]
+
+
+class VideoFrameExtractor:
+    """
+    Extracts frames of each video once and shares them between annotators in memory. Frames of recent
+    videos are kept, concurrent requests for the same video wait for the same extraction.
+    """
+
+    def __init__(self, cache_size: int = _VIDEO_FRAMES_CACHE_SIZE) -> None:
+        self._cache_size = cache_size
+        self._frames: collections.OrderedDict[
+            t.Tuple[str, int, int], asyncio.Future[t.List[ScaledVideoFrame]]
+        ] = collections.OrderedDict()
+
+    async def get(
+        self, path: PathWithMd5, frame_each_seconds: int, number_of_frames: int
+    ) -> t.List[ScaledVideoFrame]:
+        key = (path.md5, frame_each_seconds, number_of_frames)
+        frames = self._frames.get(key)
+        if frames is not None:
+            self._frames.move_to_end(key)
+            return await asyncio.shield(frames)
+        frames = asyncio.ensure_future(
+            asyncio.get_running_loop().run_in_executor(
+                None, _extract_video_frames, path.path, frame_each_seconds, number_of_frames
+            )
+        )
+        self._frames[key] = frames
+        while len(self._frames) > self._cache_size:
+            self._frames.popitem(last=False)
+        try:
+            return await asyncio.shield(frames)
+        except Exception:
+            # Do not cache failures, file might be still being written
+            if self._frames.get(key) is frames:
+                del self._frames[key]
+            raise
+
+
+def _close_pool(pool: cfut.ProcessPoolExecutor) -> None:
+    pool.shutdown(wait=False, cancel_futures=False)
+
+
+def _warm_up(functions: t.Sequence[t.Callable[[], None]]) -> None:
+    # Failure here would break the pool, models are loaded again on first request instead
+    for function in functions:
+        try:
+            function()
+        # pylint: disable-next = broad-exception-caught
+        except Exception as e:
+            log_error(e, "Unable to warm up", function.__name__)
+
+
+def _start_pool(workers: int, warm_up: t.Sequence[t.Callable[[], None]]) -> cfut.ProcessPoolExecutor:
+    # pylint: disable-next = consider-using-with
+    pool = cfut.ProcessPoolExecutor(max_workers=workers, initializer=_warm_up, initargs=(warm_up,))
+    # Processes are started by first tasks, start them right away, so that models are loaded in background
+    for _ in range(workers):
+        pool.submit(int)
+    return pool
+
+
+def image_models_pool(
+    workers: int = 1,
+    warm_up: t.Sequence[t.Callable[[], None]] = (),
+    keep_alive: t.Optional[t.Callable[[], bool]] = None,
+) -> Lazy[cfut.ProcessPoolExecutor]:
+    """
+    Processes for models processing images, decoded images are cached in them. Each process runs `warm_up`
+    functions when it starts. Pool is freed after 20 minutes without use, unless `keep_alive` returns True.
+    """
+    return Lazy(
+        lambda: _start_pool(workers, warm_up),
+        ttl=datetime.timedelta(seconds=20 * 60),
+        destructor=_close_pool,
+        keep_alive=keep_alive,
+    )
+
+
+def fit_to_memory_budget(pools: t.List[t.Tuple[int, int]], budget_mb: t.Optional[int]) -> t.List[int]:
+    """
+    Reduces number of workers of pools, given as (workers, memory of one worker in MB), until they fit into
+    the budget. Pool with largest memory is reduced first, each pool keeps at least one worker.
+    """
+    workers = [max(1, w) for w, _ in pools]
+    if budget_mb is None:
+        return workers
+    memory = [m for _, m in pools]
+    while sum(w * m for w, m in zip(workers, memory)) > budget_mb:
+        reducible = [i for i, w in enumerate(workers) if w > 1]
+        if not reducible:
+            break
+        largest = max(reducible, key=lambda i: workers[i] * memory[i])
+        workers[largest] -= 1
+    return workers
@@ -1,11 +1,124 @@
+import asyncio
+import concurrent.futures as cfut
 import hashlib
+import os
+import typing as t
 
 from pphoto.data_model.base import PathWithMd5
+from pphoto.db.md5_cache_table import FileStat, Md5CacheTable
+
+_BLOCK_SIZE = 1024 * 1024
 
 
 def compute_md5(path: str) -> PathWithMd5:
-    with open(path, "rb") as f:
-        md5 = hashlib.md5()
-        for x in f:
-            md5.update(x)
-        return PathWithMd5(path, md5.hexdigest())
+    # hashlib releases GIL for large updates, so this can run in threads
+    md5 = hashlib.md5()
+    buffer = bytearray(_BLOCK_SIZE)
+    view = memoryview(buffer)
+    with open(path, "rb", buffering=0) as f:
+        while read := f.readinto(buffer):
+            md5.update(view[:read])
+    return PathWithMd5(path, md5.hexdigest())
+
+
+def file_stat(path: str) -> FileStat:
+    stat = os.stat(path)
+    return FileStat(stat.st_size, stat.st_mtime_ns, stat.st_ino)
+
+
+def _missing_paths(paths: t.List[str]) -> t.List[str]:
+    return [path for path in paths if not os.path.exists(path)]
+
+
+class Md5Hasher:
+    """Computes md5 of files, reusing md5 of files with unchanged path, size, mtime and inode."""
+
+    def __init__(self, cache: t.Optional[Md5CacheTable], workers: int = 4) -> None:
+        self._cache = cache
+        self._pool = cfut.ThreadPoolExecutor(max_workers=workers, thread_name_prefix="md5")
+
+    def compute(self, path: str) -> PathWithMd5:
+        try:
+            stat = file_stat(path)
+            cached = self._get_cached(path, stat)
+            if cached is not None:
+                return cached
+            return self._add(compute_md5(path), stat)
+        except FileNotFoundError:
+            self.forget(path)
+            raise
+
+    async def compute_async(self, path: str) -> PathWithMd5:
+        computed = await self.compute_many([path])
+        if not computed:
+            raise FileNotFoundError(path)
+        return computed[0]
+
+    async def compute_many(self, paths: t.List[str]) -> t.List[PathWithMd5]:
+        """
+        Hashes files without cached md5 in thread pool, cache is accessed only from this thread. Files that
+        disappeared are skipped.
+        """
+        loop = asyncio.get_running_loop()
+        stats: t.List[t.Optional[FileStat]] = []
+        for path in paths:
+            try:
+                stats.append(file_stat(path))
+            except FileNotFoundError:
+                self.forget(path)
+                stats.append(None)
+        out: t.List[t.Optional[PathWithMd5]] = [
+            None if s is None else self._get_cached(p, s) for p, s in zip(paths, stats)
+        ]
+        missing = [i for i, x in enumerate(out) if x is None and stats[i] is not None]
+        computed = await asyncio.gather(
+            *(loop.run_in_executor(self._pool, compute_md5, paths[i]) for i in missing),
+            return_exceptions=True,
+        )
+        for i, path_with_md5 in zip(missing, computed):
+            if isinstance(path_with_md5, FileNotFoundError):
+                self.forget(paths[i])
+            elif isinstance(path_with_md5, BaseException):
+                raise path_with_md5
+            else:
+                out[i] = self._add(path_with_md5, t.cast(FileStat, stats[i]))
+        return [x for x in out if x is not None]
+
+    def forget(self, path: str) -> None:
+        """Drops cached md5 of removed file"""
+        if self._cache is not None:
+            self._cache.remove(path)
+
+    def moved(self, old_path: str, new_path: str) -> None:
+        if self._cache is not None:
+            self._cache.move(old_path, new_path)
+
+    async def remove_missing(self, chunk_size: int = 1000) -> int:
+        """
+        Drops cached md5 of files that no longer exist, returns their count. Goes over the cache in chunks and
+        checks files in thread pool, so it can run in background on large libraries.
+        """
+        if self._cache is None:
+            return 0
+        loop = asyncio.get_running_loop()
+        removed = 0
+        after = ""
+        while paths := self._cache.paths(after, chunk_size):
+            missing = await loop.run_in_executor(self._pool, _missing_paths, paths)
+            self._cache.remove_many(missing)
+            removed += len(missing)
+            after = paths[-1]
+        return removed
+
+    def _get_cached(self, path: str, stat: FileStat) -> t.Optional[PathWithMd5]:
+        if self._cache is None:
+            return None
+        md5 = self._cache.get(path, stat)
+        if md5 is None:
+            return None
+        return PathWithMd5(path, md5)
+
+    def _add(self, path_with_md5: PathWithMd5, stat: FileStat) -> PathWithMd5:
+        if self._cache is not None:
+            self._cache.add(path_with_md5.path, stat, path_with_md5.md5)
+        return path_with_md5
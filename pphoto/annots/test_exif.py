@@ -0,0 +1,43 @@
+import typing as t
+import unittest
+from unittest import mock
+
+from pphoto.annots.exif import Exif
+from pphoto.data_model.base import PathWithMd5
+from pphoto.db.types import NoCache
+
+
+def exif_with_mocked_exiftool() -> t.Tuple[Exif, mock.MagicMock]:
+    with mock.patch("exiftool.ExifToolHelper") as helper:
+        return (Exif(NoCache()), helper.return_value)
+
+
+def tags(path: str, model: str) -> t.Dict[str, t.Any]:
+    return {"SourceFile": path, "MakerNotes:SamsungModel": model}
+
+
+class TestProcessVideos(unittest.TestCase):
+    def test_results_are_matched_by_path(self) -> None:
+        exif, exiftool = exif_with_mocked_exiftool()
+        inps = [PathWithMd5("dir/a.mp4", "M1"), PathWithMd5("dir/b.mp4", "M2")]
+        exiftool.get_metadata.return_value = [tags("dir/b.mp4", "B"), tags("./dir/a.mp4", "A")]
+        got = exif.process_videos_impl(inps)
+        self.assertEqual([x.md5 for x in got], ["M1", "M2"])
+        self.assertEqual([x.p.camera.model if x.p else None for x in got], ["a", "b"])
+
+    def test_missing_result_falls_back_to_single_files(self) -> None:
+        exif, exiftool = exif_with_mocked_exiftool()
+        inps = [PathWithMd5("a.mp4", "M1"), PathWithMd5("b.mp4", "M2")]
+        results = {"a.mp4": [tags("a.mp4", "A")], "b.mp4": []}
+        exiftool.get_metadata.side_effect = lambda paths, params: (
+            [tags("a.mp4", "A")] if len(paths) > 1 else results[paths[0]]
+        )
+        got = exif.process_videos_impl(inps)
+        self.assertEqual(exiftool.get_metadata.call_count, 3)
+        self.assertIsNotNone(got[0].p)
+        self.assertIsNone(got[1].p)
+        self.assertIsNotNone(got[1].e)
+
+
+if __name__ == "__main__":
+    unittest.main()
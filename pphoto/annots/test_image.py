@@ -0,0 +1,153 @@
+import asyncio
+import concurrent.futures as cfut
+import io
+import typing as t
+import unittest
+from unittest import mock
+
+from PIL import ExifTags, Image
+
+from pphoto.annots.image import (
+    ScaledImage,
+    ScaledVideoFrame,
+    SharedScaledImage,
+    VideoFrameExtractor,
+    decode_image,
+    decode_image_cached,
+    encode_downscaled,
+    fit_to_memory_budget,
+    shared_image_data,
+)
+from pphoto.data_model.base import PathWithMd5
+
+
+def jpeg(width: int, height: int, orientation: int = 1) -> bytes:
+    exif = Image.Exif()
+    exif[ExifTags.Base.Orientation] = orientation
+    buffer = io.BytesIO()
+    Image.new(mode="RGB", size=(width, height)).save(buffer, format="jpeg", exif=exif)
+    return buffer.getvalue()
+
+
+class TestDecodeImage(unittest.TestCase):
+    def test_small_image_is_not_scaled(self) -> None:
+        decoded = decode_image(PathWithMd5("a.jpg", "M1"), jpeg(300, 200))
+        self.assertEqual(decoded.scaled.image.size, (300, 200))
+        self.assertEqual(decoded.scaled.original_size(), (300, 200))
+        self.assertEqual(decoded.scaled.box_to_original([1, 2, 3, 4]), [1, 2, 3, 4])
+
+    def test_large_image_is_decoded_in_reduced_size(self) -> None:
+        decoded = decode_image(PathWithMd5("a.jpg", "M1"), jpeg(4000, 3000), max_side=1000)
+        self.assertEqual(decoded.scaled.image.size, (1000, 750))
+        self.assertEqual(decoded.scaled.original_size(), (4000, 3000))
+        self.assertEqual(decoded.scaled.box_to_original([10, 20, 30, 40]), [40, 80, 120, 160])
+        self.assertEqual(decoded.scaled.box_from_original([40, 80, 120, 160]), [10, 20, 30, 40])
+        self.assertEqual(decoded.scaled.crop_original([0, 0, 400, 200]).size, (100, 50))
+        small = decoded.scaled.resized(100)
+        self.assertEqual(small.image.size, (100, 75))
+        self.assertEqual(small.original_size(), (4000, 3000))
+
+    def test_transposed_by_orientation(self) -> None:
+        decoded = decode_image(PathWithMd5("a.jpg", "M1"), jpeg(4000, 2000, orientation=6), max_side=1000)
+        self.assertEqual(decoded.orientation, 6)
+        transposed = decoded.transposed()
+        self.assertEqual(transposed.image.size, (500, 1000))
+        self.assertEqual(transposed.original_size(), (2000, 4000))
+        self.assertEqual(transposed.to_original(100, 100), (400, 400))
+
+
+class TestDecodeImageCached(unittest.TestCase):
+    def test_same_md5_in_different_sizes(self) -> None:
+        path = PathWithMd5("a.jpg", "M-cached")
+        original = jpeg(4000, 3000)
+        # Remote annotator gets smaller image for text models than for faces
+        (text_data, _) = encode_downscaled(path, original, 1024)
+        (face_data, _) = encode_downscaled(path, original, 2048)
+        self.assertEqual(decode_image_cached(path, text_data, None).scaled.image.size, (1024, 768))
+        face = decode_image_cached(path, face_data, None)
+        self.assertEqual(face.scaled.image.size, (2048, 1536))
+        self.assertEqual(face.scaled.original_size(), (2048, 1536))
+        self.assertIs(decode_image_cached(path, face_data, None), face)
+
+
+class TestEncodeDownscaled(unittest.TestCase):
+    def test_small_image_is_sent_as_is(self) -> None:
+        data = jpeg(300, 200)
+        self.assertEqual(encode_downscaled(PathWithMd5("a.jpg", "M1"), data, 1000), (data, None))
+
+    def test_encoded_image_keeps_orientation_and_maps_to_original(self) -> None:
+        path = PathWithMd5("a.jpg", "M1")
+        (data, sent) = encode_downscaled(path, jpeg(4000, 2000, orientation=6), 1000)
+        assert sent is not None
+        received = decode_image(path, data)
+        self.assertEqual(received.orientation, 6)
+        self.assertEqual(received.scaled.image.size, (1000, 500))
+        # Worker returns coordinates in the rotated received image
+        transposed = sent.transposed()
+        self.assertEqual(received.transposed().image.size, transposed.image.size)
+        self.assertEqual(transposed.original_size(), (2000, 4000))
+        self.assertEqual(transposed.box_to_original([10, 20, 30, 40]), [40, 80, 120, 160])
+
+    def test_video_frame_is_encoded_with_its_scale(self) -> None:
+        frame = ScaledImage(Image.new(mode="RGB", size=(2000, 1000)), 2.0, 2.0)
+        (data, sent) = encode_downscaled(PathWithMd5("a.mp4", "M1"), frame, None)
+        assert sent is not None
+        self.assertEqual(decode_image(PathWithMd5("a.mp4", "M1"), data).scaled.image.size, (2000, 1000))
+        self.assertEqual(sent.scaled.original_size(), (4000, 2000))
+        (data, sent) = encode_downscaled(PathWithMd5("a.mp4", "M1"), frame, 1000)
+        assert sent is not None
+        self.assertEqual(decode_image(PathWithMd5("a.mp4", "M1"), data).scaled.image.size, (1000, 500))
+        self.assertEqual(sent.scaled.original_size(), (4000, 2000))
+
+
+class TestSharedImageData(unittest.TestCase):
+    def test_pool_process_attaches_to_shared_pixels(self) -> None:
+        path = PathWithMd5("a.mp4", "M1")
+        frame = ScaledImage(Image.new(mode="RGB", size=(300, 200), color=(1, 2, 3)), 2.0, 3.0)
+        with shared_image_data(frame) as shared:
+            assert isinstance(shared, SharedScaledImage)
+            with cfut.ProcessPoolExecutor(max_workers=1) as pool:
+                decoded = pool.submit(decode_image, path, shared, None).result()
+        self.assertEqual(decoded.scaled.image.getpixel((10, 10)), (1, 2, 3))
+        self.assertEqual(decoded.scaled.original_size(), (600, 600))
+        # Memory is released after the context
+        with self.assertRaises(FileNotFoundError):
+            decode_image(path, shared, None)
+
+    def test_encoded_data_is_passed_as_is(self) -> None:
+        data = jpeg(10, 10)
+        with shared_image_data(data) as shared:
+            self.assertIs(shared, data)
+
+
+class TestVideoFrameExtractor(unittest.IsolatedAsyncioTestCase):
+    async def test_extracts_each_video_once(self) -> None:
+        calls: t.List[str] = []
+
+        def extract(path: str, _frame_each_seconds: int, _number_of_frames: int) -> t.List[ScaledVideoFrame]:
+            calls.append(path)
+            return [ScaledVideoFrame(ScaledImage(Image.new(mode="RGB", size=(10, 10)), 1.0, 1.0), 0)]
+
+        extractor = VideoFrameExtractor(cache_size=1)
+        with mock.patch("pphoto.annots.image._extract_video_frames", extract):
+            (first, second) = await asyncio.gather(
+                extractor.get(PathWithMd5("a.mp4", "M1"), 3, 10),
+                extractor.get(PathWithMd5("a.mp4", "M1"), 3, 10),
+            )
+            self.assertIs(first, second)
+            await extractor.get(PathWithMd5("b.mp4", "M2"), 3, 10)
+            await extractor.get(PathWithMd5("a.mp4", "M1"), 3, 10)
+        self.assertEqual(calls, ["a.mp4", "b.mp4", "a.mp4"])
+
+
+class TestFitToMemoryBudget(unittest.TestCase):
+    def test_reduces_largest_pool_first(self) -> None:
+        self.assertEqual(fit_to_memory_budget([(4, 3000), (2, 500)], None), [4, 2])
+        self.assertEqual(fit_to_memory_budget([(4, 3000), (2, 500)], 10000), [3, 2])
+        self.assertEqual(fit_to_memory_budget([(4, 3000), (4, 500)], 4000), [1, 2])
+        # Each pool keeps one worker even over budget
+        self.assertEqual(fit_to_memory_budget([(2, 3000), (2, 500)], 1000), [1, 1])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,85 @@
+import asyncio
+import hashlib
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+from pphoto.annots.md5 import Md5Hasher, compute_md5, file_stat
+from pphoto.db.connection import PhotosConnection
+from pphoto.db.md5_cache_table import Md5CacheTable
+
+
+def write(path: str, data: bytes, mtime_ns: int) -> None:
+    with open(path, "wb") as f:
+        f.write(data)
+    os.utime(path, ns=(mtime_ns, mtime_ns))
+
+
+class TestMd5Hasher(unittest.TestCase):
+    def setUp(self) -> None:
+        self.directory = tempfile.TemporaryDirectory()  # pylint: disable = consider-using-with
+        self.path = os.path.join(self.directory.name, "a.jpg")
+        self.cache = Md5CacheTable(PhotosConnection(":memory:"))
+        self.hasher = Md5Hasher(self.cache, workers=1)
+
+    def tearDown(self) -> None:
+        self.directory.cleanup()
+
+    def test_unchanged_file_is_not_hashed_again(self) -> None:
+        write(self.path, b"foo", 10**9)
+        with mock.patch("pphoto.annots.md5.compute_md5", side_effect=compute_md5) as compute:
+            self.assertEqual(self.hasher.compute(self.path).md5, hashlib.md5(b"foo").hexdigest())
+            self.assertEqual(self.hasher.compute(self.path).md5, hashlib.md5(b"foo").hexdigest())
+            self.assertEqual(
+                asyncio.run(self.hasher.compute_async(self.path)).md5, hashlib.md5(b"foo").hexdigest()
+            )
+        self.assertEqual(compute.call_count, 1)
+
+    def test_modified_file_is_hashed_again(self) -> None:
+        write(self.path, b"foo", 10**9)
+        self.hasher.compute(self.path)
+        write(self.path, b"bar", 2 * 10**9)
+        self.assertEqual(self.hasher.compute(self.path).md5, hashlib.md5(b"bar").hexdigest())
+        self.assertEqual(self.cache.get(self.path, file_stat(self.path)), hashlib.md5(b"bar").hexdigest())
+
+    def test_disappeared_file(self) -> None:
+        other = os.path.join(self.directory.name, "b.jpg")
+        write(self.path, b"foo", 10**9)
+        write(other, b"bar", 10**9)
+        stat = file_stat(self.path)
+        self.hasher.compute(self.path)
+        os.remove(self.path)
+        computed = asyncio.run(self.hasher.compute_many([self.path, other]))
+        self.assertEqual([x.path for x in computed], [other])
+        self.assertIsNone(self.cache.get(self.path, stat))
+        with self.assertRaises(FileNotFoundError):
+            self.hasher.compute(self.path)
+        with self.assertRaises(FileNotFoundError):
+            asyncio.run(self.hasher.compute_async(self.path))
+
+    def test_moved_file_keeps_md5(self) -> None:
+        moved = os.path.join(self.directory.name, "b.jpg")
+        write(self.path, b"foo", 10**9)
+        self.hasher.compute(self.path)
+        os.rename(self.path, moved)
+        self.hasher.moved(self.path, moved)
+        with mock.patch("pphoto.annots.md5.compute_md5") as compute:
+            self.assertEqual(self.hasher.compute(moved).md5, hashlib.md5(b"foo").hexdigest())
+        compute.assert_not_called()
+
+    def test_remove_missing_in_chunks(self) -> None:
+        paths = [os.path.join(self.directory.name, f"{i}.jpg") for i in range(5)]
+        for path in paths:
+            write(path, b"foo", 10**9)
+            self.hasher.compute(path)
+        stat = file_stat(paths[0])
+        os.remove(paths[0])
+        os.remove(paths[3])
+        self.assertEqual(asyncio.run(self.hasher.remove_missing(chunk_size=2)), 2)
+        self.assertEqual(self.cache.paths("", 10), [paths[1], paths[2], paths[4]])
+        self.assertIsNone(self.cache.get(paths[0], stat))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,80 @@
+import io
+import typing as t
+import unittest
+from types import SimpleNamespace
+
+from PIL import Image
+
+from pphoto.annots.text import Models
+from pphoto.data_model.base import PathWithMd5
+from pphoto.data_model.text import Box, BoxClassification, Classification
+from pphoto.db.types import NoCache
+from pphoto.utils import Lazy
+
+
+def image_data(width: int) -> bytes:
+    buffer = io.BytesIO()
+    Image.new(mode="RGB", size=(width, 10)).save(buffer, format="png")
+    return buffer.getvalue()
+
+
+def captioner(source: t.List[Image.Image]) -> t.Any:
+    return [[{"generated_text": f"width {image.size[0]}"}] for image in source]
+
+
+def predict(source: t.List[Image.Image], verbose: bool) -> t.Any:
+    del verbose
+    # Image of width 20 has single box
+    return [
+        SimpleNamespace(
+            names={0: "cat"},
+            boxes=(
+                [SimpleNamespace(cls=[0], conf=[0.5], xyxy=[[0.0, 0.0, 5.0, 5.0]])]
+                if image.size[0] == 20
+                else []
+            ),
+        )
+        for image in source
+    ]
+
+
+def classify(source: t.List[Image.Image], verbose: bool) -> t.Any:
+    del verbose
+    return [
+        SimpleNamespace(
+            names={0: "tabby", 1: "dog"}, probs=SimpleNamespace(top5=[0, 1], top5conf=[0.9, 0.05])
+        )
+        for _ in source
+    ]
+
+
+class TestModels(unittest.TestCase):
+    def test_process_image_batch_impl_keeps_order(self) -> None:
+        models = Models(NoCache(), None)
+        # pylint: disable = protected-access
+        models._captioner = Lazy(lambda: captioner)
+        models._predict_model = Lazy(lambda: predict)
+        models._classify_model = Lazy(lambda: classify)
+        video = PathWithMd5("video.mp4", "M1")
+        image = PathWithMd5("image.jpg", "M2")
+        results = models.process_image_batch_impl(
+            [(video, image_data(10), 1), (video, image_data(20), 2), (image, image_data(30), None)], 0.2, 0.1
+        )
+        self.assertEqual([x.md5 for x in results], ["M1", "M1", "M2"])
+        payloads = [x.p for x in results]
+        assert all(p is not None for p in payloads)
+        self.assertEqual(
+            [p.captions for p in payloads if p is not None], [["width 10"], ["width 20"], ["width 30"]]
+        )
+        self.assertEqual(
+            [p.boxes for p in payloads if p is not None][:2],
+            [
+                [],
+                [BoxClassification(Box("cat", 0.5, [0.0, 0.0, 5.0, 5.0], 2), [Classification("tabby", 0.9)])],
+            ],
+        )
+        self.assertEqual(models.process_image_batch_impl([], 0.2, 0.1), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,12 +1,10 @@
 from __future__ import annotations
 
 import asyncio
-import base64
 import concurrent.futures as cfut
+import contextlib
 import datetime
-import io
 import os
-import itertools
 import sys
 import traceback
 import typing as t
@@ -31,10 +29,20 @@ from pphoto.communication.types import (
     Error,
     RemoteAnnotatorRequest,
 )
-from pphoto.communication.server import RemoteExecutorQueue
+from pphoto.communication.scheduler import ExecutorLoad
+from pphoto.communication.server import RemoteExecutor, RemoteExecutors
+from pphoto.annots.image import (
+    ImageData,
+    ScaledImage,
+    VideoFrameExtractor,
+    decode_image_cached,
+    encode_downscaled,
+    image_models_pool,
+    shared_image_data,
+)
 from pphoto.utils import Lazy, assert_never
+from pphoto.utils.batcher import Batcher
 from pphoto.utils.files import supported_media_class, SupportedMediaClass
-from pphoto.utils.video import get_video_frames
 
 ImageFile.LOAD_TRUNCATED_IMAGES = True
 
@@ -71,9 +79,8 @@ def image_endpoint(models: Models, image: TextAnnotationRequest) -> ImageClassif
 
 
 async def fetch_ann(
-    queue: RemoteExecutorQueue, request: TextAnnotationRequest
+    annotator: RemoteExecutor, request: TextAnnotationRequest
 ) -> WithMD5[ImageClassification]:
-    annotator = await queue.get()
     response = await annotator(RemoteAnnotatorRequest(request))
     if response.error is not None:
         raise response.error
@@ -127,43 +134,89 @@ def image_to_text_model() -> PipelineProtocol:
     return t.cast(PipelineProtocol, ret)
 
 
-def _close_pool(pool: cfut.ProcessPoolExecutor) -> None:
-    pool.shutdown(wait=False, cancel_futures=False)
+_POOL_MODELS = Lazy(lambda: Models(NoCache(), remote=None))
 
 
-_POOL_MODELS = Lazy(lambda: Models(NoCache(), remote=None))
+def warm_up_pool_models() -> None:
+    """Loads models in pool process, used when the process starts"""
+    _POOL_MODELS.get().load()
+
+
+# Captioner squashes image to 384x384, so shorter side should not be smaller
+_CAPTION_MAX_SIDE = 768
+# Default input size of YOLO models
+_DETECT_MAX_SIDE = 640
+# Latency of remote and local executors is tracked by kind of request
+_REQUEST_KIND = "TextAnnotationRequest"
+# Images sent to remote workers, larger than model inputs, so that crops of detected boxes keep some detail
+_REMOTE_MAX_SIDE = 1024
+
+# Path, image data (None to read path), pts of video frame
+ImageInput = t.Tuple[PathWithMd5, t.Optional[ImageData], t.Optional[int]]
+# Image input, gap threshold, discard threshold
+_ImageRequest = t.Tuple[ImageInput, float, float]
 
 
-def _process_image_in_pool(
-    path: PathWithMd5,
-    data: t.Optional[bytes],
-    pts: t.Optional[int],
+def _process_images_in_pool(
+    inputs: t.List[ImageInput],
     gap_threshold: float,
     discard_threshold: float,
-) -> WithMD5[ImageClassification]:
-    return list(
-        _POOL_MODELS.get().process_image_batch_impl(
-            ((x, data, pts) for x in [path]), gap_threshold, discard_threshold
-        )
-    )[0]
+) -> t.List[WithMD5[ImageClassification] | Exception]:
+    models = _POOL_MODELS.get()
+    try:
+        return list(models.process_image_batch_impl(inputs, gap_threshold, discard_threshold))
+    # pylint: disable-next = broad-exception-caught
+    except Exception:
+        if len(inputs) == 1:
+            raise
+    # Some image in batch is broken, process them one by one, so that only broken ones fail
+    out: t.List[WithMD5[ImageClassification] | Exception] = []
+    for inp in inputs:
+        try:
+            out.extend(models.process_image_batch_impl([inp], gap_threshold, discard_threshold))
+        # pylint: disable-next = broad-exception-caught
+        except Exception as e:
+            out.append(e)
+    return out
 
 
 class Models:
-    def __init__(self, cache: Cache[ImageClassification], remote: t.Optional[RemoteExecutorQueue]) -> None:
+    """
+    Image captioning and object detection. Local requests are collected into batches of up to `batch_size`
+    images, waiting at most `batch_max_wait` for the batch to fill, and processed together in the pool.
+    """
+
+    def __init__(
+        self,
+        cache: Cache[ImageClassification],
+        remote: t.Optional[RemoteExecutors],
+        batch_size: int = 1,
+        batch_max_wait: datetime.timedelta = datetime.timedelta(milliseconds=50),
+        pool: t.Optional[Lazy[cfut.ProcessPoolExecutor]] = None,
+        remote_downscale: bool = True,
+        pool_workers: int = 1,
+        video_frames: t.Optional[VideoFrameExtractor] = None,
+    ) -> None:
+        """
+        Pool can be shared with other image models, so that image decoded once is reused by them, it has
+        `pool_workers` processes. With `remote_downscale`, images are downscaled before they are sent to
+        remote workers. Video frames extractor can be shared too, so that each video is decoded once.
+        """
+        self._video_frames = VideoFrameExtractor() if video_frames is None else video_frames
         self._cache = cache
+        self._remote_downscale = remote_downscale
         self._predict_model = Lazy(lambda: yolo_model("yolov8x.pt"))
         self._classify_model = Lazy(lambda: yolo_model("yolov8x-cls.pt"))
         self._captioner = Lazy(image_to_text_model)
         self._version = ImageClassification.current_version()
-        ttl = datetime.timedelta(seconds=20 * 60)
-        self._pool = Lazy(
-            # pylint: disable-next = consider-using-with
-            lambda: cfut.ProcessPoolExecutor(max_workers=1),
-            ttl=ttl,
-            destructor=_close_pool,
-        )
+        self._pool = image_models_pool() if pool is None else pool
         self._remote = remote
-        self._last_remote_request = datetime.datetime.now()
+        # Whole batch is processed at once by each process, so local pool can take that many requests
+        local_capacity = batch_size * pool_workers
+        self._local = ExecutorLoad(local_capacity) if remote is None else remote.executor_load(local_capacity)
+        self._batcher: Batcher[_ImageRequest, WithMD5[ImageClassification] | Exception] = Batcher(
+            self._process_batch_in_pool, batch_size, batch_max_wait
+        )
 
     def load(self) -> None:
         image = [Image.new(mode="RGB", size=(200, 200))]
@@ -171,15 +224,6 @@ class Models:
         self._classify_model.get()(image, verbose=False)
         self._captioner.get()(image)
 
-    def _remote_can_be_available(self) -> bool:
-        if self._remote is None:
-            return False
-        if not self._remote.empty():
-            return True
-        if datetime.datetime.now() - self._last_remote_request < datetime.timedelta(seconds=300):
-            return True
-        return False
-
     async def process_file(
         self: Models,
         path: PathWithMd5,
@@ -221,18 +265,11 @@ class Models:
     ) -> WithMD5[ImageClassification]:
 
         annotations = []
-        for frame in get_video_frames(
-            path.path,
-            frame_each_seconds=frame_each_seconds,
-            number_of_frames=number_of_frames,
-        ):
+        for frame in await self._video_frames.get(path, frame_each_seconds, number_of_frames):
             # Intentionally doing this in serial, as otherwise we might fire too much annotation request (from each worker)
             # and overwhelm the system
-            buffer = io.BytesIO(b"")
-            frame.image.save(buffer, format="jpeg")
-            data = buffer.getvalue()
             annotations.append(
-                await self._process_image(path, data, frame.pts, gap_threshold, discard_threshold)
+                await self._process_image(path, frame.image, frame.pts, gap_threshold, discard_threshold)
             )
 
         processed = []
@@ -254,144 +291,159 @@ class Models:
             Error("NothingErrorOrSuccessWhileProcessingVideo", None, None),
         )
 
+    async def _process_image_remote(
+        self: Models,
+        worker: RemoteExecutor,
+        path: PathWithMd5,
+        data: t.Optional[ImageData],
+        pts: t.Optional[int],
+        gap_threshold: float,
+        discard_threshold: float,
+    ) -> WithMD5[ImageClassification]:
+        if data is None:
+            with open(path.path, "rb") as f:
+                data = f.read()
+        (sent_data, decoded) = await asyncio.get_running_loop().run_in_executor(
+            None, encode_downscaled, path, data, _REMOTE_MAX_SIDE if self._remote_downscale else None
+        )
+        sent = None if decoded is None else decoded.scaled
+        ret = await asyncio.wait_for(
+            fetch_ann(
+                worker,
+                TextAnnotationRequest(
+                    "TextAnnotationRequest", path, pts, gap_threshold, discard_threshold, data=sent_data
+                ),
+            ),
+            600,
+        )
+        if sent is not None and ret.p is not None:
+            _boxes_to_original(ret.p, sent)
+        return ret
+
     async def _process_image(
         self: Models,
         path: PathWithMd5,
-        data: t.Optional[bytes],
+        data: t.Optional[ImageData],
         pts: t.Optional[int],
         gap_threshold: float,
         discard_threshold: float,
     ) -> WithMD5[ImageClassification]:
         if data is None and os.path.getsize(path.path) > 100_000_000:
             return WithMD5(path.md5, self._version, None, Error("SkippingHugeFile", None, None))
-        if self._remote is not None and self._remote_can_be_available():
+        worker = None
+        if self._remote is not None:
+            worker = await self._remote.acquire(_REQUEST_KIND, self._local)
+        if worker is not None:
             try:
-                if data is None:
-                    with open(path.path, "rb") as f:
-                        data = base64.encodebytes(f.read())
-                else:
-                    data = base64.encodebytes(data)
-                ret = await asyncio.wait_for(
-                    fetch_ann(
-                        self._remote,
-                        TextAnnotationRequest(
-                            "TextAnnotationRequest",
-                            path,
-                            data.decode("utf-8"),
-                            pts,
-                            gap_threshold,
-                            discard_threshold,
-                        ),
-                    ),
-                    600,
-                )
-                self._last_remote_request = datetime.datetime.now()
-                return ret
+                with worker.load.track(_REQUEST_KIND):
+                    return await self._process_image_remote(
+                        worker, path, data, pts, gap_threshold, discard_threshold
+                    )
             # pylint: disable-next = bare-except
             except:
                 traceback.print_exc()
-        p = await asyncio.get_running_loop().run_in_executor(
-            self._pool.get(), _process_image_in_pool, path, data, pts, gap_threshold, discard_threshold
-        )
-        return p
+        with self._local.track(_REQUEST_KIND):
+            processed = await self._batcher.process(((path, data, pts), gap_threshold, discard_threshold))
+        if isinstance(processed, Exception):
+            raise processed
+        return processed
+
+    async def _process_batch_in_pool(
+        self, requests: t.List[_ImageRequest]
+    ) -> t.List[WithMD5[ImageClassification] | Exception]:
+        loop = asyncio.get_running_loop()
+        by_thresholds: t.Dict[t.Tuple[float, float], t.List[int]] = {}
+        for index, (_inp, gap_threshold, discard_threshold) in enumerate(requests):
+            by_thresholds.setdefault((gap_threshold, discard_threshold), []).append(index)
+        out: t.List[WithMD5[ImageClassification] | Exception] = [
+            Exception("Missing result of batch") for _ in requests
+        ]
+        for (gap_threshold, discard_threshold), indices in by_thresholds.items():
+            with contextlib.ExitStack() as stack:
+                inputs: t.List[ImageInput] = []
+                for i in indices:
+                    (path, data, pts) = requests[i][0]
+                    inputs.append((path, stack.enter_context(shared_image_data(data)), pts))
+                results = await loop.run_in_executor(
+                    self._pool.get(), _process_images_in_pool, inputs, gap_threshold, discard_threshold
+                )
+            for index, result in zip(indices, results):
+                out[index] = result
+        return out
 
     def process_image_data(
         self,
         request: TextAnnotationRequest,
     ) -> WithMD5[ImageClassification]:
-        return list(
-            self.process_image_batch_impl(
-                [(request.path, base64.decodebytes(request.data_base64.encode("utf-8")), request.pts)],
-                request.gap_threshold,
-                request.discard_threshold,
-            )
+        return self.process_image_batch_impl(
+            [(request.path, request.data, request.pts)],
+            request.gap_threshold,
+            request.discard_threshold,
         )[0]
 
     def process_image_batch_impl(
         self: Models,
-        paths: t.Iterable[t.Tuple[PathWithMd5, t.Optional[bytes], t.Optional[int]]],
+        inputs: t.Iterable[ImageInput],
         gap_threshold: float,
         discard_threshold: float,
-    ) -> t.Iterable[WithMD5[ImageClassification]]:
-        images = [
-            (path, Image.open(path.path) if data is None else Image.open(io.BytesIO(data)), pts)
-            for path, data, pts in paths
-        ]
-        captions = self._captioner.get()([image for (_, image, _) in images])
-        results = self._predict_model.get()([img for (_, img, _) in images], verbose=False)
-        boxes_to_classify = []
-        all_input = list(zip(images, results, captions))
-        for (path, image, pts), result, caption in all_input:
+    ) -> t.List[WithMD5[ImageClassification]]:
+        """
+        Processes images in single call of each model, returns results in the same order as inputs. Each
+        model gets image downscaled to its input size, boxes are in pixels of the original image.
+        """
+        images = [(path, decode_image_cached(path, data, pts).scaled, pts) for path, data, pts in inputs]
+        if not images:
+            return []
+        captions = self._captioner.get()([image.resized(_CAPTION_MAX_SIDE).image for (_, image, _) in images])
+        detect_images = [image.resized(_DETECT_MAX_SIDE) for (_, image, _) in images]
+        results = self._predict_model.get()([x.image for x in detect_images], verbose=False)
+        boxes_to_classify: t.List[t.Tuple[int, ScaledImage, Box]] = []
+        for index, ((_path, image, pts), detect_image, result) in enumerate(
+            zip(images, detect_images, results)
+        ):
             names = result.names
-            for box_id, box in enumerate(result.boxes):
+            for box in result.boxes:
                 classification = names[int(box.cls[0])]
                 confidence = float(box.conf[0])
-                xyxy = list(float(x) for x in box.xyxy[0])
-                boxes_to_classify.append(
-                    (
-                        path,
-                        image,
-                        box_id,
-                        caption,
-                        Box(classification, confidence, xyxy, pts),
-                    )
-                )
+                xyxy = detect_image.box_to_original([float(x) for x in box.xyxy[0]])
+                boxes_to_classify.append((index, image, Box(classification, confidence, xyxy, pts)))
 
+        classified = []
         if boxes_to_classify:
-            results = list(
-                zip(
-                    boxes_to_classify,
-                    self._classify_model.get()(
-                        [
-                            image.crop(
-                                (
-                                    int(box.xyxy[0]),
-                                    int(box.xyxy[1]),
-                                    int(box.xyxy[2]),
-                                    int(box.xyxy[3]),
-                                )
-                            )
-                            for (_, image, _, _, box) in boxes_to_classify
-                        ],
-                        verbose=False,
-                    ),
-                )
+            classified = self._classify_model.get()(
+                [image.crop_original(box.xyxy) for (_, image, box) in boxes_to_classify],
+                verbose=False,
             )
-        else:
-            results = []
-
-        visited = set()
-        for path, group in itertools.groupby(results, lambda x: t.cast(PathWithMd5, x[0][0])):
-            visited.add(path.path)
-            box_class = []
-            captions = set()
-            for (_, _image, box_id, caption, box), result in group:
-                for c in caption:
-                    gt = c.get("generated_text")
-                    if gt is not None:
-                        captions.add(remove_consecutive_words(gt))
-                names = result.names
-                classifications = []
-                prev_conf = 0.0
-                for index, conf in zip(result.probs.top5, result.probs.top5conf):
-                    if conf < discard_threshold:
-                        continue
-                    if prev_conf - conf > gap_threshold:
-                        break
-                    prev_conf = conf
-                    classifications.append(Classification(names[index], float(conf)))
-                box_class.append(BoxClassification(box, classifications))
-            yield WithMD5(path.md5, self._version, ImageClassification(list(captions), box_class), None)
-        for (path, image, _), captions, _ in all_input:
-            if path.path in visited:
-                continue
-            visited.add(path.path)
-            captions = set()
+
+        box_classes: t.List[t.List[BoxClassification]] = [[] for _ in images]
+        for (index, _image, box), result in zip(boxes_to_classify, classified):
+            names = result.names
+            classifications = []
+            prev_conf = 0.0
+            for name_index, conf in zip(result.probs.top5, result.probs.top5conf):
+                if conf < discard_threshold:
+                    continue
+                if prev_conf - conf > gap_threshold:
+                    break
+                prev_conf = conf
+                classifications.append(Classification(names[name_index], float(conf)))
+            box_classes[index].append(BoxClassification(box, classifications))
+
+        out = []
+        for (path, _image, _pts), caption, box_class in zip(images, captions, box_classes):
+            texts = set()
             for c in caption:
                 gt = c.get("generated_text")
                 if gt is not None:
-                    captions.add(remove_consecutive_words(gt))
-            yield WithMD5(path.md5, self._version, ImageClassification(list(captions), []), None)
+                    texts.add(remove_consecutive_words(gt))
+            out.append(WithMD5(path.md5, self._version, ImageClassification(list(texts), box_class), None))
+        return out
+
+
+def _boxes_to_original(classification: ImageClassification, image: ScaledImage) -> None:
+    """Maps boxes in pixels of downscaled image sent to remote worker to pixels of the original"""
+    for box_classification in classification.boxes:
+        box_classification.box.xyxy = image.box_to_original(box_classification.box.xyxy)
 
 
 def _merge_image_classifications_for_video(
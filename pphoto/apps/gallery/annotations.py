@@ -130,7 +130,7 @@ def location_tasks_recipes(
     location: LocationTypes,
     query: SearchQuery,
     db: ImageSqlDB,
-    all_images: Lazy[t.Tuple[t.List[ImageRow], bool]],
+    all_images: Lazy[t.Tuple[t.List[ImageRow], bool, t.Optional[str]]],
 ) -> t.Dict[str, ManualLocation]:
     location_tasks_recipe = {}
     if location.t == "FixedLocation":
@@ -158,7 +158,7 @@ def location_tasks_recipes(
         }
     elif location.t == "InterpolatedLocation":
         location_tasks_recipe = {}
-        omgs, _ = all_images.get()
+        omgs, _, _ = all_images.get()
         fwdbwd = forward_backward(omgs, DateWithLoc.from_image)
         for index, omg in enumerate(omgs):
             predicted_location = predict_location(omg, fwdbwd[index][0], fwdbwd[index][1])
@@ -179,12 +179,12 @@ def location_tasks_recipes(
 
 def date_tasks_recipes(
     date: DateTypes,
-    all_images: Lazy[t.Tuple[t.List[ImageRow], bool]],
+    all_images: Lazy[t.Tuple[t.List[ImageRow], bool, t.Optional[str]]],
 ) -> t.Dict[str, ManualDate]:
     transformed_date_recipe = {}
     if date.t == "TransDate":
         if date.adjust_dates:
-            omgs, _ = all_images.get()
+            omgs, _, _ = all_images.get()
             for omg in omgs:
                 if omg.date_transformed:
                     transformed_date_recipe[omg.md5] = ManualDate(omg.date)
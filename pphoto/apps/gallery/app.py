@@ -9,7 +9,9 @@ from PIL import ImageFile
 
 from fastapi import FastAPI, Request, Response
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import FileResponse
+from fastapi.responses import FileResponse, JSONResponse
+
+from pphoto.gallery.url import InvalidCursor
 
 from pphoto.utils import Lazy
 
@@ -56,6 +58,11 @@ async def log_metadata(request: Request, func: t.Callable[[Request], t.Awaitable
     return response
 
 
+@app.exception_handler(InvalidCursor)
+async def invalid_cursor(_request: Request, exc: InvalidCursor) -> JSONResponse:
+    return JSONResponse(status_code=400, content={"detail": str(exc)})
+
+
 @app.get("/index.html")
 @app.get("/")
 async def read_index() -> FileResponse:
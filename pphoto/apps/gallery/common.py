@@ -19,6 +19,7 @@ DB = Lazy(
         PhotosConnection(DBFilesConfig().photos_db, check_same_thread=False),
         GalleryConnection(DBFilesConfig().gallery_db, check_same_thread=False),
         JobsConnection(DBFilesConfig().jobs_db, check_same_thread=False),
+        DBFilesConfig().face_index,
     )
 )
 
@@ -91,14 +91,13 @@ def image_iterator(
     db: ImageSqlDB,
     query: SearchQuery,
 ) -> t.Iterable[t.Tuple[str, t.Optional[datetime], t.Optional[ImageAddress]]]:
-    page = 0
     paging = 1000
+    cursor = None
     has_next_page = True
     while has_next_page:
-        omgs, has_next_page = db.get_matching_images(
-            query, SortParams(SortBy.TIMESTAMP, SortOrder.ASC), GalleryPaging(page, paging)
+        omgs, has_next_page, cursor = db.get_matching_images(
+            query, SortParams(SortBy.TIMESTAMP, SortOrder.ASC), GalleryPaging(0, paging, cursor)
         )
-        page += 1
         for omg in omgs:
             filename = None
             for possible_filename in db.files(omg.md5):
@@ -9,6 +9,7 @@ from dataclasses import dataclass
 from fastapi import APIRouter
 
 from pphoto.data_model.face import Position
+from pphoto.db.face_index import FaceDistance
 from pphoto.data_model.manual import ManualIdentity, IdentitySkipReason
 from pphoto.db.types_location import LocationCluster, LocPoint, LocationBounds
 from pphoto.db.types_date import DateCluster, DateClusterGroupBy
@@ -134,12 +135,13 @@ class ImageResponse:
     has_next_page: bool
     omgs: t.List[ImageWithMeta]
     some_location: ManualLocation | None
+    next_cursor: t.Optional[str]
 
 
 @router.post("/images")
 async def image_page(params: GalleryRequest) -> ImageResponse:
     images = []
-    omgs, has_next_page = DB.get().get_matching_images(params.query, params.sort, params.paging)
+    omgs, has_next_page, next_cursor = DB.get().get_matching_images(params.query, params.sort, params.paging)
     fwdbwd = forward_backward(omgs, DateWithLoc.from_image)
 
     some_location = None
@@ -165,7 +167,7 @@ async def image_page(params: GalleryRequest) -> ImageResponse:
                 paths,
             )
         )
-    return ImageResponse(has_next_page, images, some_location)
+    return ImageResponse(has_next_page, images, some_location, next_cursor)
 
 
 @router.post("/directories")
@@ -196,7 +198,10 @@ class FaceWithMeta:
     extension: str
     identity: t.Optional[str]
     skip_reason: t.Optional[IdentitySkipReason]
-    embedding: t.List[float]
+    # None when embeddings were not requested
+    embedding: t.Optional[t.List[float]]
+    # Precomputed by face clustering job, None for faces that were not clustered yet
+    cluster: t.Optional[int] = None
 
 
 @dataclass
@@ -206,16 +211,23 @@ class FacesResponse:
     top_identities: t.List[IdentityRowPayload]
 
 
+@dataclass
+class FacesRequest(GalleryRequest):
+    include_embeddings: bool = True
+
+
 @router.post("/faces")
-async def faces_on_page(params: GalleryRequest) -> FacesResponse:
+async def faces_on_page(params: FacesRequest) -> FacesResponse:
     faces = []
     db = DB.get()
-    omgs, has_next_page = db.get_matching_images(params.query, params.sort, params.paging)
+    omgs, has_next_page, _ = db.get_matching_images(params.query, params.sort, params.paging)
     top_idents = db.identities.top_identities(100)
+    md5s = [omg.md5 for omg in omgs]
+    clusters = db.get_face_clusters(md5s)
+    faces_with_identities = db.get_faces_with_identities(md5s)
 
     for omg in omgs:
-        fcs = db.get_face_embeddings(omg.md5)
-        identities = db.get_manual_identities(omg.md5)
+        (fcs, identities) = faces_with_identities[omg.md5]
         if identities is not None:
             ident_dct = {
                 identity.position: identity.identity
@@ -239,12 +251,78 @@ async def faces_on_page(params: GalleryRequest) -> FacesResponse:
                         omg.extension,
                         ident_dct.get(face.position),
                         skip_dct.get(face.position),
-                        face.embedding,
+                        face.embedding if params.include_embeddings else None,
+                        clusters.get((omg.md5, face.position)),
                     )
                 )
     return FacesResponse(has_next_page, faces, top_idents)
 
 
+@dataclass
+class SimilarFacesRequest:
+    md5: str
+    position: Position
+    limit: int = 20
+    distance: FaceDistance = "l2"
+
+
+@dataclass
+class SimilarFace:
+    position: Position
+    md5: str
+    extension: str
+    identity: t.Optional[str]
+    distance: float
+
+
+@dataclass
+class IdentitySuggestion:
+    identity: str
+    distance: float
+    faces: int
+
+
+@dataclass
+class SimilarFacesResponse:
+    faces: t.List[SimilarFace]
+    suggestions: t.List[IdentitySuggestion]
+
+
+@router.post("/faces/similar")
+async def similar_faces(params: SimilarFacesRequest) -> SimilarFacesResponse:
+    db = DB.get()
+    fcs = db.get_face_embeddings(params.md5)
+    embedding = None
+    if fcs is not None:
+        embedding = next((face.embedding for face in fcs.faces if face.position == params.position), None)
+    if embedding is None:
+        return SimilarFacesResponse([], [])
+    matches = [
+        match
+        for match in db.face_index.search(embedding, params.limit + 1, params.distance)
+        if match.md5 != params.md5 or match.position != params.position
+    ][: params.limit]
+    md5s = list({match.md5 for match in matches})
+    extensions = db.get_extensions(md5s)
+    identities = {
+        (md5, x.position): x.identity
+        for md5, manual in db.get_many_manual_identities(md5s).items()
+        for x in manual.identities
+        if x.identity is not None
+    }
+    faces = []
+    suggestions: t.Dict[str, IdentitySuggestion] = {}
+    for match in matches:
+        identity = identities.get((match.md5, match.position))
+        faces.append(
+            SimilarFace(match.position, match.md5, extensions.get(match.md5, "jpg"), identity, match.distance)
+        )
+        if identity is not None:
+            suggestion = suggestions.setdefault(identity, IdentitySuggestion(identity, match.distance, 0))
+            suggestion.faces += 1
+    return SimilarFacesResponse(faces, sorted(suggestions.values(), key=lambda x: x.distance))
+
+
 @dataclass
 class FaceFeatureRequest:
     md5: str
@@ -1,9 +1,12 @@
 import argparse
 import asyncio
 import json
+import os
+import socket
 import sys
 import traceback
 import typing as t
+from datetime import timedelta
 
 import asyncinotify
 import tqdm
@@ -11,24 +14,34 @@ import tqdm
 from pphoto.data_model.base import PathWithMd5
 from pphoto.data_model.config import Config, DBFilesConfig
 from pphoto.data_model.manual import ManualIdentity
+from pphoto.db.directory_snapshots_table import DirectorySnapshotsTable
+from pphoto.db.annotation_status_table import AnnotationStatusTable
+from pphoto.db.face_index import FaceIndex
 from pphoto.db.features_table import FeaturesTable
 from pphoto.db.connection import PhotosConnection, GalleryConnection, JobsConnection
 from pphoto.db.files_table import FilesTable
 from pphoto.db.identity_table import IdentityTable
-from pphoto.db.queries import PhotosQueries
+from pphoto.db.md5_cache_table import Md5CacheTable
+from pphoto.db.work_queue_table import WorkQueueTable
 from pphoto.annots.annotator import Annotator
+from pphoto.annots.md5 import Md5Hasher
 from pphoto.annots.date import PathDateExtractor
 from pphoto.communication.server import start_image_server_loop, ImportDirectory, RefreshJobs
 from pphoto.remote_jobs.types import TaskId, RemoteTask, ManualAnnotationTask, RemoteJobType
 from pphoto.remote_jobs.db import RemoteJobsTable
 from pphoto.file_mgmt.jobs import Jobs, JobType, IMPORT_PRIORITY, DEFAULT_PRIORITY, REALTIME_PRIORITY
 from pphoto.file_mgmt.queues import Queues, Queue
+from pphoto.gallery.face_clusters import FaceClusterer
 from pphoto.gallery.reindexer import Reindexer
-from pphoto.utils import assert_never, Lazy
+from pphoto.utils import assert_never, batched, Lazy
 from pphoto.utils.alive import Alive
-from pphoto.utils.files import get_paths, expand_vars_in_path
+from pphoto.utils.files import DirectorySnapshot, get_changed_paths, get_paths, expand_vars_in_path
 from pphoto.utils.progress_bar import ProgressBar
-from pphoto.communication.server import RemoteExecutorQueue, start_annotation_remote_worker_loop
+from pphoto.communication.server import RemoteExecutors, start_annotation_remote_worker_loop
+from pphoto.communication.scheduler import ComputeScheduler
+
+
+HASH_BATCH_SIZE = 64
 
 
 class GlobalContext:
@@ -36,6 +49,7 @@ class GlobalContext:
         self,
         jobs: Jobs,
         files: FilesTable,
+        directory_snapshots: DirectorySnapshotsTable,
         remote_jobs: RemoteJobsTable,
         queues: Queues,
     ) -> None:
@@ -43,6 +57,7 @@ class GlobalContext:
         self.jobs = jobs
         self.remote_jobs = remote_jobs
         self.files = files
+        self.directory_snapshots = directory_snapshots
 
 
 @Alive(persistent=True, key=[0])
@@ -51,16 +66,17 @@ async def worker(name: str, context: GlobalContext, queue: Queue, /) -> None:
         # Get a "work item" out of the queue.
         item = await queue.get()
         path, type_ = item.payload
+        released = False
         try:
             if type_ == JobType.CHEAP_FEATURES:
                 assert isinstance(path, PathWithMd5)
-                context.jobs.cheap_features(path, recompute_location=False)
+                await context.jobs.cheap_features(path, recompute_location=False)
             elif type_ == JobType.IMAGE_TO_TEXT:
                 assert isinstance(path, PathWithMd5)
                 await context.jobs.image_to_text(path)
             elif type_ == JobType.ADD_MANUAL_ANNOTATION:
                 if isinstance(path, RemoteTask) and isinstance(path.payload, ManualAnnotationTask):
-                    context.jobs.add_manual_annotation(path)
+                    await context.jobs.add_manual_annotation(path)
                 else:
                     assert False, "Wrong type for ADD_MANUAL_ANNOTATION"
             elif type_ == JobType.FACE_CLUSTER_ANNOTATION:
@@ -90,6 +106,11 @@ async def worker(name: str, context: GlobalContext, queue: Queue, /) -> None:
                     assert False, "Wrong type for FACE_CLUSTER_ANNOTATION"
             else:
                 assert_never(type_)
+        except asyncio.CancelledError:
+            # Item was not processed, it will be claimed again
+            released = True
+            queue.release(item)
+            raise
         # pylint: disable-next = broad-exception-caught
         except Exception as e:
             traceback.print_exc()
@@ -97,11 +118,12 @@ async def worker(name: str, context: GlobalContext, queue: Queue, /) -> None:
             if isinstance(path, PathWithMd5):
                 context.queues.mark_failed(path)
         finally:
-            # Notify the queue that the "work item" has been processed.
-            context.queues.get_progress_bar(type_, item.priority).update(1)
-            queue.task_done()
-            # So that we gave up place for other workers too
-            await asyncio.sleep(0.001)
+            if not released:
+                # Notify the queue that the "work item" has been processed.
+                context.queues.get_progress_bar(type_, item.priority).update(1)
+                queue.task_done(item)
+                # So that we gave up place for other workers too
+                await asyncio.sleep(0.001)
 
 
 @Alive(persistent=True, key=[0])
@@ -165,7 +187,7 @@ async def inotify_worker(name: str, dirs: t.List[str], context: GlobalContext, /
                 continue
             try:
                 path = event.path.absolute().resolve().as_posix()
-                path_with_md5 = context.jobs.get_path_with_md5_to_enqueue(path, can_add=True)
+                path_with_md5 = await context.jobs.get_path_with_md5_to_enqueue(path, can_add=True)
                 if path_with_md5 is None:
                     continue
                 context.queues.enqueue_path_skipped_known(path_with_md5, REALTIME_PRIORITY)
@@ -182,23 +204,53 @@ async def reingest_directories_worker(context: GlobalContext, config: Config, /)
     while True:
         await context.queues.cheap_features.join()
         found_something = False
-        for path in get_paths(config.input_patterns, config.input_directories):
-            if context.files.by_path(path) is not None:
-                continue
-            path_with_md5 = context.jobs.get_path_with_md5_to_enqueue(path, can_add=True)
-            if path_with_md5 is None:
-                continue
-            context.queues.enqueue_path_skipped_known(path_with_md5, DEFAULT_PRIORITY)
-            total_for_reingest += 1
-            if total_for_reingest % 1000 == 0:
-                await asyncio.sleep(0.001)
-            found_something = True
+        snapshots = context.directory_snapshots.get_all()
+        new_snapshots: t.Dict[str, DirectorySnapshot] = {}
+        changed_paths = get_changed_paths(
+            config.input_patterns, config.input_directories, snapshots, new_snapshots
+        )
+        for chunk in batched(changed_paths, HASH_BATCH_SIZE):
+            known = context.files.known_paths(chunk)
+            paths = [path for path in chunk if path not in known]
+            await context.jobs.hash_files(paths)
+            for path in paths:
+                path_with_md5 = await context.jobs.get_path_with_md5_to_enqueue(path, can_add=True)
+                if path_with_md5 is None:
+                    continue
+                context.queues.enqueue_path_skipped_known(path_with_md5, DEFAULT_PRIORITY)
+                total_for_reingest += 1
+                if total_for_reingest % 1000 == 0:
+                    await asyncio.sleep(0.001)
+                found_something = True
+        # Stored only after whole scan, so interrupted scan is repeated
+        context.directory_snapshots.replace_all(new_snapshots)
         if found_something:
             context.queues.update_progress_bars()
         # Check for new features once every 8 hours
         await asyncio.sleep(3600 * 8)
 
 
+@Alive(persistent=False, key=[])
+async def enqueue_unannotated_files(context: GlobalContext, /) -> None:
+    # Queues are persistent, so workers can continue with previous items while this runs
+    await asyncio.sleep(0.001)
+    progress = tqdm.tqdm(desc="Enqueuing unannotated files")
+    for actions in context.jobs.find_unannotated_files():
+        for action in actions:
+            context.queues.enqueue_path(
+                [(action.path_with_md5, t) for t in action.job_types], action.priority
+            )
+        progress.update(len(actions))
+        await asyncio.sleep(0.001)
+    progress.close()
+    context.queues.update_progress_bars()
+
+
+@Alive(persistent=False, key=[])
+async def prune_md5_cache(context: GlobalContext, /) -> None:
+    await context.jobs.prune_md5_cache()
+
+
 @Alive(persistent=True, key=[])
 async def managed_worker_and_import_worker(
     context: GlobalContext, queue: asyncio.Queue[ImportDirectory], /
@@ -213,9 +265,11 @@ async def managed_worker_and_import_worker(
                 progress_bar.get().add_to_total(len(paths))
                 progress_bar.get().update_total()
             enqueued = False
-            for path in paths:
+            for index, path in enumerate(paths):
                 try:
-                    action = context.jobs.import_file(path, import_command.mode)
+                    if index % HASH_BATCH_SIZE == 0:
+                        await context.jobs.hash_files(paths[index : index + HASH_BATCH_SIZE])
+                    action = await context.jobs.import_file(path, import_command.mode)
                     if action is not None:
                         enqueued = True
                         context.queues.enqueue_path(
@@ -266,6 +320,21 @@ async def reindex_gallery(reindexer: Reindexer, /) -> None:
         await asyncio.sleep(sleep_time)
 
 
+@Alive(persistent=True, key=[])
+async def cluster_faces(clusterer: FaceClusterer, /) -> None:
+    # Allow other tasks to start
+    await asyncio.sleep(0.001)
+    while True:
+        try:
+            # Clusterer has its own connection, so that it does not block other tasks
+            await asyncio.get_running_loop().run_in_executor(None, clusterer.update)
+        # pylint: disable-next = broad-exception-caught
+        except Exception as e:
+            traceback.print_exc()
+            print("Error while clustering faces:", e)
+        await asyncio.sleep(60)
+
+
 # pylint: disable-next = too-many-statements
 async def main() -> None:
     files_config = DBFilesConfig()
@@ -274,12 +343,76 @@ async def main() -> None:
     parser.add_argument("--db", default=files_config.photos_db, type=str)
     parser.add_argument("--remote-annotator-port", default=8001, type=int)
     parser.add_argument("--image-to-text-workers", default=3, type=int)
+    parser.add_argument(
+        "--image-to-text-batch-size",
+        default=4,
+        type=int,
+        help="Max number of images captioned and classified together by local models",
+    )
+    parser.add_argument(
+        "--image-to-text-batch-wait-ms",
+        default=100,
+        type=int,
+        help="Max time image waits for other images to fill the batch",
+    )
+    parser.add_argument(
+        "--text-model-workers",
+        default=1,
+        type=int,
+        help="Processes with captioning and detection models, with 1 text and face workers they share process",
+    )
+    parser.add_argument("--face-model-workers", default=1, type=int, help="Processes with face models")
+    parser.add_argument(
+        "--model-memory-budget-mb",
+        default=None,
+        type=int,
+        help="Max memory of model processes, number of workers is reduced to fit into it",
+    )
+    parser.add_argument(
+        "--no-remote-downscale",
+        dest="remote_downscale",
+        action="store_false",
+        help="Send original images to remote annotators, instead of downscaling them to sizes used by models",
+    )
+    parser.add_argument("--hash-workers", default=4, type=int, help="Number of threads computing md5")
+    parser.add_argument(
+        "--cheap-features-workers",
+        default=4,
+        type=int,
+        help="Number of processes extracting exif and dimensions, 0 extracts them in this process",
+    )
+    parser.add_argument(
+        "--reindex-workers",
+        default=0,
+        type=int,
+        help="Number of processes computing gallery index, 0 computes it in this process",
+    )
+    parser.add_argument(
+        "--write-batch-size",
+        default=1000,
+        type=int,
+        help="Number of writes to photos db committed together, 1 commits every write",
+    )
+    parser.add_argument(
+        "--write-batch-seconds",
+        default=1.0,
+        type=float,
+        help="Max age of not yet committed write to photos db",
+    )
     args = parser.parse_args()
     config = Config.load(args.config)
-    photos_connection = PhotosConnection(args.db)
+    photos_connection = PhotosConnection(
+        args.db, batch_size=args.write_batch_size, batch_max_age=timedelta(seconds=args.write_batch_seconds)
+    )
     gallery_connection = GalleryConnection(files_config.gallery_db)
     jobs_connection = JobsConnection(files_config.jobs_db)
-    reindexer = Reindexer(PathDateExtractor(config.directory_matching), photos_connection, gallery_connection)
+    queues = Queues(WorkQueueTable(jobs_connection), f"{socket.gethostname()}:{os.getpid()}")
+    reindexer = Reindexer(
+        PathDateExtractor(config.directory_matching),
+        photos_connection,
+        gallery_connection,
+        workers=args.reindex_workers,
+    )
     features = FeaturesTable(photos_connection)
     files = FilesTable(photos_connection)
     identities = IdentityTable(photos_connection)
@@ -289,45 +422,82 @@ async def main() -> None:
         while True:
             photos_connection.check_unused()
             reindexer.check_unused()
+            queues.renew_leases()
             Lazy.check_ttl()
             await asyncio.sleep(10)
 
+    @Alive(persistent=True, key=[])
+    async def flush_old_writes() -> None:
+        # Batched writes should not keep write transaction open when there are no further writes
+        while True:
+            wait = photos_connection.flush_old()
+            await asyncio.sleep(max(wait.total_seconds(), 0.01))
+
     import_queue: asyncio.Queue[ImportDirectory] = asyncio.Queue()
     refresh_queue: asyncio.Queue[RefreshJobs] = asyncio.Queue()
     await start_image_server_loop(refresh_queue, import_queue, "data/unix-domain-socket")
-    remote_annotator_queue: RemoteExecutorQueue = asyncio.Queue()
-    await start_annotation_remote_worker_loop(remote_annotator_queue, args.remote_annotator_port)
+    remote_executors: RemoteExecutors = ComputeScheduler()
+    await start_annotation_remote_worker_loop(remote_executors, args.remote_annotator_port)
 
     tasks = []
     tasks.append(asyncio.create_task(check_db_connection()))
+    tasks.append(asyncio.create_task(flush_old_writes()))
     tasks.append(asyncio.create_task(reindex_gallery(reindexer)))
 
     annotator = Annotator(
-        config.directory_matching, files_config, features, identities, remote_annotator_queue
+        config.directory_matching,
+        files_config,
+        features,
+        identities,
+        remote_executors,
+        cheap_features_workers=args.cheap_features_workers,
+        image_to_text_batch_size=args.image_to_text_batch_size,
+        image_to_text_batch_wait=timedelta(milliseconds=args.image_to_text_batch_wait_ms),
+        remote_downscale=args.remote_downscale,
+        text_model_workers=args.text_model_workers,
+        face_model_workers=args.face_model_workers,
+        model_memory_budget_mb=args.model_memory_budget_mb,
+        # Models are kept loaded while there are images to process, not only while they are used
+        models_keep_alive=lambda: queues.image_to_text.pending() > 0,
+        face_index=FaceIndex(photos_connection, files_config.face_index),
     )
+    clusters_connection = PhotosConnection(args.db, check_same_thread=False)
+    clusterer = FaceClusterer(clusters_connection, FaceIndex(clusters_connection, files_config.face_index))
+    tasks.append(asyncio.create_task(cluster_faces(clusterer)))
     remote_jobs_table = RemoteJobsTable(jobs_connection)
-    jobs = Jobs(config.managed_folder, files, remote_jobs_table, PhotosQueries(photos_connection), annotator)
-    queues = Queues()
-    context = GlobalContext(jobs, files, remote_jobs_table, queues)
+    jobs = Jobs(
+        config.managed_folder,
+        files,
+        remote_jobs_table,
+        AnnotationStatusTable(photos_connection),
+        annotator,
+        Md5Hasher(Md5CacheTable(photos_connection), workers=args.hash_workers),
+    )
+    context = GlobalContext(
+        jobs, files, DirectorySnapshotsTable(photos_connection), remote_jobs_table, queues
+    )
 
     # Fix inconsistencies in the DB before we start.
     context.jobs.fix_in_progress_moved_files_at_startup()
     context.jobs.fix_imported_files_at_startup()
 
-    unannotated = context.jobs.find_unannotated_files()
-    for action in tqdm.tqdm(unannotated, desc="Enqueuing unannotated files"):
-        context.queues.enqueue_path([(action.path_with_md5, t) for t in action.job_types], action.priority)
-    del unannotated
-    context.queues.update_progress_bars()
+    context.queues.add_pending_to_progress_bars()
+    if queues.image_to_text.pending() > 0:
+        annotator.warm_up_models()
 
     # Starting async tasks
+    tasks.append(asyncio.create_task(enqueue_unannotated_files(context)))
+    tasks.append(asyncio.create_task(prune_md5_cache(context)))
     tasks.append(asyncio.create_task(manual_annotation_worker("manual-annotation", refresh_queue, context)))
     tasks.append(asyncio.create_task(managed_worker_and_import_worker(context, import_queue)))
     tasks.append(asyncio.create_task(reingest_directories_worker(context, config)))
-    for i in range(1):
+    # Each worker waits for the pool. There are more of them than processes, so that pool is busy and
+    # concurrent videos are batched into one exiftool call.
+    for i in range(max(1, 4 * args.cheap_features_workers)):
         task = asyncio.create_task(worker(f"worker-cheap-{i}", context, queues.cheap_features))
         tasks.append(task)
-    for i in range(args.image_to_text_workers):
+    # Enough concurrent workers to fill the batch
+    for i in range(max(args.image_to_text_workers, args.image_to_text_batch_size * args.text_model_workers)):
         task = asyncio.create_task(worker(f"worker-image-to-text-{i}", context, queues.image_to_text))
         tasks.append(task)
     tasks.append(asyncio.create_task(inotify_worker("watch-files", config.watched_directories, context)))
@@ -340,6 +510,8 @@ async def main() -> None:
             task.cancel()
         # Wait until all worker tasks are cancelled.
         await asyncio.gather(*tasks, return_exceptions=True)
+        queues.close()
+        photos_connection.flush()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,38 @@
+import argparse
+import asyncio
+import os
+
+from pphoto.annots.date import PathDateExtractor
+from pphoto.data_model.config import Config, DBFilesConfig
+from pphoto.db.connection import PhotosConnection, GalleryConnection
+from pphoto.gallery.reindexer import Reindexer
+from pphoto.utils.progress_bar import ProgressBar
+
+
+async def main() -> None:
+    files_config = DBFilesConfig()
+    parser = argparse.ArgumentParser(prog="Gallery reindexer")
+    parser.add_argument("--config", default="config.yaml", type=str)
+    parser.add_argument("--db", default=files_config.photos_db, type=str)
+    parser.add_argument("--gallery-db", default=files_config.gallery_db, type=str)
+    parser.add_argument("--workers", default=os.cpu_count() or 1, type=int)
+    parser.add_argument("--batch-size", default=100, type=int)
+    parser.add_argument("--all", action="store_true", help="Reindex all images, not only changed ones")
+    args = parser.parse_args()
+    config = Config.load(args.config)
+    reindexer = Reindexer(
+        PathDateExtractor(config.directory_matching),
+        PhotosConnection(args.db),
+        GalleryConnection(args.gallery_db),
+        workers=args.workers,
+        batch_size=args.batch_size,
+    )
+    if args.all:
+        reindexer.enqueue_all()
+    progress_bar = ProgressBar("Reindexing gallery")
+    while await reindexer.load(progress=progress_bar) > 0:
+        pass
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
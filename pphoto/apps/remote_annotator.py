@@ -43,17 +43,21 @@ def annotator_func(request: RemoteAnnotatorRequest) -> ActualResponse:
         print("Remote annotator server request took", request.p.t, time.time() - start_time, file=sys.stderr)
 
 
-async def worker(_worker_id: int, host: str, port: int) -> None:
+async def worker(_worker_id: int, host: str, port: int, in_flight: int) -> None:
     tasks = []
     tasks.append(asyncio.create_task(check_db_connection()))
     tasks.append(
-        asyncio.create_task(async_compute_client_loop(annotator_func, RemoteAnnotatorRequest, host, port))
+        asyncio.create_task(
+            async_compute_client_loop(
+                annotator_func, RemoteAnnotatorRequest.from_frame, host, port, in_flight
+            )
+        )
     )
     await asyncio.gather(*tasks, return_exceptions=True)
 
 
-def worker_run(worker_id: int, host: str, port: int) -> None:
-    asyncio.run(worker(worker_id, host, port))
+def worker_run(worker_id: int, host: str, port: int, in_flight: int) -> None:
+    asyncio.run(worker(worker_id, host, port, in_flight))
 
 
 def main() -> None:
@@ -61,11 +65,19 @@ def main() -> None:
     parser.add_argument("--workers", type=int, default=4)
     parser.add_argument("--host", type=str, required=True)
     parser.add_argument("--port", type=int, default=8001)
+    parser.add_argument(
+        "--in-flight",
+        type=int,
+        default=2,
+        help="Requests sent to each worker at once, next ones are received while current one is processed",
+    )
     args = parser.parse_args()
     processes = []
     try:
         for i in range(args.workers):
-            processes.append(multiprocessing.Process(target=worker_run, args=(i, args.host, args.port)))
+            processes.append(
+                multiprocessing.Process(target=worker_run, args=(i, args.host, args.port, args.in_flight))
+            )
             processes[-1].start()
         for p in processes:
             p.join()
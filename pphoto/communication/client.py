@@ -1,10 +1,9 @@
 import asyncio
+import concurrent.futures as cfut
 import typing as t
 import sys
 
-# pylint: disable-next = unused-import
-from dataclasses_json import DataClassJsonMixin
-
+from pphoto.communication.frames import HELLO_REQUEST_ID, Frame, encode_hello, read_frame, write_frame
 from pphoto.communication.types import (
     SystemStatus,
     RefreshJobs,
@@ -54,15 +53,69 @@ async def request_response(request: ImageWatcherCommands, expected_type: t.Type[
         writer.close()
 
 
-Request = t.TypeVar("Request", bound="DataClassJsonMixin")
-Response = t.TypeVar("Response", bound="DataClassJsonMixin")
+Request = t.TypeVar("Request")
+
+
+async def _process_request(
+    func: t.Callable[[Request], ActualResponse],
+    request_parser: t.Callable[[bytes, bytes], Request],
+    frame: Frame,
+    writer: asyncio.StreamWriter,
+    executor: cfut.Executor,
+    drain_lock: asyncio.Lock,
+) -> None:
+    try:
+        request = request_parser(frame.header, frame.data)
+        response = await asyncio.get_running_loop().run_in_executor(executor, func, request)
+    # pylint: disable-next = broad-exception-caught
+    except Exception as e:
+        log_error(e, "Error while processing request")
+        response = ActualResponse.from_exception(e)
+    write_frame(writer, frame.request_id, response.to_json().encode("utf-8"))
+    async with drain_lock:
+        await writer.drain()
+
+
+async def _serve_connection(
+    func: t.Callable[[Request], ActualResponse],
+    request_parser: t.Callable[[bytes, bytes], Request],
+    reader: asyncio.StreamReader,
+    writer: asyncio.StreamWriter,
+    capacity: int,
+) -> None:
+    """
+    Serves requests until the connection is closed. Requests are computed one by one, but server can send up
+    to `capacity` requests, so next ones are received while current one is computed.
+    """
+    drain_lock = asyncio.Lock()
+    tasks: t.Set[asyncio.Task[None]] = set()
+    # Models are not thread safe, requests are computed one at a time outside of the event loop
+    executor = cfut.ThreadPoolExecutor(max_workers=1, thread_name_prefix="compute")
+    try:
+        write_frame(writer, HELLO_REQUEST_ID, encode_hello(capacity))
+        await writer.drain()
+        while True:
+            frame = await read_frame(reader)
+            task = asyncio.create_task(
+                _process_request(func, request_parser, frame, writer, executor, drain_lock)
+            )
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+    except asyncio.IncompleteReadError:
+        print("Disconnected", file=sys.stderr)
+    finally:
+        for task in tasks:
+            task.cancel()
+        executor.shutdown(wait=False, cancel_futures=True)
+        writer.close()
 
 
 async def async_compute_client_loop(
     func: t.Callable[[Request], ActualResponse],
-    request_parser: t.Type[Request],
+    request_parser: t.Callable[[bytes, bytes], Request],
     host: str,
     port: int,
+    capacity: int = 2,
 ) -> None:
     unable_to_connect_sleep = 1
     while True:
@@ -80,24 +133,7 @@ async def async_compute_client_loop(
                 unable_to_connect_sleep *= 2
                 unable_to_connect_sleep = min(unable_to_connect_sleep, 120)
                 continue
-            try:
-                line = await reader.read()
-                if not line.strip():
-                    # pylint: disable-next = broad-exception-raised
-                    raise Exception("Empty request")
-                request = request_parser.from_json(line)
-                response = func(request)
-                writer.write(response.to_json().encode("utf-8"))
-                writer.write_eof()
-                await writer.drain()
-            # pylint: disable-next = broad-exception-caught
-            except Exception as e:
-                log_error(e, "Error while processing request")
-                writer.write(ActualResponse.from_exception(e).to_json().encode("utf-8"))
-                writer.write_eof()
-                await writer.drain()
-            finally:
-                writer.close()
+            await _serve_connection(func, request_parser, reader, writer, capacity)
         # pylint: disable-next = broad-exception-caught
         except Exception as e:
             log_error(e, "Unexpected Error while processing request")
@@ -0,0 +1,56 @@
+import asyncio
+import json
+import struct
+import typing as t
+
+# Request id, length of json header, length of binary data
+_FRAME_PREFIX = struct.Struct("!QII")
+# Large videos are not sent to remote annotators, this is just a sanity check against garbage
+MAX_FRAME_DATA = 512 * 1024 * 1024
+# Request id of the first frame, which is sent by remote worker after it connects
+HELLO_REQUEST_ID = 0
+
+
+class FrameError(Exception):
+    pass
+
+
+class FramedRequest(t.Protocol):
+    def frame_header(self) -> bytes: ...
+
+    def frame_data(self) -> bytes: ...
+
+
+class Frame(t.NamedTuple):
+    request_id: int
+    header: bytes
+    data: bytes
+
+
+def write_frame(writer: asyncio.StreamWriter, request_id: int, header: bytes, data: bytes = b"") -> None:
+    """Writes whole frame to the buffer at once, so frames of concurrent requests are not interleaved."""
+    writer.write(_FRAME_PREFIX.pack(request_id, len(header), len(data)))
+    writer.write(header)
+    if data:
+        writer.write(data)
+
+
+async def read_frame(reader: asyncio.StreamReader) -> Frame:
+    """Raises `asyncio.IncompleteReadError` when connection is closed."""
+    request_id, header_len, data_len = _FRAME_PREFIX.unpack(await reader.readexactly(_FRAME_PREFIX.size))
+    if header_len + data_len > MAX_FRAME_DATA:
+        raise FrameError(f"Frame too large: {header_len} + {data_len} bytes")
+    header = await reader.readexactly(header_len)
+    data = await reader.readexactly(data_len) if data_len else b""
+    return Frame(request_id, header, data)
+
+
+def encode_hello(capacity: int) -> bytes:
+    return json.dumps({"capacity": capacity}).encode("utf-8")
+
+
+def decode_hello(header: bytes) -> int:
+    capacity = json.loads(header).get("capacity")
+    if not isinstance(capacity, int) or capacity < 1:
+        raise FrameError(f"Invalid capacity in hello {capacity}")
+    return capacity
@@ -0,0 +1,113 @@
+import asyncio
+import contextlib
+import time
+import typing as t
+
+# Weight of the newest request in rolling latency
+_LATENCY_SMOOTHING = 0.2
+# Latency recorded for failed requests, so that failing executors are avoided when there are other ones
+_FAILED_REQUEST_LATENCY = 60.0
+
+
+class ExecutorLoad:
+    """Requests in flight and rolling latency by request kind of one executor, local or remote"""
+
+    def __init__(self, capacity: int, on_free: t.Optional[t.Callable[[], None]] = None) -> None:
+        self.capacity = max(1, capacity)
+        self.in_flight = 0
+        self._latency: t.Dict[str, float] = {}
+        self._on_free = on_free
+
+    def latency(self, kind: str) -> t.Optional[float]:
+        return self._latency.get(kind)
+
+    def is_free(self) -> bool:
+        return self.in_flight < self.capacity
+
+    def expected_finish(self, kind: str) -> float:
+        """
+        Expected seconds until new request of given kind is finished. Executors without measured latency
+        are expected to be instant, so that each executor is tried.
+        """
+        return self._latency.get(kind, 0.0) * (self.in_flight + 1) / self.capacity
+
+    @contextlib.contextmanager
+    def track(self, kind: str) -> t.Iterator[None]:
+        self.in_flight += 1
+        start = time.monotonic()
+        latency = _FAILED_REQUEST_LATENCY
+        try:
+            yield
+            latency = time.monotonic() - start
+        finally:
+            self.in_flight -= 1
+            previous = self._latency.get(kind)
+            if previous is None:
+                self._latency[kind] = latency
+            else:
+                self._latency[kind] = previous + _LATENCY_SMOOTHING * (latency - previous)
+            if self._on_free is not None:
+                self._on_free()
+
+
+class RemoteWorker(t.Protocol):
+    load: ExecutorLoad
+    closed: bool
+
+
+Worker = t.TypeVar("Worker", bound=RemoteWorker)
+
+
+class ComputeScheduler(t.Generic[Worker]):
+    """
+    Routes requests to the executor, local or remote, that is expected to finish them first. Executor gets at
+    most its capacity of requests, when all are full, requests wait until some executor is free, so that
+    slow workers are not over-subscribed.
+    """
+
+    def __init__(self) -> None:
+        self._workers: t.List[Worker] = []
+        self._freed = asyncio.Event()
+
+    def _notify(self) -> None:
+        self._freed.set()
+
+    def executor_load(self, capacity: int) -> ExecutorLoad:
+        """Load of an executor, which wakes up requests waiting for free executor when request finishes"""
+        return ExecutorLoad(capacity, self._notify)
+
+    def add(self, worker: Worker) -> None:
+        self._workers.append(worker)
+        self._notify()
+
+    def remove(self, worker: Worker) -> None:
+        if worker in self._workers:
+            self._workers.remove(worker)
+        self._notify()
+
+    def workers(self) -> t.List[Worker]:
+        return list(self._workers)
+
+    def _pick(self, kind: str, local: ExecutorLoad) -> t.Tuple[bool, t.Optional[Worker]]:
+        free = [w for w in self._workers if not w.closed and w.load.is_free()]
+        best = min(free, key=lambda w: w.load.expected_finish(kind), default=None)
+        if best is not None and (
+            not local.is_free() or best.load.expected_finish(kind) <= local.expected_finish(kind)
+        ):
+            return (True, best)
+        if local.is_free():
+            return (True, None)
+        return (False, None)
+
+    async def acquire(self, kind: str, local: ExecutorLoad) -> t.Optional[Worker]:
+        """
+        Waits for free executor expected to finish request first, returns remote worker or None for local
+        executor. Caller has to start tracking the request on returned executor's load before it awaits
+        anything, otherwise other requests could take the same slot.
+        """
+        while True:
+            self._freed.clear()
+            (found, worker) = self._pick(kind, local)
+            if found:
+                return worker
+            await self._freed.wait()
@@ -1,9 +1,17 @@
+from __future__ import annotations
+
 import asyncio
 import typing as t
 
-# pylint: disable-next = unused-import
-from dataclasses_json import DataClassJsonMixin
-
+from pphoto.communication.frames import (
+    HELLO_REQUEST_ID,
+    FrameError,
+    FramedRequest,
+    decode_hello,
+    read_frame,
+    write_frame,
+)
+from pphoto.communication.scheduler import ComputeScheduler
 from pphoto.communication.types import (
     SystemStatus,
     RefreshJobs,
@@ -15,7 +23,7 @@ from pphoto.communication.types import (
     ActualResponse,
     RemoteAnnotatorRequest,
 )
-from pphoto.utils import assert_never
+from pphoto.utils import assert_never, log_error
 from pphoto.utils.alive import get_state
 from pphoto.utils.progress_bar import get_bars
 
@@ -61,42 +69,98 @@ async def start_image_server_loop(
     )
 
 
-Request = t.TypeVar("Request", bound="DataClassJsonMixin")
+Request = t.TypeVar("Request", bound=FramedRequest)
 
 
 class ConnectedComputeResouce(t.Generic[Request]):
+    """
+    Persistent connection to remote worker, which accepts up to `capacity` requests at once. Worker is in
+    the scheduler while it's connected, callers track requests on its `load`.
+    """
+
     def __init__(
         self,
         reader: asyncio.StreamReader,
         writer: asyncio.StreamWriter,
+        scheduler: ComputeScheduler[ConnectedComputeResouce[Request]],
+        capacity: int,
     ) -> None:
         self._reader = reader
         self._writer = writer
+        self._scheduler = scheduler
+        self.load = scheduler.executor_load(capacity)
+        self.closed = False
+        self._next_request_id = HELLO_REQUEST_ID + 1
+        self._pending: t.Dict[int, asyncio.Future[ActualResponse]] = {}
+        self._drain_lock = asyncio.Lock()
+
+    async def serve(self) -> None:
+        """Reads responses until the connection is closed, then fails requests that are still pending."""
+        self._scheduler.add(self)
+        try:
+            while True:
+                frame = await read_frame(self._reader)
+                future = self._pending.get(frame.request_id)
+                if future is not None and not future.done():
+                    future.set_result(ActualResponse.from_json(frame.header))
+        except asyncio.IncompleteReadError:
+            pass
+        # pylint: disable-next = broad-exception-caught
+        except Exception as e:
+            log_error(e, "Error while reading from remote worker")
+        finally:
+            self.closed = True
+            self._scheduler.remove(self)
+            self._writer.close()
+            for future in self._pending.values():
+                if not future.done():
+                    # pylint: disable-next = broad-exception-raised
+                    future.set_exception(Exception("Connection to remote worker closed"))
 
     async def __call__(self, request: Request) -> ActualResponse:
+        request_id = self._next_request_id
+        self._next_request_id += 1
+        future: asyncio.Future[ActualResponse] = asyncio.get_running_loop().create_future()
+        self._pending[request_id] = future
         try:
-            self._writer.write(request.to_json().encode("utf-8"))
-            self._writer.write_eof()
-            await self._writer.drain()
-            line = await self._reader.read()
-            if not line.strip():
+            if self.closed:
                 # pylint: disable-next = broad-exception-raised
-                raise Exception("Empty response")
-            return ActualResponse.from_json(line)
+                raise Exception("Connection to remote worker closed")
+            write_frame(self._writer, request_id, request.frame_header(), request.frame_data())
+            async with self._drain_lock:
+                await self._writer.drain()
+            return await future
         # pylint: disable-next=broad-exception-caught
         except Exception as e:
             return ActualResponse.from_exception(e)
         finally:
-            self._writer.close()
+            del self._pending[request_id]
 
 
-RemoteExecutorQueue = asyncio.Queue[ConnectedComputeResouce[RemoteAnnotatorRequest]]
+RemoteExecutor = ConnectedComputeResouce[RemoteAnnotatorRequest]
+RemoteExecutors = ComputeScheduler[RemoteExecutor]
+
+
+async def _remote_worker_connected(
+    reader: asyncio.StreamReader,
+    writer: asyncio.StreamWriter,
+    scheduler: ComputeScheduler[ConnectedComputeResouce[Request]],
+) -> None:
+    try:
+        hello = await read_frame(reader)
+        if hello.request_id != HELLO_REQUEST_ID:
+            raise FrameError(f"Expected hello from remote worker, got request {hello.request_id}")
+        capacity = decode_hello(hello.header)
+    # pylint: disable-next=broad-exception-caught
+    except Exception as e:
+        log_error(e, "Remote worker did not introduce itself")
+        writer.close()
+        return
+    await ConnectedComputeResouce(reader, writer, scheduler, capacity).serve()
 
 
 async def start_annotation_remote_worker_loop(
-    worker_queue: asyncio.Queue[ConnectedComputeResouce[Request]],
+    scheduler: ComputeScheduler[ConnectedComputeResouce[Request]],
     port: int,
 ) -> None:
-    await asyncio.start_server(
-        lambda a, b: worker_queue.put_nowait(ConnectedComputeResouce(a, b)), "0.0.0.0", port
-    )
+    await asyncio.start_server(lambda a, b: _remote_worker_connected(a, b, scheduler), "0.0.0.0", port)
@@ -0,0 +1,81 @@
+import asyncio
+import typing as t
+import unittest
+
+from pphoto.communication.scheduler import ComputeScheduler, ExecutorLoad
+
+
+class FakeWorker:
+    def __init__(self, scheduler: "ComputeScheduler[FakeWorker]", capacity: int) -> None:
+        self.load = scheduler.executor_load(capacity)
+        self.closed = False
+
+
+def set_latency(load: ExecutorLoad, kind: str, latency: float) -> None:
+    # pylint: disable-next = protected-access
+    load._latency[kind] = latency
+
+
+class TestExecutorLoad(unittest.TestCase):
+    def test_rolling_latency(self) -> None:
+        load = ExecutorLoad(2)
+        self.assertIsNone(load.latency("a"))
+        self.assertEqual(load.expected_finish("a"), 0.0)
+        with load.track("a"):
+            self.assertEqual(load.in_flight, 1)
+        self.assertEqual(load.in_flight, 0)
+        set_latency(load, "a", 10.0)
+        self.assertEqual(load.expected_finish("a"), 5.0)
+        with self.assertRaises(ValueError):
+            with load.track("a"):
+                raise ValueError()
+        # Failures make executor look slow
+        latency = load.latency("a")
+        assert latency is not None
+        self.assertGreater(latency, 10.0)
+
+
+class TestComputeScheduler(unittest.IsolatedAsyncioTestCase):
+    async def test_picks_fastest_free_executor(self) -> None:
+        scheduler: ComputeScheduler[FakeWorker] = ComputeScheduler()
+        local = scheduler.executor_load(1)
+        fast = FakeWorker(scheduler, 1)
+        slow = FakeWorker(scheduler, 2)
+        scheduler.add(slow)
+        scheduler.add(fast)
+        set_latency(local, "a", 4.0)
+        set_latency(fast.load, "a", 1.0)
+        set_latency(slow.load, "a", 10.0)
+        self.assertIs(await scheduler.acquire("a", local), fast)
+        with fast.load.track("a"):
+            # Local is faster than slow worker, which would finish in 5s
+            self.assertIsNone(await scheduler.acquire("a", local))
+            with local.track("a"):
+                # Everything else is busy
+                self.assertIs(await scheduler.acquire("a", local), slow)
+        closed = FakeWorker(scheduler, 1)
+        closed.closed = True
+        scheduler.add(closed)
+        self.assertIs(await scheduler.acquire("a", local), fast)
+
+    async def test_waits_for_free_executor(self) -> None:
+        scheduler: ComputeScheduler[FakeWorker] = ComputeScheduler()
+        local = scheduler.executor_load(1)
+        worker = FakeWorker(scheduler, 1)
+        scheduler.add(worker)
+        acquired: t.List[t.Optional[FakeWorker]] = []
+
+        async def acquire() -> None:
+            acquired.append(await scheduler.acquire("a", local))
+
+        with local.track("a"):
+            with worker.load.track("a"):
+                task = asyncio.create_task(acquire())
+                await asyncio.sleep(0.01)
+                self.assertEqual(acquired, [])
+        await task
+        self.assertEqual(len(acquired), 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
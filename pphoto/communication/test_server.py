@@ -0,0 +1,87 @@
+import asyncio
+import threading
+import typing as t
+import unittest
+
+from pphoto.communication.client import async_compute_client_loop
+from pphoto.communication.scheduler import ComputeScheduler
+from pphoto.communication.server import RemoteExecutor, _remote_worker_connected
+from pphoto.communication.types import (
+    ActualResponse,
+    FaceEmbeddingsRequest,
+    FaceEmbeddingsWithMD5,
+    RemoteAnnotatorRequest,
+    RemoteAnnotatorResponse,
+)
+from pphoto.data_model.base import PathWithMd5
+
+
+def request(md5: str, data: bytes) -> RemoteAnnotatorRequest:
+    return RemoteAnnotatorRequest(
+        FaceEmbeddingsRequest("FaceEmbeddingsRequest", PathWithMd5("a.jpg", md5), None, None, data=data)
+    )
+
+
+class TestRemoteWorkerProtocol(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self) -> None:
+        self.scheduler: ComputeScheduler[RemoteExecutor] = ComputeScheduler()
+        self.computing: t.List[str] = []
+        self.release = threading.Event()
+        self.server = await asyncio.start_server(
+            lambda a, b: _remote_worker_connected(a, b, self.scheduler), "127.0.0.1", 0
+        )
+        port = self.server.sockets[0].getsockname()[1]
+        self.client = asyncio.create_task(
+            async_compute_client_loop(self.compute, RemoteAnnotatorRequest.from_frame, "127.0.0.1", port, 2)
+        )
+
+    async def asyncTearDown(self) -> None:
+        self.release.set()
+        self.client.cancel()
+        await asyncio.gather(self.client, return_exceptions=True)
+        # Let server notice the disconnect, so no handler is cancelled mid read
+        while self.scheduler.workers():
+            await asyncio.sleep(0.01)
+        self.server.close()
+
+    def compute(self, req: RemoteAnnotatorRequest) -> ActualResponse:
+        self.computing.append(req.p.path.md5)
+        self.release.wait(10)
+        # Echoes request data, to check that the binary part arrived and response matches request
+        md5 = f"{req.p.path.md5}:{req.p.data.decode('utf-8')}"
+        return ActualResponse(
+            RemoteAnnotatorResponse(FaceEmbeddingsWithMD5("FaceEmbeddingsWithMD5", md5, 1, None, None)), None
+        )
+
+    async def worker(self) -> RemoteExecutor:
+        while not self.scheduler.workers():
+            await asyncio.sleep(0.01)
+        return self.scheduler.workers()[0]
+
+    async def test_requests_in_flight_on_one_connection(self) -> None:
+        worker = await self.worker()
+        self.assertEqual(worker.load.capacity, 2)
+        responses = asyncio.gather(worker(request("x", b"\x00data x")), worker(request("y", b"data y")))
+        while not self.computing:
+            await asyncio.sleep(0.01)
+        self.release.set()
+        x, y = await responses
+        assert x.response is not None and y.response is not None
+        self.assertEqual(x.response.p.md5, "x:\x00data x")
+        self.assertEqual(y.response.p.md5, "y:data y")
+        self.assertEqual(self.computing, ["x", "y"])
+
+    async def test_disconnect_fails_pending_requests(self) -> None:
+        resource = await self.worker()
+        pending = asyncio.create_task(resource(request("x", b"")))
+        while not self.computing:
+            await asyncio.sleep(0.01)
+        self.client.cancel()
+        response = await pending
+        self.assertIsNotNone(response.error)
+        self.assertTrue(resource.closed)
+        self.assertEqual(self.scheduler.workers(), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -43,10 +43,11 @@ class FaceEmbeddingsWithMD5:
 class TextAnnotationRequest(dj.DataClassJsonMixin):
     t: _t.Literal["TextAnnotationRequest"]
     path: PathWithMd5
-    data_base64: str
     pts: _t.Optional[int]
     gap_threshold: float
     discard_threshold: float
+    # Raw bytes are not part of json, they are sent after it in the same frame
+    data: bytes = dc.field(default=b"", repr=False, metadata=dj.config(exclude=dj.Exclude.ALWAYS))
 
 
 @dc.dataclass
@@ -54,14 +55,27 @@ class FaceEmbeddingsRequest(dj.DataClassJsonMixin):
     t: _t.Literal["FaceEmbeddingsRequest"]
     path: PathWithMd5
     for_positions: _t.Optional[_t.List[Position]]
-    data_base64: str
     pts: _t.Optional[int]
+    # Raw bytes are not part of json, they are sent after it in the same frame
+    data: bytes = dc.field(default=b"", repr=False, metadata=dj.config(exclude=dj.Exclude.ALWAYS))
 
 
 @dc.dataclass
 class RemoteAnnotatorRequest(dj.DataClassJsonMixin):
     p: TextAnnotationRequest | FaceEmbeddingsRequest
 
+    def frame_header(self) -> bytes:
+        return self.to_json().encode("utf-8")
+
+    def frame_data(self) -> bytes:
+        return self.p.data
+
+    @staticmethod
+    def from_frame(header: bytes, data: bytes) -> RemoteAnnotatorRequest:
+        request = RemoteAnnotatorRequest.from_json(header)
+        request.p.data = data
+        return request
+
 
 @dc.dataclass
 class RemoteAnnotatorResponse(dj.DataClassJsonMixin):
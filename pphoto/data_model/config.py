@@ -12,6 +12,7 @@ from pphoto.utils.files import expand_vars_in_path
 class DBFilesConfig:
     image_to_text_jsonl: str = "data/output-image-to-text.jsonl"
     face_embeddings_jsonl: str = "data/output-face-embeddings.jsonl"
+    face_index: str = "data/face-index.f32"
     exif_jsonl: str = "data/output-exif.jsonl"
     dimm_jsonl: str = "data/output-dimmensions.jsonl"
     geo_address_jsonl: str = "data/output-geo.jsonl"
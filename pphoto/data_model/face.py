@@ -1,12 +1,25 @@
 from __future__ import annotations
 
 import json
+import struct
 import typing as t
 
 from dataclasses import dataclass
 
+import numpy as np
+import numpy.typing as npt
+
 from pphoto.data_model.base import StorableData
 
+# Magic, dtype of embeddings, dimensions of embedding, number of faces, resolution width and height
+_BINARY_HEADER = struct.Struct("<4sBHIII")
+_BINARY_MAGIC = b"FEMB"
+# Left, top, right, bottom, has pts, pts
+_BINARY_POSITION = struct.Struct("<iiii?q")
+_BINARY_DTYPES: t.List[np.dtype[t.Any]] = [np.dtype("<f4"), np.dtype("<f2")]
+# Features before this version are stored as json
+_BINARY_VERSION = 1
+
 
 @dataclass
 class ImageResolution:
@@ -117,6 +130,65 @@ class FaceEmbeddings(StorableData):
     def from_json_bytes(x: bytes) -> FaceEmbeddings:
         return FaceEmbeddings.from_json_dict(json.loads(x))
 
+    def to_bytes(self, dtype: npt.DTypeLike = np.float32) -> bytes:
+        """
+        Compact binary form, positions are packed in the header, followed by embeddings as little endian array
+        of `dtype`, which has to be float32 or float16.
+        """
+        dtype = np.dtype(dtype).newbyteorder("<")
+        matrix = np.array([face.embedding for face in self.faces], dtype=dtype)
+        dims = matrix.shape[1] if self.faces else 0
+        header = _BINARY_HEADER.pack(
+            _BINARY_MAGIC,
+            _BINARY_DTYPES.index(dtype),
+            dims,
+            len(self.faces),
+            self.resolution.width,
+            self.resolution.height,
+        )
+        positions = b"".join(
+            _BINARY_POSITION.pack(p.left, p.top, p.right, p.bottom, p.pts is not None, p.pts or 0)
+            for p in (face.position for face in self.faces)
+        )
+        return header + positions + matrix.tobytes()
+
+    @staticmethod
+    def from_bytes(x: bytes) -> FaceEmbeddings:
+        """Loads binary form, or json, which is used by features stored before binary form existed"""
+        if not x.startswith(_BINARY_MAGIC):
+            return FaceEmbeddings.from_json_bytes(x)
+        (resolution, positions, matrix) = decode_embeddings_array(x)
+        return FaceEmbeddings(
+            resolution,
+            [Face(position, embedding) for position, embedding in zip(positions, matrix.tolist())],
+        )
+
     @staticmethod
     def current_version() -> int:
-        return 0
+        return _BINARY_VERSION
+
+
+def decode_embeddings_array(
+    x: bytes,
+) -> t.Tuple[ImageResolution, t.List[Position], npt.NDArray[np.float32]]:
+    """Decodes binary form of `FaceEmbeddings` with embeddings as (faces, dimensions) float32 array"""
+    (magic, dtype_index, dims, count, width, height) = _BINARY_HEADER.unpack_from(x)
+    if magic != _BINARY_MAGIC:
+        raise ValueError(f"Not binary face embeddings: {magic!r}")
+    offset = _BINARY_HEADER.size
+    positions_end = offset + count * _BINARY_POSITION.size
+    positions = [
+        Position(left, top, right, bottom, pts if has_pts else None)
+        for (left, top, right, bottom, has_pts, pts) in _BINARY_POSITION.iter_unpack(x[offset:positions_end])
+    ]
+    matrix = np.frombuffer(x, dtype=_BINARY_DTYPES[dtype_index], count=count * dims, offset=positions_end)
+    return (
+        ImageResolution(width, height),
+        positions,
+        matrix.reshape(count, dims).astype(np.float32, copy=False),
+    )
+
+
+def migrate_json_to_binary(x: bytes) -> bytes:
+    """Converts payload of features stored as json to binary form of the current version"""
+    return FaceEmbeddings.from_json_bytes(x).to_bytes()
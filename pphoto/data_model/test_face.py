@@ -0,0 +1,56 @@
+import json
+import unittest
+
+import numpy as np
+
+from pphoto.data_model.face import (
+    Face,
+    FaceEmbeddings,
+    ImageResolution,
+    Position,
+    decode_embeddings_array,
+    migrate_json_to_binary,
+)
+
+
+def embeddings() -> FaceEmbeddings:
+    return FaceEmbeddings(
+        ImageResolution(640, 480),
+        [
+            Face(Position(10, 20, 110, 120, None), [i / 256 for i in range(128)]),
+            Face(Position(-5, 0, 50, 60, 3000), [-i / 64 for i in range(128)]),
+        ],
+    )
+
+
+class TestFaceEmbeddingsBinary(unittest.TestCase):
+    def test_roundtrip(self) -> None:
+        data = embeddings()
+        self.assertEqual(FaceEmbeddings.from_bytes(data.to_bytes()), data)
+        self.assertEqual(FaceEmbeddings.from_bytes(data.to_bytes(np.float16)), data)
+
+    def test_no_faces(self) -> None:
+        data = FaceEmbeddings(ImageResolution(1, 2), [])
+        self.assertEqual(FaceEmbeddings.from_bytes(data.to_bytes()), data)
+
+    def test_smaller_than_json(self) -> None:
+        data = embeddings()
+        for face, values in zip(data.faces, np.random.default_rng(0).normal(0, 0.1, (2, 128)).tolist()):
+            face.embedding = values
+        size = len(json.dumps(data.to_json_dict()).encode("utf-8"))
+        self.assertLess(len(data.to_bytes()) * 4, size)
+        self.assertLess(len(data.to_bytes(np.float16)) * 8, size)
+
+    def test_decode_array(self) -> None:
+        (resolution, positions, matrix) = decode_embeddings_array(embeddings().to_bytes(np.float16))
+        self.assertEqual(resolution, ImageResolution(640, 480))
+        self.assertEqual(positions, [face.position for face in embeddings().faces])
+        self.assertEqual(matrix.dtype, np.float32)
+        self.assertEqual(matrix.shape, (2, 128))
+        self.assertEqual(matrix[1, 64], -1.0)
+
+    def test_loads_json(self) -> None:
+        data = embeddings()
+        serialized = json.dumps(data.to_json_dict()).encode("utf-8")
+        self.assertEqual(FaceEmbeddings.from_bytes(serialized), data)
+        self.assertEqual(FaceEmbeddings.from_bytes(migrate_json_to_binary(serialized)), data)
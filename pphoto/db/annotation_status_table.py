@@ -0,0 +1,138 @@
+import typing as t
+
+from pphoto.data_model.base import PathWithMd5
+from pphoto.db.connection import PhotosConnection
+
+# Feature of type and version required by job exists for md5, used as `NOT EXISTS` to find missing ones
+_MISSING_FEATURE = """
+SELECT 1 FROM features
+WHERE features.type = annotation_required.type
+  AND features.md5 = {md5}
+  AND features.version = annotation_required.version
+"""
+
+
+class AnnotationStatusTable:
+    """
+    Md5s of files that are missing features required by some job, at current version. It is maintained by
+    triggers on `features` and `files` tables, so these tables have to exist before. Required features are
+    set by `set_required`, which recomputes the status when they change, e.g. after a model version bump.
+    """
+
+    def __init__(self, connection: PhotosConnection) -> None:
+        self._con = connection
+        self._init_db()
+
+    def _init_db(
+        self,
+    ) -> None:
+        self._con.execute(
+            """
+CREATE TABLE IF NOT EXISTS annotation_required (
+  job TEXT NOT NULL,
+  type TEXT NOT NULL,
+  version INTEGER NOT NULL,
+  PRIMARY KEY (job, type)
+) STRICT;
+        """
+        )
+        self._con.execute(
+            """
+CREATE TABLE IF NOT EXISTS annotation_missing (
+  id INTEGER PRIMARY KEY AUTOINCREMENT,
+  job TEXT NOT NULL,
+  md5 TEXT NOT NULL
+) STRICT;
+        """
+        )
+        self._con.execute(
+            """
+CREATE UNIQUE INDEX IF NOT EXISTS annotation_missing_idx_md5_job ON annotation_missing (md5, job);
+        """
+        )
+        self._con.execute(
+            """
+CREATE INDEX IF NOT EXISTS annotation_missing_idx_job_id ON annotation_missing (job, id);
+        """
+        )
+        for event, files_event in [("INSERT", "INSERT"), ("UPDATE", "UPDATE OF md5")]:
+            self._con.execute(
+                f"""
+CREATE TRIGGER IF NOT EXISTS annotation_status_features_on_{event.lower()} AFTER {event} ON features
+BEGIN
+  DELETE FROM annotation_missing
+  WHERE md5 = NEW.md5
+    AND job IN (
+      SELECT job FROM annotation_required WHERE type = NEW.type AND version = NEW.version
+    )
+    AND NOT EXISTS (
+      SELECT 1 FROM annotation_required
+      WHERE annotation_required.job = annotation_missing.job
+        AND NOT EXISTS ({_MISSING_FEATURE.format(md5="NEW.md5")})
+    );
+END
+            """
+            )
+            self._con.execute(
+                f"""
+CREATE TRIGGER IF NOT EXISTS annotation_status_files_on_{event.lower()} AFTER {files_event} ON files
+WHEN NEW.md5 IS NOT NULL
+BEGIN
+  INSERT OR IGNORE INTO annotation_missing (job, md5)
+  SELECT DISTINCT job, NEW.md5 FROM annotation_required
+  WHERE NOT EXISTS ({_MISSING_FEATURE.format(md5="NEW.md5")});
+END
+            """
+            )
+        self._con.commit()
+
+    def set_required(self, job: str, types: t.List[t.Tuple[str, int]]) -> bool:
+        """Sets (type, version) of features required by job. Returns True if status had to be recomputed."""
+        current = self._con.execute(
+            "SELECT type, version FROM annotation_required WHERE job = ?", (job,)
+        ).fetchall()
+        if sorted(current) == sorted(types):
+            return False
+        with self._con.transaction():
+            self._con.execute("DELETE FROM annotation_required WHERE job = ?", (job,))
+            self._con.executemany(
+                "INSERT INTO annotation_required VALUES (?, ?, ?)",
+                [(job, type_, version) for type_, version in types],
+            )
+            self._con.execute("DELETE FROM annotation_missing WHERE job = ?", (job,))
+            self._con.execute(
+                f"""
+INSERT OR IGNORE INTO annotation_missing (job, md5)
+SELECT DISTINCT ?, files.md5 FROM files
+WHERE files.md5 IS NOT NULL
+  AND EXISTS (
+    SELECT 1 FROM annotation_required
+    WHERE annotation_required.job = ?
+      AND NOT EXISTS ({_MISSING_FEATURE.format(md5="files.md5")})
+  )
+                """,
+                (job, job),
+            )
+        return True
+
+    def missing_total(self, job: str) -> int:
+        res = self._con.execute("SELECT COUNT(*) FROM annotation_missing WHERE job = ?", (job,)).fetchone()
+        return 0 if res is None else int(res[0])
+
+    def missing(self, job: str, chunk_size: int = 500) -> t.Iterable[t.List[PathWithMd5]]:
+        """Yields files missing features required by job, in chunks."""
+        position = 0
+        while True:
+            chunk = self._con.execute(
+                "SELECT id, md5 FROM annotation_missing WHERE job = ? AND id > ? ORDER BY id LIMIT ?",
+                (job, position, chunk_size),
+            ).fetchall()
+            if not chunk:
+                return
+            position = chunk[-1][0]
+            md5s = [md5 for _, md5 in chunk]
+            res = self._con.execute(
+                f"SELECT path, md5 FROM files WHERE md5 IN ({','.join('?' for _ in md5s)})", md5s
+            ).fetchall()
+            if res:
+                yield [PathWithMd5(path, md5) for path, md5 in res]
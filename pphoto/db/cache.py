@@ -33,19 +33,39 @@ class SQLiteCache(t.Generic[Ser], Cache[Ser]):
         type_: t.Type[Ser],
         loader: t.Callable[[bytes], Ser],
         jsonl_path: t.Optional[str] = None,
+        dumper: t.Optional[t.Callable[[Ser], bytes]] = None,
     ) -> None:
         self._features_table = features_table
         self._loader = loader
+        self._dumper = dumper
         self._type = type_.__name__
         self._data: t.Dict[str, FeaturePayload[WithMD5[Ser], None]] = {}
         self._current_version = type_.current_version()
         self._jsonl = JsonlWriter(jsonl_path)
 
     def get(self, key: str) -> t.Optional[FeaturePayload[WithMD5[Ser], None]]:
-        cached = self._data.get(key)
-        res = self._features_table.get_payload(self._type, key)
+        return self._parse(key, self._features_table.get_payload(self._type, key))
+
+    def get_many(self, keys: t.Sequence[str]) -> t.Dict[str, FeaturePayload[WithMD5[Ser], None]]:
+        return self.parse_many(keys, self._features_table.get_payloads([self._type], keys))
+
+    def parse_many(
+        self, keys: t.Sequence[str], payloads: t.Dict[t.Tuple[str, str], FeaturePayload[bytes, bytes]]
+    ) -> t.Dict[str, FeaturePayload[WithMD5[Ser], None]]:
+        """Parses payloads of this type from `FeaturesTable.get_payloads`, which may contain other types"""
+        out = {}
+        for key in keys:
+            parsed = self._parse(key, payloads.get((self._type, key)))
+            if parsed is not None:
+                out[key] = parsed
+        return out
+
+    def _parse(
+        self, key: str, res: t.Optional[FeaturePayload[bytes, bytes]]
+    ) -> t.Optional[FeaturePayload[WithMD5[Ser], None]]:
         if res is None:
             return None
+        cached = self._data.get(key)
         if cached is not None and cached.rowid == res.rowid and cached.last_update == res.last_update:
             return cached
         if res.payload is not None:
@@ -72,6 +92,8 @@ class SQLiteCache(t.Generic[Ser], Cache[Ser]):
             return data
         if data.p is None:
             d = None
+        elif self._dumper is not None:
+            d = self._dumper(data.p)
         else:
             d = json.dumps(data.p.to_json_dict()).encode("utf-8")
         if data.e is None:
@@ -0,0 +1,131 @@
+import typing as t
+
+from pphoto.db.connection import PhotosConnection
+from pphoto.db.types_file import ManagedLifecycle
+
+
+class ChangeLogTable:
+    """
+    Append only log of md5s whose features or files became dirty, filled by triggers on `features` and
+    `files` tables, so these tables have to exist before. Each consumer stores its position in the log.
+    """
+
+    def __init__(self, connection: PhotosConnection) -> None:
+        self._con = connection
+        self._init_db()
+
+    def _init_db(
+        self,
+    ) -> None:
+        exists = self._con.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'change_log'"
+        ).fetchone()
+        self._con.execute(
+            """
+CREATE TABLE IF NOT EXISTS change_log (
+  id INTEGER PRIMARY KEY AUTOINCREMENT,
+  md5 TEXT NOT NULL,
+  type TEXT
+) STRICT;
+        """
+        )
+        self._con.execute(
+            """
+CREATE TABLE IF NOT EXISTS change_log_positions (
+  consumer TEXT NOT NULL PRIMARY KEY,
+  position INTEGER NOT NULL
+) STRICT;
+        """
+        )
+        for event in ["INSERT", "UPDATE"]:
+            self._con.execute(
+                f"""
+CREATE TRIGGER IF NOT EXISTS change_log_features_on_{event.lower()} AFTER {event} ON features
+WHEN NEW.dirty = 1
+BEGIN
+  INSERT INTO change_log (md5, type) VALUES (NEW.md5, NEW.type);
+END
+            """
+            )
+            self._con.execute(
+                f"""
+CREATE TRIGGER IF NOT EXISTS change_log_files_on_{event.lower()} AFTER {event} ON files
+WHEN NEW.dirty = 1
+  AND NEW.md5 IS NOT NULL
+  AND NEW.managed <> {ManagedLifecycle.BEING_MOVED_AROUND.value}
+  AND NEW.managed <> {ManagedLifecycle.IMPORTED.value}
+BEGIN
+  INSERT INTO change_log (md5, type) VALUES (NEW.md5, NULL);
+END
+            """
+            )
+        if exists is None:
+            # Changes made before change log existed are only in dirty flags
+            self._con.execute(
+                f"""
+INSERT INTO change_log (md5, type)
+SELECT md5, NULL FROM files
+WHERE dirty = 1
+  AND md5 IS NOT NULL
+  AND managed <> {ManagedLifecycle.BEING_MOVED_AROUND.value}
+  AND managed <> {ManagedLifecycle.IMPORTED.value}
+            """
+            )
+            self._con.execute(
+                "INSERT INTO change_log (md5, type) SELECT md5, type FROM features WHERE dirty = 1"
+            )
+        self._con.commit()
+
+    def last_id(self) -> int:
+        res = self._con.execute("SELECT MAX(id) FROM change_log").fetchone()
+        return 0 if res is None or res[0] is None else int(res[0])
+
+    def position(self, consumer: str) -> int:
+        res = self._con.execute(
+            "SELECT position FROM change_log_positions WHERE consumer = ?", (consumer,)
+        ).fetchone()
+        return 0 if res is None else int(res[0])
+
+    def set_position(self, consumer: str, position: int) -> None:
+        self._con.execute(
+            """
+INSERT INTO change_log_positions VALUES (?, ?)
+ON CONFLICT(consumer) DO UPDATE SET position=excluded.position
+            """,
+            (consumer, position),
+        )
+        self._con.commit()
+
+    def left(self, after: int) -> int:
+        """Upper bound of number of changes after given position."""
+        return max(0, self.last_id() - after)
+
+    def changes(self, after: int, types: t.List[str], limit: int = 100000) -> t.Tuple[t.Set[str], int]:
+        """Returns changed md5s after given position, and position of the last returned change.
+
+        Changes of files are always returned, changes of features only for given `types`.
+        """
+        res = self._con.execute(
+            f"""
+SELECT id, md5, type FROM change_log
+WHERE id > ?
+ORDER BY id
+LIMIT {limit}
+            """,
+            (after,),
+        ).fetchall()
+        types_set = set(types)
+        md5s = set()
+        position = after
+        for id_, md5, type_ in res:
+            position = id_
+            if type_ is None or type_ in types_set:
+                md5s.add(md5)
+        return md5s, position
+
+    def prune(self) -> None:
+        """Removes changes processed by all consumers."""
+        self._con.execute(
+            "DELETE FROM change_log WHERE id <= (SELECT COALESCE(MIN(position), 0) FROM change_log_positions)"
+        )
+        self._con.commit()
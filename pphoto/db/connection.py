@@ -12,7 +12,25 @@ MaybeParameters = t.Optional[t.Sequence[Parameter]]
 
 
 class _Connection:
-    def __init__(self, path: str, timeout: int = 120, check_same_thread: bool = True) -> None:
+    """
+    Wrapper around sqlite connection, that reconnects lazily.
+
+    Tables call `commit()` after each write. With `batch_size` > 1, writes are batched: `commit()` only
+    counts pending writes, and actual commit happens once there are `batch_size` of them, or once the oldest
+    of them is older than `batch_max_age` (checked on writes and in `flush_old()`, that has to be called
+    periodically, so that write transaction is not left open while there are no other writes). Pending
+    writes are visible through this connection, but not to other connections, and are lost on crash. Use
+    `flush()` when write has to be durable, e.g. before touching files on disk or finishing user's task.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        timeout: int = 120,
+        check_same_thread: bool = True,
+        batch_size: int = 1,
+        batch_max_age: timedelta = timedelta(seconds=1),
+    ) -> None:
         self._path = path
         self._timeout = timeout
         self._check_same_thread = check_same_thread
@@ -20,17 +38,31 @@ class _Connection:
         self._connection: t.Optional[sqlite3.Connection] = None
         self._disconnect_timeout = timedelta(seconds=10)
         self._transactions = 0
+        self._batch_size = batch_size
+        self._batch_max_age = batch_max_age
+        self._pending_writes = 0
+        self._oldest_pending_write: t.Optional[datetime] = None
+
+    @property
+    def path(self) -> str:
+        return self._path
 
     def reconnect(self) -> None:
         if self._connection is not None:
+            try:
+                self.flush()
+            except sqlite3.Error as e:
+                print("Unable to flush pending writes before reconnect", e, file=sys.stderr)
             self._connection.close()
+        self._reset_pending()
         self._connection = self._connect()
 
     def check_unused(self) -> None:
         if self._connection is None:
             return
-        now = datetime.now()
-        if now - self._last_use > self._disconnect_timeout:
+        self.flush_old()
+        if datetime.now() - self._last_use > self._disconnect_timeout:
+            self.flush()
             self._connection.close()
             self._connection = None
 
@@ -82,33 +114,71 @@ class _Connection:
             # It is ok, this is expected
 
     def commit(self) -> None:
-        self._last_use = datetime.now()
+        now = datetime.now()
+        self._last_use = now
         if self._connection is None:
             self._connection = self._connect()
-        if self._transactions <= 0:
-            return self._connection.commit()
+        if self._transactions > 0:
+            return None
+        self._pending_writes += 1
+        if self._oldest_pending_write is None:
+            self._oldest_pending_write = now
+        if (
+            self._pending_writes >= self._batch_size
+            or now - self._oldest_pending_write >= self._batch_max_age
+        ):
+            self.flush()
         return None
 
+    def flush_old(self) -> timedelta:
+        """Flushes pending writes older than `batch_max_age`, returns time after which it should be called again"""
+        if self._oldest_pending_write is None:
+            return self._batch_max_age
+        age = datetime.now() - self._oldest_pending_write
+        if age < self._batch_max_age:
+            return self._batch_max_age - age
+        self.flush()
+        return self._batch_max_age
+
+    def flush(self) -> None:
+        """Commits pending writes. Inside of `transaction()` it does nothing, as transaction commits at the end."""
+        if self._transactions > 0:
+            return
+        if self._connection is not None:
+            self._connection.commit()
+        self._reset_pending()
+
+    def _reset_pending(self) -> None:
+        self._pending_writes = 0
+        self._oldest_pending_write = None
+
     @contextlib.contextmanager
     def transaction(self) -> t.Generator[None, None, None]:
+        if self._transactions == 0:
+            # Otherwise rollback of this transaction would also roll back unrelated pending writes
+            self.flush()
         self._transactions += 1
         try:
             yield None
             if self._connection is None:
                 self._connection = self._connect()
             self._connection.commit()
+            self._reset_pending()
         except:
             if self._connection is None:
                 self._connection = self._connect()
             self._connection.rollback()
+            self._reset_pending()
             raise
         finally:
             self._transactions -= 1
 
     def rollback(self) -> None:
+        """Rolls back also all pending writes."""
         self._last_use = datetime.now()
         if self._connection is None:
             self._connection = self._connect()
+        self._reset_pending()
         return self._connection.rollback()
 
 
@@ -4,6 +4,11 @@ from pphoto.db.connection import GalleryConnection
 
 
 class DirectoriesTable:
+    """
+    Writes are batched by connection. On crash, directories written since last commit are lost, and recomputed
+    by reindexer from photos db.
+    """
+
     def __init__(self, connection: GalleryConnection) -> None:
         self._con = connection
         self._init_db()
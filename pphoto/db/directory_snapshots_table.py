@@ -0,0 +1,43 @@
+import typing as t
+
+from pphoto.db.connection import PhotosConnection
+from pphoto.utils.files import DirectorySnapshot
+
+
+class DirectorySnapshotsTable:
+    """Mtimes of scanned input directories, so that unchanged directories are not listed again."""
+
+    def __init__(self, connection: PhotosConnection) -> None:
+        self._con = connection
+        self._init_db()
+
+    def _init_db(
+        self,
+    ) -> None:
+        self._con.execute(
+            """
+CREATE TABLE IF NOT EXISTS directory_snapshots (
+  directory TEXT NOT NULL PRIMARY KEY,
+  mtime_ns INTEGER NOT NULL,
+  scanned_at_ns INTEGER NOT NULL
+) STRICT;
+        """
+        )
+
+    def get_all(self) -> t.Dict[str, DirectorySnapshot]:
+        res = self._con.execute("SELECT directory, mtime_ns, scanned_at_ns FROM directory_snapshots")
+        out: t.Dict[str, DirectorySnapshot] = {}
+        while True:
+            items = res.fetchmany()
+            if not items:
+                return out
+            for directory, mtime_ns, scanned_at_ns in items:
+                out[directory] = DirectorySnapshot(mtime_ns, scanned_at_ns)
+
+    def replace_all(self, snapshots: t.Dict[str, DirectorySnapshot]) -> None:
+        with self._con.transaction():
+            self._con.execute("DELETE FROM directory_snapshots")
+            self._con.executemany(
+                "INSERT INTO directory_snapshots VALUES (?, ?, ?)",
+                [(directory, s.mtime_ns, s.scanned_at_ns) for directory, s in snapshots.items()],
+            )
@@ -0,0 +1,67 @@
+import typing as t
+
+from pphoto.data_model.face import Position
+from pphoto.db.connection import PhotosConnection
+
+
+class FaceClustersTable:
+    """
+    Cluster of each face in `face_index` table, which has to exist before, faces are identified by its rows.
+    Clusters are computed by face clustering job, which is the only writer.
+    """
+
+    def __init__(self, connection: PhotosConnection) -> None:
+        self._con = connection
+        self._init_db()
+
+    def _init_db(
+        self,
+    ) -> None:
+        self._con.execute(
+            """
+CREATE TABLE IF NOT EXISTS face_clusters (
+  row INTEGER PRIMARY KEY,
+  cluster INTEGER NOT NULL
+) STRICT;
+        """
+        )
+        self._con.execute(
+            """
+CREATE INDEX IF NOT EXISTS face_clusters_idx_cluster ON face_clusters (cluster);
+        """
+        )
+        self._con.commit()
+
+    def clusters(self) -> t.Dict[int, int]:
+        """Cluster by row of face in `face_index`"""
+        return dict(self._con.execute("SELECT row, cluster FROM face_clusters").fetchall())
+
+    def update(self, changed: t.Dict[int, int], removed: t.Iterable[int]) -> None:
+        with self._con.transaction():
+            self._con.executemany("DELETE FROM face_clusters WHERE row = ?", [(row,) for row in removed])
+            self._con.executemany(
+                "INSERT OR REPLACE INTO face_clusters VALUES (?, ?)",
+                list(changed.items()),
+            )
+
+    def renumber(self, renumbered: t.List[t.Tuple[int, int]]) -> None:
+        """
+        Moves clusters to new rows of faces in `FaceIndex.compact`, before rows of `face_index` are renumbered.
+        `renumbered` has (new, old) rows in increasing order.
+        """
+        self._con.execute("DELETE FROM face_clusters WHERE row NOT IN (SELECT row FROM face_index)")
+        self._con.executemany("UPDATE face_clusters SET row = ? WHERE row = ?", renumbered)
+
+    def clusters_of(self, md5s: t.Sequence[str]) -> t.Dict[t.Tuple[str, Position], int]:
+        """Clusters of faces of given md5s, by md5 and position of face"""
+        res = self._con.execute(
+            f"""
+SELECT md5, left, top, right, bottom, pts, cluster
+FROM face_index JOIN face_clusters USING (row)
+WHERE md5 IN ({','.join('?' for _ in md5s)})""",
+            md5s,
+        ).fetchall()
+        return {
+            (md5, Position(left, top, right, bottom, pts)): cluster
+            for md5, left, top, right, bottom, pts, cluster in res
+        }
@@ -0,0 +1,291 @@
+import os
+import sys
+import typing as t
+
+from dataclasses import dataclass
+
+import numpy as np
+import numpy.typing as npt
+
+from pphoto.data_model.face import FaceEmbeddings, Position, decode_embeddings_array
+from pphoto.db.connection import PhotosConnection
+from pphoto.db.face_clusters_table import FaceClustersTable
+
+_DIMENSIONS = 128
+_SYNC_CHUNK_SIZE = 500
+_COMPACT_CHUNK_SIZE = 10000
+
+FaceDistance = t.Literal["l2", "cosine"]
+
+
+class IndexedFaces(t.NamedTuple):
+    rows: npt.NDArray[np.int64]
+    faces: t.List[t.Tuple[str, Position]]
+    embeddings: npt.NDArray[np.float32]
+
+
+@dataclass
+class FaceMatch:
+    md5: str
+    position: Position
+    distance: float
+
+
+class FaceIndex:
+    """
+    Nearest neighbour search over all face embeddings. Embeddings are appended to float32 matrix file, which
+    is memory-mapped for search, `face_index` table maps rows of the matrix to md5 and position of the face.
+    When faces of md5 are indexed again, they get new rows and old ones are no longer referenced.
+
+    There should be a single writer, searches can run in other processes, they pick up committed changes.
+    Writer can `compact()` the file, then referenced rows are copied to a file of the next generation and
+    renumbered, together with their clusters.
+    """
+
+    def __init__(self, connection: PhotosConnection, path: str, dimensions: int = _DIMENSIONS) -> None:
+        self._con = connection
+        self._path = path
+        self._dimensions = dimensions
+        self._row_bytes = dimensions * 4
+        self._init_db()
+        # State of search, reloaded when the table changes
+        self._state: t.Optional[t.Tuple[int, int, int]] = None
+        self._generation = 0
+        self._matrix: npt.NDArray[np.float32] = np.zeros((0, dimensions), dtype=np.float32)
+        self._norms: npt.NDArray[np.float32] = np.zeros((0,), dtype=np.float32)
+        self._rows: npt.NDArray[np.int64] = np.zeros((0,), dtype=np.int64)
+        self._faces: t.List[t.Tuple[str, Position]] = []
+
+    def _init_db(
+        self,
+    ) -> None:
+        self._con.execute(
+            """
+CREATE TABLE IF NOT EXISTS face_index (
+  row INTEGER PRIMARY KEY,
+  md5 TEXT NOT NULL,
+  left INTEGER NOT NULL,
+  top INTEGER NOT NULL,
+  right INTEGER NOT NULL,
+  bottom INTEGER NOT NULL,
+  pts INTEGER
+) STRICT;
+        """
+        )
+        self._con.execute(
+            """
+CREATE INDEX IF NOT EXISTS face_index_idx_md5 ON face_index (md5);
+        """
+        )
+        self._con.execute(
+            """
+CREATE TABLE IF NOT EXISTS face_index_files (
+  md5 TEXT NOT NULL PRIMARY KEY,
+  last_update INTEGER NOT NULL
+) STRICT;
+        """
+        )
+        self._con.execute(
+            """
+CREATE TABLE IF NOT EXISTS face_index_generation (
+  id INTEGER PRIMARY KEY CHECK (id = 0),
+  generation INTEGER NOT NULL
+) STRICT;
+        """
+        )
+        self._con.execute("INSERT OR IGNORE INTO face_index_generation VALUES (0, 0)")
+        self._con.commit()
+
+    def _file(self, generation: int) -> str:
+        return self._path if generation == 0 else f"{self._path}.{generation}"
+
+    def _current_generation(self) -> int:
+        (generation,) = self._con.execute("SELECT generation FROM face_index_generation").fetchone()
+        return int(generation)
+
+    def _append(self, matrix: npt.NDArray[np.float32]) -> int:
+        """Appends rows to the matrix file, returns index of the first one"""
+        with open(self._file(self._current_generation()), "ab") as f:
+            size = f.tell()
+            if size % self._row_bytes:
+                # Partially written row from a crash
+                size -= size % self._row_bytes
+                f.truncate(size)
+            f.write(matrix.astype("<f4").tobytes())
+            f.flush()
+        return size // self._row_bytes
+
+    def add(self, md5: str, embeddings: FaceEmbeddings) -> None:
+        self.add_array(
+            md5,
+            [face.position for face in embeddings.faces],
+            np.array([face.embedding for face in embeddings.faces], dtype=np.float32),
+        )
+
+    def add_array(self, md5: str, positions: t.List[Position], matrix: npt.NDArray[np.float32]) -> None:
+        """Replaces indexed faces of md5, `matrix` has embedding of each position in rows"""
+        with self._con.transaction():
+            self._con.execute("DELETE FROM face_index WHERE md5 = ?", (md5,))
+            if positions:
+                first = self._append(matrix.reshape(len(positions), self._dimensions))
+                self._con.executemany(
+                    "INSERT INTO face_index VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    [
+                        (first + i, md5, p.left, p.top, p.right, p.bottom, p.pts)
+                        for i, p in enumerate(positions)
+                    ],
+                )
+            self._con.execute(
+                """
+INSERT INTO face_index_files VALUES (?, strftime('%s'))
+ON CONFLICT(md5) DO UPDATE SET last_update=excluded.last_update""",
+                (md5,),
+            )
+
+    def sync(self) -> int:
+        """Indexes face embeddings features that changed since they were indexed. Returns number of files."""
+        synced = 0
+        while True:
+            rows = self._con.execute(
+                """
+SELECT features.md5, features.payload FROM features
+LEFT JOIN face_index_files ON face_index_files.md5 = features.md5
+WHERE features.type = ?
+  AND features.version = ?
+  AND features.is_error = 0
+  AND (face_index_files.last_update IS NULL OR face_index_files.last_update < features.last_update)
+LIMIT ?""",
+                (FaceEmbeddings.__name__, FaceEmbeddings.current_version(), _SYNC_CHUNK_SIZE),
+            ).fetchall()
+            if not rows:
+                return synced
+            for md5, payload in rows:
+                try:
+                    (_, positions, matrix) = decode_embeddings_array(payload)
+                # pylint: disable-next = broad-exception-caught
+                except Exception as e:
+                    print("Unable to index faces of", md5, e, file=sys.stderr)
+                    (positions, matrix) = ([], np.zeros((0, self._dimensions), dtype=np.float32))
+                self.add_array(md5, positions, matrix)
+            synced += len(rows)
+
+    def state(self) -> t.Tuple[int, int, int]:
+        """Changes whenever indexed faces change"""
+        (count, max_row, generation) = self._con.execute(
+            """
+SELECT COUNT(*), COALESCE(MAX(row), -1), (SELECT generation FROM face_index_generation)
+FROM face_index"""
+        ).fetchone()
+        return (count, max_row, generation)
+
+    def _refresh(self) -> None:
+        state = self.state()
+        if state == self._state:
+            return
+        # Generation is read in the same statement as rows, so that they match the file
+        res = self._con.execute(
+            """
+SELECT (SELECT generation FROM face_index_generation), row, md5, left, top, right, bottom, pts
+FROM face_index ORDER BY row"""
+        ).fetchall()
+        generation = res[0][0] if res else state[2]
+        if generation != self._generation:
+            self._generation = generation
+            self._matrix = np.zeros((0, self._dimensions), dtype=np.float32)
+            self._norms = np.zeros((0,), dtype=np.float32)
+        path = self._file(generation)
+        try:
+            size = os.path.getsize(path) // self._row_bytes if res else 0
+        except FileNotFoundError:
+            # File was compacted after rows were read, they are read again next time
+            return
+        if size != self._matrix.shape[0]:
+            previous = self._matrix.shape[0] if size > self._matrix.shape[0] else 0
+            self._matrix = (
+                np.memmap(path, dtype="<f4", mode="r", shape=(size, self._dimensions))
+                if size
+                else np.zeros((0, self._dimensions), dtype=np.float32)
+            )
+            # Only appended rows need new norms
+            self._norms = np.concatenate(
+                [self._norms[:previous], np.linalg.norm(self._matrix[previous:], axis=1).astype(np.float32)]
+            )
+        rows = []
+        faces = []
+        for _, row, md5, left, top, right, bottom, pts in res:
+            if row < size:
+                rows.append(row)
+                faces.append((md5, Position(left, top, right, bottom, pts)))
+        self._rows = np.array(rows, dtype=np.int64)
+        self._faces = faces
+        self._state = state
+
+    def unreferenced(self) -> int:
+        """Number of rows in the matrix file, which are no longer referenced, as faces were indexed again"""
+        path = self._file(self._current_generation())
+        size = os.path.getsize(path) // self._row_bytes if os.path.exists(path) else 0
+        (count,) = self._con.execute("SELECT COUNT(*) FROM face_index").fetchone()
+        return max(0, size - int(count))
+
+    def compact(self, min_unreferenced: float = 0.0) -> int:
+        """
+        Copies referenced rows to file of the next generation and renumbers them and their clusters, if at
+        least `min_unreferenced` fraction of rows is unreferenced. Readers switch to the new file once they
+        see the new rows. Only writer can compact. Returns number of removed rows.
+        """
+        generation = self._current_generation()
+        old_path = self._file(generation)
+        if not os.path.exists(old_path):
+            return 0
+        size = os.path.getsize(old_path) // self._row_bytes
+        rows = [int(row) for (row,) in self._con.execute("SELECT row FROM face_index ORDER BY row")]
+        if len(rows) == size or (rows and rows[-1] >= size) or size - len(rows) < min_unreferenced * size:
+            return 0
+        new_path = self._file(generation + 1)
+        source = np.memmap(old_path, dtype="<f4", mode="r", shape=(size, self._dimensions))
+        with open(new_path, "wb") as f:
+            for start in range(0, len(rows), _COMPACT_CHUNK_SIZE):
+                f.write(np.asarray(source[rows[start : start + _COMPACT_CHUNK_SIZE]], dtype="<f4").tobytes())
+            f.flush()
+            os.fsync(f.fileno())
+        del source
+        # Rows only move to lower numbers, in increasing order they never collide with other rows
+        renumbered = [(new, old) for new, old in enumerate(rows) if new != old]
+        clusters = FaceClustersTable(self._con)
+        with self._con.transaction():
+            clusters.renumber(renumbered)
+            self._con.executemany("UPDATE face_index SET row = ? WHERE row = ?", renumbered)
+            self._con.execute("UPDATE face_index_generation SET generation = ?", (generation + 1,))
+        os.remove(old_path)
+        return size - len(rows)
+
+    def faces(self) -> IndexedFaces:
+        """All indexed faces, embeddings are copied from the matrix file"""
+        self._refresh()
+        return IndexedFaces(
+            self._rows, list(self._faces), np.array(self._matrix[self._rows], dtype=np.float32)
+        )
+
+    def search(
+        self, embedding: t.Sequence[float], limit: int, distance: FaceDistance = "l2"
+    ) -> t.List[FaceMatch]:
+        """Faces closest to embedding, by euclidean distance or by cosine distance, closest first"""
+        self._refresh()
+        if not self._faces or limit <= 0:
+            return []
+        query = np.asarray(embedding, dtype=np.float32)
+        query_norm = float(np.linalg.norm(query))
+        dots = (self._matrix @ query)[self._rows]
+        norms = self._norms[self._rows]
+        if distance == "l2":
+            distances = np.sqrt(np.maximum(norms * norms - 2 * dots + query_norm * query_norm, 0))
+        else:
+            distances = 1 - dots / np.maximum(norms * query_norm, np.finfo(np.float32).tiny)
+        limit = min(limit, len(distances))
+        closest = np.argpartition(distances, limit - 1)[:limit]
+        closest = closest[np.argsort(distances[closest])]
+        out = []
+        for i in closest:
+            (md5, position) = self._faces[i]
+            out.append(FaceMatch(md5, position, float(distances[i])))
+        return out
@@ -1,8 +1,12 @@
+import sys
 import typing as t
 from pphoto.db.connection import PhotosConnection
 from pphoto.db.types import FeaturePayload
 
 
+_MAX_KEYS_PER_QUERY = 500
+
+
 class FeaturesFableWrongParams(Exception):
     def __init__(self, message: str, payload: t.Optional[bytes], error: t.Optional[bytes]) -> None:
         super().__init__(
@@ -11,6 +15,12 @@ class FeaturesFableWrongParams(Exception):
 
 
 class FeaturesTable:
+    """
+    Writes are batched by connection. On crash, features written since last commit (at most `batch_size`
+    writes or `batch_max_age` old) are lost, and recomputed as they are missing again. Manual annotations
+    can't be recomputed, so they have to be followed by `flush()`.
+    """
+
     def __init__(
         self,
         connection: PhotosConnection,
@@ -134,6 +144,33 @@ CREATE INDEX IF NOT EXISTS features_idx_is_error ON features (is_error);
         ).fetchone()
         if res is None:
             return None
+        return self._to_payload(res)
+
+    def get_payloads(
+        self,
+        types: t.List[str],
+        keys: t.Sequence[str],
+    ) -> t.Dict[t.Tuple[str, str], FeaturePayload[bytes, bytes]]:
+        """Returns payloads of all given types and md5s, indexed by `(type, md5)`"""
+        out = {}
+        for i in range(0, len(keys), _MAX_KEYS_PER_QUERY):
+            chunk = keys[i : i + _MAX_KEYS_PER_QUERY]
+            res = self._con.execute(
+                f"""
+SELECT type, md5, rowid, payload, is_error, last_update, version
+FROM features
+WHERE type IN ({",".join("?" for _ in types)}) AND md5 IN ({",".join("?" for _ in chunk)})""",
+                (*types, *chunk),
+            )
+            while True:
+                items = res.fetchmany()
+                if not items:
+                    break
+                for type_, md5, *row in items:
+                    out[(type_, md5)] = self._to_payload(row)
+        return out
+
+    def _to_payload(self, res: t.Sequence[t.Any]) -> FeaturePayload[bytes, bytes]:
         (
             rowid,
             payload,
@@ -179,3 +216,48 @@ WHERE
             (type_, md5, version, payload or error, 1 if payload is None else 0),
         )
         self._con.commit()
+
+    def last_update(self, type_: str) -> int:
+        """Last time feature of given type was changed, 0 when there is none"""
+        res = self._con.execute("SELECT MAX(last_update) FROM features WHERE type = ?", (type_,)).fetchone()
+        return 0 if res is None or res[0] is None else int(res[0])
+
+    def migrate_payloads(
+        self,
+        type_: str,
+        from_version: int,
+        to_version: int,
+        convert: t.Callable[[bytes], bytes],
+    ) -> int:
+        """
+        Converts payloads of features of given type and version to a new version, e.g. new storage format,
+        without recomputing them. Errors are only moved to the new version, payloads that fail to convert are
+        left at the old version to be recomputed. Returns number of migrated rows.
+        """
+        migrated = 0
+        position = -1
+        while True:
+            rows = self._con.execute(
+                """
+SELECT rowid, payload, is_error FROM features
+WHERE type = ? AND version = ? AND rowid > ?
+ORDER BY rowid
+LIMIT ?""",
+                (type_, from_version, position, _MAX_KEYS_PER_QUERY),
+            ).fetchall()
+            if not rows:
+                return migrated
+            position = rows[-1][0]
+            updates: t.List[t.Tuple[int, bytes, int]] = []
+            for rowid, payload, is_error in rows:
+                try:
+                    updates.append((to_version, payload if is_error else convert(payload), rowid))
+                # pylint: disable-next = broad-exception-caught
+                except Exception as e:
+                    print("Unable to migrate", type_, rowid, e, file=sys.stderr)
+            with self._con.transaction():
+                self._con.executemany("UPDATE features SET version = ?, payload = ? WHERE rowid = ?", updates)
+            migrated += len(updates)
+
+    def flush(self) -> None:
+        self._con.flush()
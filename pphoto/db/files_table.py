@@ -4,6 +4,9 @@ from pphoto.db.connection import PhotosConnection
 from pphoto.db.types_file import FileRow, ManagedLifecycle
 
 
+_MAX_KEYS_PER_QUERY = 500
+
+
 class FilesTableWrongLifecycleParams(Exception):
     def __init__(self, message: str, managed: ManagedLifecycle, tmp_path: t.Optional[str]) -> None:
         super().__init__(
@@ -12,6 +15,12 @@ class FilesTableWrongLifecycleParams(Exception):
 
 
 class FilesTable:
+    """
+    Writes of unmanaged files are batched by connection. On crash, unmanaged files added since last commit are
+    lost, and found again by next scan of directories. Writes that change managed lifecycle or path are
+    flushed immediately, as files on disk are moved right after them, so those are never lost.
+    """
+
     def __init__(self, connection: PhotosConnection) -> None:
         self._con = connection
         self._init_db()
@@ -84,7 +93,7 @@ INSERT OR IGNORE INTO files VALUES (?, strftime('%s'), ?, ?, ?, ?, 1)
                 managed.value,
             ),
         )
-        self._con.commit()
+        self._commit(managed)
 
     def add_or_update(
         self,
@@ -112,7 +121,12 @@ ON CONFLICT(path) DO UPDATE SET
                 managed.value,
             ),
         )
+        self._commit(managed)
+
+    def _commit(self, managed: ManagedLifecycle) -> None:
         self._con.commit()
+        if managed != ManagedLifecycle.NOT_MANAGED:
+            self._con.flush()
 
     def _validate_lifecycle(
         self,
@@ -142,6 +156,7 @@ UPDATE files SET path=?, dirty=1 WHERE path = ?
             (new_path, old_path),
         )
         self._con.commit()
+        self._con.flush()
 
     def set_lifecycle(
         self,
@@ -161,6 +176,7 @@ UPDATE files SET managed=? , tmp_path=?, dirty=1 WHERE path = ?
             ),
         )
         self._con.commit()
+        self._con.flush()
 
     def dirty_md5s(self, limit: int = 1000) -> t.List[str]:
         res = self._con.execute(
@@ -182,6 +198,15 @@ SELECT COUNT(DISTINCT md5) FROM files WHERE dirty=1 AND managed <> {ManagedLifec
         assert res is not None
         return int(res[0])
 
+    def all_md5s(self) -> t.Iterable[str]:
+        res = self._con.execute("SELECT DISTINCT md5 FROM files WHERE md5 IS NOT NULL")
+        while True:
+            items = res.fetchmany()
+            if not items:
+                return
+            for (md5,) in items:
+                yield md5
+
     def undirty(self, md5: str, max_last_update: float) -> None:
         self._con.execute(
             """
@@ -289,3 +314,43 @@ UPDATE files SET dirty = 0 WHERE dirty=1 AND md5 = ? AND last_update <= ?
                 )
             )
         return out
+
+    def known_paths(self, paths: t.Sequence[str]) -> t.Set[str]:
+        """Returns which of the paths are in the table."""
+        out: t.Set[str] = set()
+        for i in range(0, len(paths), _MAX_KEYS_PER_QUERY):
+            chunk = paths[i : i + _MAX_KEYS_PER_QUERY]
+            res = self._con.execute(
+                f"SELECT path FROM files WHERE path IN ({','.join('?' for _ in chunk)})",
+                chunk,
+            ).fetchall()
+            out.update(path for (path,) in res)
+        return out
+
+    def by_md5s(
+        self,
+        md5s: t.Sequence[str],
+    ) -> t.Dict[str, t.List[FileRow]]:
+        out: t.Dict[str, t.List[FileRow]] = {md5: [] for md5 in md5s}
+        for i in range(0, len(md5s), _MAX_KEYS_PER_QUERY):
+            chunk = md5s[i : i + _MAX_KEYS_PER_QUERY]
+            res = self._con.execute(
+                f"""
+SELECT rowid, last_update, path, md5, og_path, tmp_path, managed
+FROM files
+WHERE md5 IN ({",".join("?" for _ in chunk)})""",
+                chunk,
+            ).fetchall()
+            for rowid, last_update, path, md5, og_path, tmp_path, managed in res:
+                out[md5].append(
+                    FileRow(
+                        path,
+                        md5,
+                        og_path,
+                        tmp_path,
+                        ManagedLifecycle(managed),
+                        last_update,
+                        rowid,
+                    )
+                )
+        return out
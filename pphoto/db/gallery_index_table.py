@@ -5,6 +5,8 @@ import copy
 import itertools
 import typing as t
 import math
+import sqlite3
+import sys
 from datetime import datetime
 
 # TODO move to proper place
@@ -13,7 +15,7 @@ from pphoto.gallery.utils import (
 )
 
 # TODO: extract this type into query payload
-from pphoto.gallery.url import SearchQuery, GalleryPaging, SortParams, SortBy
+from pphoto.gallery.url import SearchQuery, GalleryPaging, GalleryCursor, SortParams, SortBy, SortOrder
 from pphoto.utils import assert_never
 from pphoto.data_model.manual import ManualText, ManualLocation, ManualDate
 from pphoto.db.connection import GalleryConnection
@@ -52,19 +54,42 @@ _DATE_BUCKET_SIZES_SECONDS = [
     365.25 * 24 * 60 * 60,
 ]
 
+# Columns that are searched by substring, and have trigram index in `gallery_index_fts`
+_FTS_COLUMNS = ["tags", "classifications", "address_full", "camera"]
+# Trigram index can't be used for shorter patterns
+_FTS_MIN_PATTERN_LENGTH = 3
+
+
+def _parse_joined_tags(tags: t.Optional[str], tags_probs: t.Optional[str]) -> t.List[t.Tuple[str, float]]:
+    """Pairs tags with probabilities from joined columns, tags without valid probability are skipped"""
+    out = []
+    for tag, prob in zip((tags or "").split(":"), (tags_probs or "").split(":")):
+        try:
+            if tag:
+                out.append((tag, float(prob)))
+        except ValueError:
+            pass
+    return out
+
 
 class GalleryIndexTable:
+    """
+    Writes are batched by connection. On crash, entries written since last commit are lost, and recomputed by
+    reindexer from photos db.
+    """
+
     def __init__(
         self,
         connection: GalleryConnection,
+        full_text_search: bool = True,
     ) -> None:
         self._con = connection
+        self._fts = full_text_search
         self._init_db()
 
     def _init_db(
         self,
     ) -> None:
-        # TODO: store tags as text and tags as list of items
         self._con.execute(
             """
 CREATE TABLE IF NOT EXISTS gallery_index (
@@ -133,6 +158,7 @@ ALTER TABLE gallery_index ADD COLUMN file_size INTEGER
             ["md5"],
             ["feature_last_update"],
             ["timestamp"],
+            ["timestamp", "md5"],
             ["tags"],
             ["classifications"],
             ["address_full"],
@@ -147,15 +173,143 @@ ALTER TABLE gallery_index ADD COLUMN file_size INTEGER
             name = f"gallery_index_idx_{'_'.join(columns)}"
             cols_str = ", ".join(columns)
             self._con.execute(f"CREATE INDEX IF NOT EXISTS {name} ON gallery_index ({cols_str});")
+        self._init_side_tables()
+        if self._fts:
+            self._fts = self._init_fts()
         # Just init this table
         DirectoriesTable(self._con)
 
+    def _init_side_tables(self) -> None:
+        """Tables with one row per item of multi-valued columns, so they can be joined and grouped by."""
+        exists = self._con.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'image_tags'"
+        ).fetchone()
+        for table, columns, value_column in [
+            ("image_tags", "md5 TEXT NOT NULL, tag TEXT NOT NULL, prob REAL NOT NULL", "tag"),
+            ("image_identities", "md5 TEXT NOT NULL, identity TEXT NOT NULL", "identity"),
+            ("image_manual_features", "md5 TEXT NOT NULL, feature TEXT NOT NULL", "feature"),
+        ]:
+            self._con.execute(
+                f"""
+CREATE TABLE IF NOT EXISTS {table} (
+  {columns},
+  PRIMARY KEY (md5, {value_column})
+) STRICT;"""
+            )
+            self._con.execute(
+                f"CREATE INDEX IF NOT EXISTS {table}_idx_{value_column}_md5 ON {table} ({value_column}, md5);"
+            )
+        if exists is None:
+            # Database from before side tables existed, fill them from the joined columns
+            res = self._con.execute(
+                "SELECT md5, tags, tags_probs, identity, manual_features FROM gallery_index"
+            )
+            while True:
+                items = res.fetchmany(1000)
+                if not items:
+                    break
+                for md5, tags, tags_probs, identity, manual_features in items:
+                    self._replace_side_tables(
+                        md5,
+                        _parse_joined_tags(tags, tags_probs),
+                        [x for x in (identity or "").split(",") if x],
+                        [x for x in (manual_features or "").split(",") if x],
+                    )
+            self._con.commit()
+
+    def _replace_side_tables(
+        self,
+        md5: str,
+        tags: t.List[t.Tuple[str, float]],
+        identities: t.List[str],
+        manual_features: t.List[str],
+    ) -> None:
+        for table in ["image_tags", "image_identities", "image_manual_features"]:
+            self._con.execute(f"DELETE FROM {table} WHERE md5 = ?", (md5,))
+        if tags:
+            self._con.executemany(
+                "INSERT OR IGNORE INTO image_tags VALUES (?, ?, ?)", [(md5, tag, prob) for tag, prob in tags]
+            )
+        if identities:
+            self._con.executemany(
+                "INSERT OR IGNORE INTO image_identities VALUES (?, ?)", [(md5, x) for x in identities]
+            )
+        if manual_features:
+            self._con.executemany(
+                "INSERT OR IGNORE INTO image_manual_features VALUES (?, ?)",
+                [(md5, x) for x in manual_features],
+            )
+
+    def _init_fts(self) -> bool:
+        """Creates trigram index over columns used in `like` queries. Returns False if it's not supported."""
+        exists = self._con.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'gallery_index_fts'"
+        ).fetchone()
+        cols = ", ".join(_FTS_COLUMNS)
+        new_cols = ", ".join(f"NEW.{c}" for c in _FTS_COLUMNS)
+        old_cols = ", ".join(f"OLD.{c}" for c in _FTS_COLUMNS)
+        try:
+            self._con.execute(
+                f"""
+CREATE VIRTUAL TABLE IF NOT EXISTS gallery_index_fts USING fts5(
+  {cols},
+  content='gallery_index',
+  content_rowid='rowid',
+  tokenize='trigram'
+);"""
+            )
+        except sqlite3.OperationalError as e:
+            # SQLite is compiled without fts5, or it is too old to have trigram tokenizer
+            print("Full text search is not available, falling back to LIKE queries:", e, file=sys.stderr)
+            return False
+        self._con.execute(
+            f"""
+CREATE TRIGGER IF NOT EXISTS gallery_index_fts_on_insert
+AFTER INSERT ON gallery_index
+BEGIN
+  INSERT INTO gallery_index_fts (rowid, {cols}) VALUES (NEW.rowid, {new_cols});
+END;"""
+        )
+        self._con.execute(
+            f"""
+CREATE TRIGGER IF NOT EXISTS gallery_index_fts_on_delete
+AFTER DELETE ON gallery_index
+BEGIN
+  INSERT INTO gallery_index_fts (gallery_index_fts, rowid, {cols}) VALUES ('delete', OLD.rowid, {old_cols});
+END;"""
+        )
+        changed = " OR ".join(f"OLD.{c} IS NOT NEW.{c}" for c in _FTS_COLUMNS)
+        self._con.execute(
+            f"""
+CREATE TRIGGER IF NOT EXISTS gallery_index_fts_on_update
+AFTER UPDATE OF {cols} ON gallery_index
+FOR EACH ROW WHEN {changed}
+BEGIN
+  INSERT INTO gallery_index_fts (gallery_index_fts, rowid, {cols}) VALUES ('delete', OLD.rowid, {old_cols});
+  INSERT INTO gallery_index_fts (rowid, {cols}) VALUES (NEW.rowid, {new_cols});
+END;"""
+        )
+        if exists is None:
+            # Database from before the index existed, index rows that are already there
+            self._con.execute("INSERT INTO gallery_index_fts (gallery_index_fts) VALUES ('rebuild')")
+            self._con.commit()
+        return True
+
+    def _like_clause(self, column: str, pattern: str) -> t.Tuple[str, t.List[str | int | float | None]]:
+        if not self._fts or len(pattern.replace("%", "").replace("_", "")) < _FTS_MIN_PATTERN_LENGTH:
+            return (f"{column} like ?", [pattern])
+        # Index is used to find candidates, `like` on the actual column keeps exact semantics of plain `like`.
+        return (
+            f"rowid IN (SELECT rowid FROM gallery_index_fts WHERE {column} like ?) AND {column} like ?",
+            [pattern, pattern],
+        )
+
     def add(
         self,
         omg: Image,
     ) -> None:
         tags = sorted(list((omg.tags or {}).items()))
-        self._con.execute(
+        updated = self._con.execute(
             """
 INSERT INTO gallery_index VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, 0, ?, ?, ?, ?, ?, ?, ?)
 ON CONFLICT(md5) DO UPDATE SET
@@ -186,6 +340,7 @@ WHERE
     excluded.version >= gallery_index.version
     AND excluded.feature_last_update > gallery_index.feature_last_update
   )
+RETURNING md5
 """,
             (
                 omg.md5,
@@ -210,7 +365,9 @@ WHERE
                 None if omg.dimension is None else omg.dimension.height,
                 omg.file_size,
             ),
-        )
+        ).fetchone()
+        if updated is not None:
+            self._replace_side_tables(omg.md5, tags, omg.identities, omg.manual_features)
         self._con.commit()
 
     def old_versions_md5_total(
@@ -244,6 +401,12 @@ WHERE
         )
         self._con.commit()
 
+    def get_extensions(self, md5s: t.Sequence[str]) -> t.Dict[str, str]:
+        res = self._con.execute(
+            f"SELECT md5, extension FROM gallery_index WHERE md5 IN ({','.join('?' for _ in md5s)})", md5s
+        ).fetchall()
+        return dict(res)
+
     def _matching_query(
         self,
         select: str,
@@ -277,26 +440,28 @@ WHERE
             .replace("#timestamp#", timestamp_column)
             .replace("#timestamp_transformed#", f"timestamp != ({timestamp_column}) as timestamp_transformed")
         )
+        like_clauses = []
         if url.addr:
-            clauses.append("address_full like ?")
-            variables.append(f"%{url.addr}%")
+            like_clauses.append(self._like_clause("address_full", f"%{url.addr}%"))
         if url.cls:
-            clauses.append("classifications like ?")
-            variables.append(f"%{url.cls}%")
+            like_clauses.append(self._like_clause("classifications", f"%{url.cls}%"))
         if url.tag:
             for tag in url.tag.split(","):
-                clauses.append("tags like ?")
-                variables.append(f"%{tag}%")
+                like_clauses.append(self._like_clause("tags", f"%{tag}%"))
+        for txt, vrs in like_clauses:
+            clauses.append(txt)
+            variables.extend(vrs)
         if url.identity:
             for ident in url.identity.split(","):
-                clauses.append("identity like ?")
-                variables.append(f"%,{ident},%")
+                clauses.append("md5 IN (SELECT md5 FROM image_identities WHERE identity = ?)")
+                variables.append(ident)
         if url.directory:
             clauses.append("md5 in (SELECT md5 FROM directories WHERE directory like ?)")
             variables.append(f"{url.directory}%")
         if url.camera:
-            clauses.append("camera like ?")
-            variables.append(f"%{url.camera}%")
+            txt, vrs = self._like_clause("camera", f"%{url.camera}%")
+            clauses.append(txt)
+            variables.extend(vrs)
         if url.tsfrom:
             clauses.append(f"{timestamp_column} >= ?")
             variables.append(url.tsfrom)
@@ -308,7 +473,7 @@ WHERE
         if url.skip_being_annotated:
             clauses.append("being_annotated = 0")
         for txt, vrs in extra_clauses or []:
-            clauses.append(f"({txt})")
+            clauses.append(f"({txt.replace('#timestamp#', timestamp_column)})")
             variables.extend(vrs)
         if clauses:
             where = "WHERE " + " AND ".join(clauses)
@@ -339,24 +504,21 @@ WHERE
             else:
                 extra_clauses.append(("address_full IS NULL", []))
         if has_manual_location is not None:
-            if has_manual_location:
-                extra_clauses.append((f"manual_features LIKE '%,{ManualLocation.__name__},%'", []))
-            else:
-                extra_clauses.append((f"manual_features NOT LIKE '%,{ManualLocation.__name__},%'", []))
+            extra_clauses.append(self._manual_feature_clause(ManualLocation.__name__, has_manual_location))
         if has_manual_text is not None:
-            if has_manual_text:
-                extra_clauses.append((f"manual_features LIKE '%,{ManualText.__name__},%'", []))
-            else:
-                extra_clauses.append((f"manual_features NOT LIKE '%,{ManualText.__name__},%'", []))
+            extra_clauses.append(self._manual_feature_clause(ManualText.__name__, has_manual_text))
         if has_manual_date is not None:
-            if has_manual_date:
-                extra_clauses.append((f"manual_features LIKE '%,{ManualDate.__name__},%'", []))
-            else:
-                extra_clauses.append((f"manual_features NOT LIKE '%,{ManualDate.__name__},%'", []))
+            extra_clauses.append(self._manual_feature_clause(ManualDate.__name__, has_manual_date))
 
         (query, params) = self._matching_query("md5", url, extra_clauses)
         return [x for (x,) in self._con.execute(query, params).fetchall()]
 
+    def _manual_feature_clause(
+        self, feature: str, present: bool
+    ) -> t.Tuple[str, t.List[str | int | float | None]]:
+        negation = "" if present else "NOT "
+        return (f"md5 {negation}IN (SELECT md5 FROM image_manual_features WHERE feature = ?)", [feature])
+
     def get_date_clusters(
         self, url: SearchQuery, group_by: t.List[DateClusterGroupBy], buckets: int
     ) -> t.List[DateCluster]:
@@ -613,24 +775,24 @@ FROM
             select,
             variables,
         ) = self._matching_query(
-            "tags, classifications, address_name, address_country, camera, identity",
+            "md5, classifications, address_name, address_country, camera",
             url,
         )
         query = f"""
 WITH matched_images AS ({select})
-SELECT "total", null, COUNT(1) FROM matched_images
+SELECT 'total', null, COUNT(1) FROM matched_images
 UNION ALL
-SELECT "cls", classifications, COUNT(1) FROM matched_images GROUP BY classifications
+SELECT 'cls', classifications, COUNT(1) FROM matched_images GROUP BY classifications
 UNION ALL
-SELECT "tag", tags, COUNT(1) FROM matched_images GROUP BY tags
+SELECT 'tag', tag, COUNT(1) FROM matched_images JOIN image_tags USING (md5) GROUP BY tag
 UNION ALL
-SELECT "ident", identity, COUNT(1) FROM matched_images GROUP BY identity
+SELECT 'ident', identity, COUNT(1) FROM matched_images JOIN image_identities USING (md5) GROUP BY identity
 UNION ALL
-SELECT "addrn", address_name, COUNT(1) FROM matched_images WHERE address_name IS NOT NULL GROUP BY address_name
+SELECT 'addrn', address_name, COUNT(1) FROM matched_images WHERE address_name IS NOT NULL GROUP BY address_name
 UNION ALL
-SELECT "addrc", address_country, COUNT(1) FROM matched_images WHERE address_country IS NOT NULL GROUP BY address_country
+SELECT 'addrc', address_country, COUNT(1) FROM matched_images WHERE address_country IS NOT NULL GROUP BY address_country
 UNION ALL
-SELECT "cam", camera, COUNT(1) FROM matched_images GROUP BY camera
+SELECT 'cam', camera, COUNT(1) FROM matched_images GROUP BY camera
 {_extra_query_for_tests}
         """
         tag_cnt: t.Counter[str] = Counter()
@@ -669,14 +831,11 @@ SELECT "cam", camera, COUNT(1) FROM matched_images GROUP BY camera
                 elif type_ == "tag":
                     if not value:
                         continue
-                    for c in value.split(":"):
-                        tag_cnt[c] += count
+                    tag_cnt[value] += count
                 elif type_ == "ident":
                     if not value:
                         continue
-                    for c in value.split(","):
-                        if c:
-                            identity_cnt[c] += count
+                    identity_cnt[value] += count
                 elif type_ == "cam":
                     cameras_cnt[value] += count
                 elif type_ in [
@@ -692,32 +851,45 @@ SELECT "cam", camera, COUNT(1) FROM matched_images GROUP BY camera
         url: SearchQuery,
         sort_params: SortParams,
         gallery_paging: GalleryPaging,
-    ) -> t.Tuple[t.List[Image], bool]:
+    ) -> t.Tuple[t.List[Image], bool, t.Optional[str]]:
+        """Returns page of images, whether there is next page, and cursor for the next page if available."""
         # TODO: aggregations could be done separately
         actual_paging = gallery_paging.paging + 1
-        (
-            query,
-            variables,
-        ) = self._matching_query(
-            "md5, extension, #as#timestamp#, #timestamp_transformed#, tags, tags_probs, classifications, address_country, address_name, address_full, feature_last_update, latitude, longitude, altitude, version, manual_features, being_annotated, camera, software, identity, width, height, file_size",
-            url,
-        )
+        select = "md5, extension, #as#timestamp#, #timestamp_transformed#, tags, tags_probs, classifications, address_country, address_name, address_full, feature_last_update, latitude, longitude, altitude, version, manual_features, being_annotated, camera, software, identity, width, height, file_size"
+        order = sort_params.order.value
         sort_by = None
         if sort_params.sort_by == SortBy.TIMESTAMP:
-            sort_by = "timestamp"
+            sort_by = f"timestamp {order}, md5 {order}"
         elif sort_params.sort_by == SortBy.RANDOM:
-            sort_by = "RANDOM()"
+            sort_by = f"RANDOM() {order}"
         else:
             assert_never(sort_params.sort_by)
 
-        if gallery_paging.paging:
-            query = f"{query}\nORDER BY {sort_by}\n{sort_params.order.value} LIMIT {actual_paging}\nOFFSET {gallery_paging.paging * gallery_paging.page}"
-        res = self._con.execute(
-            query,
-            variables,
-        )
-        items = res.fetchall()
+        offset = gallery_paging.paging * gallery_paging.page
+        segments: t.List[t.List[t.Tuple[str, t.List[t.Union[str, int, float, None]]]]] = [[]]
+        if gallery_paging.paging and gallery_paging.cursor and sort_params.sort_by == SortBy.TIMESTAMP:
+            segments = _seek_segments(GalleryCursor.decode(gallery_paging.cursor), sort_params.order)
+            offset = 0
+        items: t.List[t.Tuple[t.Any, ...]] = []
+        for extra_clauses in segments:
+            (
+                query,
+                variables,
+            ) = self._matching_query(select, url, extra_clauses)
+            if gallery_paging.paging:
+                query = f"{query}\nORDER BY {sort_by}\nLIMIT {actual_paging - len(items)}\nOFFSET {offset}"
+            res = self._con.execute(
+                query,
+                variables,
+            )
+            items.extend(res.fetchall())
+            if gallery_paging.paging and len(items) >= actual_paging:
+                break
         has_extra_data = len(items) > gallery_paging.paging
+        next_cursor = None
+        if has_extra_data and gallery_paging.paging and sort_params.sort_by == SortBy.TIMESTAMP:
+            last = items[gallery_paging.paging - 1]
+            next_cursor = GalleryCursor(last[2], last[0]).encode()
         output = []
         for (
             md5,
@@ -783,7 +955,7 @@ SELECT "cam", camera, COUNT(1) FROM matched_images GROUP BY camera
                     version,
                 )
             )
-        return output, has_extra_data
+        return output, has_extra_data, next_cursor
 
     def get_matching_directories(self, url: SearchQuery) -> t.List[DirectoryStats]:
         (match_query, match_params) = self._matching_query(
@@ -812,6 +984,34 @@ GROUP BY directory
         ]
 
 
+def _seek_segments(
+    cursor: GalleryCursor, order: SortOrder
+) -> t.List[t.List[t.Tuple[str, t.List[t.Union[str, int, float, None]]]]]:
+    """
+    Returns clauses selecting images after the cursor, in order in which they should be queried.
+    NULL timestamps are sorted first, and row value comparison skips them, so they are queried separately.
+    """
+    if order == SortOrder.ASC:
+        operator = ">"
+    elif order == SortOrder.DESC:
+        operator = "<"
+    else:
+        assert_never(order)
+    if cursor.timestamp is None:
+        nulls: t.List[t.Tuple[str, t.List[t.Union[str, int, float, None]]]] = [
+            (f"#timestamp# IS NULL AND md5 {operator} ?", [cursor.md5])
+        ]
+        if order == SortOrder.ASC:
+            return [nulls, [("#timestamp# IS NOT NULL", [])]]
+        return [nulls]
+    not_nulls: t.List[t.Tuple[str, t.List[t.Union[str, int, float, None]]]] = [
+        (f"(#timestamp#, md5) {operator} (?, ?)", [cursor.timestamp, cursor.md5])
+    ]
+    if order == SortOrder.DESC:
+        return [not_nulls, [("#timestamp# IS NULL", [])]]
+    return [not_nulls]
+
+
 def round_to_significant_digits(value: float, significant_digits: int) -> float:
     if value == 0:
         return value
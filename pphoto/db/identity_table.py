@@ -5,6 +5,8 @@ from pphoto.db.types_identity import IdentityRowPayload
 
 
 class IdentityTable:
+    """Identities are added by user, so writes are flushed immediately and nothing is lost on crash."""
+
     def __init__(self, connection: PhotosConnection) -> None:
         self._con = connection
         self._init_db()
@@ -54,6 +56,7 @@ ON CONFLICT(identity) DO UPDATE SET
             ),
         )
         self._con.commit()
+        self._con.flush()
 
     def top_identities(
         self,
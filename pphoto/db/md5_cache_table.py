@@ -0,0 +1,78 @@
+import typing as t
+
+from pphoto.db.connection import PhotosConnection
+
+
+class FileStat(t.NamedTuple):
+    size: int
+    mtime_ns: int
+    inode: int
+
+
+class Md5CacheTable:
+    """
+    Md5 of files by their path and stat, so that unchanged files are not hashed again. Writes are batched by
+    connection, lost entries are just recomputed.
+    """
+
+    def __init__(self, connection: PhotosConnection) -> None:
+        self._con = connection
+        self._init_db()
+
+    def _init_db(
+        self,
+    ) -> None:
+        self._con.execute(
+            """
+CREATE TABLE IF NOT EXISTS md5_cache (
+  path TEXT NOT NULL PRIMARY KEY,
+  size INTEGER NOT NULL,
+  mtime_ns INTEGER NOT NULL,
+  inode INTEGER NOT NULL,
+  md5 TEXT NOT NULL
+) STRICT;
+        """
+        )
+
+    def get(self, path: str, stat: FileStat) -> t.Optional[str]:
+        res = self._con.execute(
+            "SELECT md5 FROM md5_cache WHERE path = ? AND size = ? AND mtime_ns = ? AND inode = ?",
+            (path, stat.size, stat.mtime_ns, stat.inode),
+        ).fetchone()
+        if res is None:
+            return None
+        return str(res[0])
+
+    def add(self, path: str, stat: FileStat, md5: str) -> None:
+        self._con.execute(
+            """
+INSERT INTO md5_cache VALUES (?, ?, ?, ?, ?)
+ON CONFLICT(path) DO UPDATE SET
+  size=excluded.size,
+  mtime_ns=excluded.mtime_ns,
+  inode=excluded.inode,
+  md5=excluded.md5
+            """,
+            (path, stat.size, stat.mtime_ns, stat.inode, md5),
+        )
+        self._con.commit()
+
+    def remove(self, path: str) -> None:
+        self._con.execute("DELETE FROM md5_cache WHERE path = ?", (path,))
+        self._con.commit()
+
+    def move(self, old_path: str, new_path: str) -> None:
+        """Renamed file keeps its md5, it's still checked against stat of the file at the new path"""
+        self._con.execute("UPDATE OR REPLACE md5_cache SET path = ? WHERE path = ?", (new_path, old_path))
+        self._con.commit()
+
+    def paths(self, after: str, limit: int) -> t.List[str]:
+        """Cached paths ordered by path, starting after given one. Used to prune the cache in chunks."""
+        res = self._con.execute(
+            "SELECT path FROM md5_cache WHERE path > ? ORDER BY path LIMIT ?", (after, limit)
+        ).fetchall()
+        return [str(path) for (path,) in res]
+
+    def remove_many(self, paths: t.List[str]) -> None:
+        self._con.executemany("DELETE FROM md5_cache WHERE path = ?", [(path,) for path in paths])
+        self._con.commit()
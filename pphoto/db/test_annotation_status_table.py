@@ -0,0 +1,80 @@
+import typing as t
+import unittest
+
+from pphoto.data_model.base import PathWithMd5
+from pphoto.db.annotation_status_table import AnnotationStatusTable
+from pphoto.db.connection import PhotosConnection
+from pphoto.db.features_table import FeaturesTable
+from pphoto.db.files_table import FilesTable
+from pphoto.db.types_file import ManagedLifecycle
+
+
+def connection() -> PhotosConnection:
+    return PhotosConnection(":memory:")
+
+
+def missing(table: AnnotationStatusTable, job: str, chunk_size: int = 500) -> t.List[PathWithMd5]:
+    return sorted((x for chunk in table.missing(job, chunk_size) for x in chunk), key=lambda x: x.path)
+
+
+class TestAnnotationStatusTable(unittest.TestCase):
+    def test_create_table(self) -> None:
+        conn = connection()
+        FeaturesTable(conn)
+        FilesTable(conn)
+        AnnotationStatusTable(conn)
+        AnnotationStatusTable(conn)
+
+    def test_status_is_recomputed_on_version_change(self) -> None:
+        conn = connection()
+        features = FeaturesTable(conn)
+        files = FilesTable(conn)
+        files.add_or_update("a", "M1", None, ManagedLifecycle.NOT_MANAGED, None)
+        files.add_or_update("b", "M2", None, ManagedLifecycle.NOT_MANAGED, None)
+        features.add(b"p", None, "T1", "M1", 1)
+        features.add(b"p", None, "T2", "M1", 1)
+        features.add(b"p", None, "T1", "M2", 1)
+        status = AnnotationStatusTable(conn)
+
+        self.assertTrue(status.set_required("job", [("T1", 1), ("T2", 1)]))
+        self.assertFalse(status.set_required("job", [("T2", 1), ("T1", 1)]))
+        self.assertEqual(missing(status, "job"), [PathWithMd5("b", "M2")])
+        self.assertTrue(status.set_required("job", [("T1", 2)]))
+        self.assertEqual(missing(status, "job"), [PathWithMd5("a", "M1"), PathWithMd5("b", "M2")])
+        self.assertEqual(status.missing_total("other"), 0)
+
+    def test_status_is_updated_by_writes(self) -> None:
+        conn = connection()
+        features = FeaturesTable(conn)
+        files = FilesTable(conn)
+        status = AnnotationStatusTable(conn)
+        status.set_required("job", [("T1", 1), ("T2", 1)])
+        status.set_required("other", [("T3", 1)])
+
+        files.add_or_update("a", "M1", None, ManagedLifecycle.NOT_MANAGED, None)
+        files.add_or_update("b", "M1", None, ManagedLifecycle.NOT_MANAGED, None)
+        files.add_or_update("c", "M2", None, ManagedLifecycle.NOT_MANAGED, None)
+        self.assertEqual(status.missing_total("job"), 2)
+        self.assertEqual(
+            missing(status, "job", chunk_size=1),
+            [PathWithMd5("a", "M1"), PathWithMd5("b", "M1"), PathWithMd5("c", "M2")],
+        )
+
+        features.add(b"p", None, "T1", "M1", 1)
+        features.add(b"p", None, "T2", "M1", 0)
+        self.assertEqual(status.missing_total("job"), 2)
+        features.add(None, b"error", "T2", "M1", 1)
+        self.assertEqual(missing(status, "job"), [PathWithMd5("c", "M2")])
+        self.assertEqual(status.missing_total("other"), 2)
+
+        # File with already annotated md5
+        features.add(b"p", None, "T3", "M3", 1)
+        files.add_or_update("d", "M3", None, ManagedLifecycle.NOT_MANAGED, None)
+        self.assertEqual(missing(status, "job"), [PathWithMd5("c", "M2"), PathWithMd5("d", "M3")])
+        self.assertEqual(
+            missing(status, "other"), [PathWithMd5("a", "M1"), PathWithMd5("b", "M1"), PathWithMd5("c", "M2")]
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
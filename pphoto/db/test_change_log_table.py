@@ -0,0 +1,76 @@
+import unittest
+
+from pphoto.db.change_log_table import ChangeLogTable
+from pphoto.db.connection import PhotosConnection
+from pphoto.db.features_table import FeaturesTable
+from pphoto.db.files_table import FilesTable
+from pphoto.db.types_file import ManagedLifecycle
+
+
+def connection() -> PhotosConnection:
+    return PhotosConnection(":memory:")
+
+
+class TestChangeLogTable(unittest.TestCase):
+    def test_create_and_migrate_table(self) -> None:
+        conn = connection()
+        FeaturesTable(conn)
+        FilesTable(conn)
+        ChangeLogTable(conn)
+        ChangeLogTable(conn)
+
+    def test_changes_are_logged(self) -> None:
+        conn = connection()
+        features = FeaturesTable(conn)
+        files = FilesTable(conn)
+        log = ChangeLogTable(conn)
+        self.assertEqual(log.changes(0, ["T1"]), (set(), 0))
+
+        features.add(b"p", None, "T1", "M1", 0)
+        features.add(b"p", None, "T2", "M2", 0)
+        files.add_or_update("a", "M3", None, ManagedLifecycle.NOT_MANAGED, None)
+        files.add_or_update("b", "M4", "og/b", ManagedLifecycle.IMPORTED, None)
+        md5s, position = log.changes(0, ["T1"])
+        self.assertEqual(md5s, {"M1", "M3"})
+        self.assertEqual(position, 3)
+        self.assertEqual(log.left(0), 3)
+        self.assertEqual(log.left(position), 0)
+
+        # Undirtying is not a change
+        features.undirty("M1", ["T1"], 1e20)
+        self.assertEqual(log.changes(position, ["T1"]), (set(), position))
+        # Same payload is not a change
+        features.add(b"p", None, "T1", "M1", 0)
+        self.assertEqual(log.changes(position, ["T1"]), (set(), position))
+        features.add(b"new", None, "T1", "M1", 0)
+        files.set_lifecycle("b", ManagedLifecycle.SYNCED, None)
+        self.assertEqual(log.changes(position, ["T1"]), ({"M1", "M4"}, position + 2))
+
+    def test_positions_and_prune(self) -> None:
+        conn = connection()
+        features = FeaturesTable(conn)
+        FilesTable(conn)
+        log = ChangeLogTable(conn)
+        for md5 in ["M1", "M2", "M3"]:
+            features.add(b"p", None, "T1", md5, 0)
+        self.assertEqual(log.position("consumer"), 0)
+        log.set_position("consumer", 2)
+        self.assertEqual(log.position("consumer"), 2)
+        log.prune()
+        self.assertEqual(log.changes(0, ["T1"]), ({"M3"}, 3))
+        self.assertEqual(log.left(2), 1)
+
+    def test_dirty_rows_are_logged_for_old_database(self) -> None:
+        conn = connection()
+        features = FeaturesTable(conn)
+        files = FilesTable(conn)
+        features.add(b"p", None, "T1", "M1", 0)
+        features.add(b"p", None, "T1", "M2", 0)
+        features.undirty("M2", ["T1"], 1e20)
+        files.add_or_update("a", "M3", None, ManagedLifecycle.NOT_MANAGED, None)
+        log = ChangeLogTable(conn)
+        self.assertEqual(log.changes(0, ["T1"]), ({"M1", "M3"}, 2))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,70 @@
+import os
+import tempfile
+import unittest
+from datetime import timedelta
+
+from pphoto.db.connection import PhotosConnection
+
+
+def count(conn: PhotosConnection) -> int:
+    res = conn.execute("SELECT COUNT(*) FROM numbers").fetchone()
+    assert res is not None
+    return int(res[0])
+
+
+class TestConnectionBatching(unittest.TestCase):
+    def setUp(self) -> None:
+        # pylint: disable-next = consider-using-with
+        self._dir = tempfile.TemporaryDirectory()
+        path = os.path.join(self._dir.name, "photos.db")
+        self.writer = PhotosConnection(path, batch_size=3, batch_max_age=timedelta(hours=1))
+        self.reader = PhotosConnection(path)
+        self.writer.execute("CREATE TABLE IF NOT EXISTS numbers (x INTEGER)")
+        self.writer.flush()
+
+    def tearDown(self) -> None:
+        self._dir.cleanup()
+
+    def insert(self, x: int) -> None:
+        self.writer.execute("INSERT INTO numbers VALUES (?)", (x,))
+        self.writer.commit()
+
+    def test_commits_once_batch_is_full(self) -> None:
+        self.insert(1)
+        self.insert(2)
+        self.assertEqual(count(self.writer), 2)
+        self.assertEqual(count(self.reader), 0)
+        self.insert(3)
+        self.assertEqual(count(self.reader), 3)
+
+    def test_flush(self) -> None:
+        self.insert(1)
+        self.assertEqual(count(self.reader), 0)
+        self.writer.flush()
+        self.assertEqual(count(self.reader), 1)
+
+    def test_commits_old_writes(self) -> None:
+        # pylint: disable-next = protected-access
+        self.writer._batch_max_age = timedelta(seconds=0)
+        self.insert(1)
+        self.assertEqual(count(self.reader), 1)
+
+    def test_flush_old(self) -> None:
+        self.insert(1)
+        self.assertGreater(self.writer.flush_old(), timedelta(minutes=59))
+        self.assertEqual(count(self.reader), 0)
+        # pylint: disable-next = protected-access
+        self.writer._batch_max_age = timedelta(seconds=0)
+        self.writer.flush_old()
+        self.assertEqual(count(self.reader), 1)
+
+    def test_failed_transaction_keeps_pending_writes(self) -> None:
+        self.insert(1)
+        with self.assertRaises(ValueError):
+            with self.writer.transaction():
+                self.insert(2)
+                raise ValueError("rollback")
+        self.assertEqual(count(self.reader), 1)
+        with self.writer.transaction():
+            self.insert(3)
+        self.assertEqual(count(self.reader), 2)
@@ -0,0 +1,28 @@
+import unittest
+
+from pphoto.db.connection import PhotosConnection
+from pphoto.db.directory_snapshots_table import DirectorySnapshotsTable
+from pphoto.utils.files import DirectorySnapshot
+
+
+def connection() -> PhotosConnection:
+    return PhotosConnection(":memory:")
+
+
+class TestDirectorySnapshotsTable(unittest.TestCase):
+    def test_create_and_migrate_table(self) -> None:
+        conn = connection()
+        DirectorySnapshotsTable(conn)
+        DirectorySnapshotsTable(conn)
+
+    def test_replace_all(self) -> None:
+        table = DirectorySnapshotsTable(connection())
+        self.assertEqual(table.get_all(), {})
+        table.replace_all({"/a": DirectorySnapshot(1, 2), "/a/b": DirectorySnapshot(3, 4)})
+        self.assertEqual(table.get_all(), {"/a": DirectorySnapshot(1, 2), "/a/b": DirectorySnapshot(3, 4)})
+        table.replace_all({"/a": DirectorySnapshot(5, 6)})
+        self.assertEqual(table.get_all(), {"/a": DirectorySnapshot(5, 6)})
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,115 @@
+import os
+import tempfile
+import typing as t
+import unittest
+
+from pphoto.data_model.face import Face, FaceEmbeddings, ImageResolution, Position
+from pphoto.db.connection import PhotosConnection
+from pphoto.db.face_clusters_table import FaceClustersTable
+from pphoto.db.face_index import FaceIndex
+from pphoto.db.features_table import FeaturesTable
+
+
+def embedding(*values: float) -> t.List[float]:
+    return [*values, *([0.0] * (128 - len(values)))]
+
+
+def embeddings(*faces: t.List[float]) -> FaceEmbeddings:
+    return FaceEmbeddings(
+        ImageResolution(100, 100),
+        [Face(Position(i, 0, i + 10, 10, None), face) for i, face in enumerate(faces)],
+    )
+
+
+class TestFaceIndex(unittest.TestCase):
+    def setUp(self) -> None:
+        self.directory = tempfile.TemporaryDirectory()  # pylint: disable = consider-using-with
+        self.path = os.path.join(self.directory.name, "faces.f32")
+        self.connection = PhotosConnection(os.path.join(self.directory.name, "photos.db"))
+        self.index = FaceIndex(self.connection, self.path)
+
+    def tearDown(self) -> None:
+        self.directory.cleanup()
+
+    def test_empty(self) -> None:
+        self.assertEqual(self.index.search(embedding(1.0), 5), [])
+
+    def test_search_l2(self) -> None:
+        self.index.add("M1", embeddings(embedding(1.0), embedding(0.0, 1.0)))
+        self.index.add("M2", embeddings(embedding(0.9)))
+        found = self.index.search(embedding(1.0), 2)
+        self.assertEqual([(x.md5, x.position.left) for x in found], [("M1", 0), ("M2", 0)])
+        self.assertAlmostEqual(found[0].distance, 0.0, places=5)
+        self.assertAlmostEqual(found[1].distance, 0.1, places=5)
+        self.assertEqual(len(self.index.search(embedding(1.0), 10)), 3)
+
+    def test_search_cosine(self) -> None:
+        self.index.add("M1", embeddings(embedding(3.0, 0.1), embedding(0.0, 1.0)))
+        found = self.index.search(embedding(1.0), 1, "cosine")
+        self.assertEqual([(x.md5, x.position.left) for x in found], [("M1", 0)])
+        self.assertLess(found[0].distance, 0.01)
+
+    def test_replace_faces_of_md5(self) -> None:
+        self.index.add("M1", embeddings(embedding(1.0)))
+        self.assertEqual(len(self.index.search(embedding(1.0), 10)), 1)
+        self.index.add("M1", embeddings(embedding(0.0, 1.0), embedding(0.0, 2.0)))
+        found = self.index.search(embedding(1.0), 10)
+        self.assertEqual([x.position.left for x in found], [0, 1])
+        self.assertAlmostEqual(found[0].distance, 2**0.5, places=5)
+
+    def test_other_reader_sees_appended_faces(self) -> None:
+        reader = FaceIndex(PhotosConnection(self.connection.path), self.path)
+        self.index.add("M1", embeddings(embedding(1.0)))
+        self.assertEqual([x.md5 for x in reader.search(embedding(1.0), 10)], ["M1"])
+        self.index.add("M2", embeddings(embedding(2.0)))
+        self.assertEqual([x.md5 for x in reader.search(embedding(2.0), 10)], ["M2", "M1"])
+
+    def test_partial_row_is_overwritten(self) -> None:
+        self.index.add("M1", embeddings(embedding(1.0)))
+        with open(self.path, "ab") as f:
+            f.write(b"abc")
+        self.index.add("M2", embeddings(embedding(2.0)))
+        self.assertEqual(os.path.getsize(self.path), 2 * 128 * 4)
+        self.assertAlmostEqual(self.index.search(embedding(2.0), 1)[0].distance, 0.0, places=5)
+
+    def test_sync_from_features(self) -> None:
+        features = FeaturesTable(self.connection)
+        version = FaceEmbeddings.current_version()
+        features.add(embeddings(embedding(1.0)).to_bytes(), None, "FaceEmbeddings", "M1", version)
+        features.add(None, b"error", "FaceEmbeddings", "M2", version)
+        features.add(embeddings().to_bytes(), None, "FaceEmbeddings", "M3", version)
+        self.assertEqual(self.index.sync(), 2)
+        self.assertEqual(self.index.sync(), 0)
+        self.assertEqual([x.md5 for x in self.index.search(embedding(1.0), 10)], ["M1"])
+
+    def test_compact(self) -> None:
+        reader = FaceIndex(PhotosConnection(self.connection.path), self.path)
+        clusters = FaceClustersTable(self.connection)
+        self.index.add("M1", embeddings(embedding(1.0)))
+        self.index.add("M2", embeddings(embedding(2.0), embedding(3.0)))
+        self.index.add("M1", embeddings(embedding(4.0)))
+        clusters.update({1: 10, 2: 11, 3: 12}, [])
+        self.assertEqual(reader.search(embedding(4.0), 1)[0].md5, "M1")
+        self.assertEqual(self.index.unreferenced(), 1)
+        self.assertEqual(self.index.compact(min_unreferenced=0.5), 0)
+
+        self.assertEqual(self.index.compact(), 1)
+        self.assertEqual(self.index.unreferenced(), 0)
+        self.assertFalse(os.path.exists(self.path))
+        self.assertEqual(os.path.getsize(f"{self.path}.1"), 3 * 128 * 4)
+        found = reader.search(embedding(4.0), 10)
+        self.assertEqual([(x.md5, x.position.left) for x in found], [("M1", 0), ("M2", 1), ("M2", 0)])
+        self.assertAlmostEqual(found[0].distance, 0.0, places=5)
+        # Clusters move with their faces
+        self.assertEqual(
+            clusters.clusters_of(["M1", "M2"]),
+            {
+                ("M2", Position(0, 0, 10, 10, None)): 10,
+                ("M2", Position(1, 0, 11, 10, None)): 11,
+                ("M1", Position(0, 0, 10, 10, None)): 12,
+            },
+        )
+        # Writer appends to the new file
+        self.index.add("M3", embeddings(embedding(5.0)))
+        self.assertEqual([x.md5 for x in reader.search(embedding(5.0), 1)], ["M3"])
+        self.assertEqual(os.path.getsize(f"{self.path}.1"), 4 * 128 * 4)
@@ -152,6 +152,45 @@ class TestFeaturesTable(unittest.TestCase):
         dirty = sorted(list(table.dirty_md5s(["T1", "T2", "T3"])))
         self.assertListEqual(dirty, [])
 
+    def test_get_payloads(self) -> None:
+        table = FeaturesTable(connection())
+        table.add(b"p1", None, "T1", "M1", 0)
+        table.add(None, b"e2", "T2", "M1", 1)
+        table.add(b"p3", None, "T1", "M2", 0)
+        table.add(b"p4", None, "T3", "M2", 0)
+        table.add(b"p5", None, "T1", "M3", 0)
+        ret = table.get_payloads(["T1", "T2"], ["M1", "M2", "M4"])
+        self.assertListEqual(sorted(ret.keys()), [("T1", "M1"), ("T1", "M2"), ("T2", "M1")])
+        for (type_, md5), payload in ret.items():
+            self.assertEqual(payload, table.get_payload(type_, md5))
+
+    def test_migrate_payloads(self) -> None:
+        table = FeaturesTable(connection())
+        table.add(b"p1", None, "T1", "M1", 0)
+        table.add(None, b"e2", "T1", "M2", 0)
+        table.add(b"bad", None, "T1", "M3", 0)
+        table.add(b"p4", None, "T1", "M4", 1)
+        table.add(b"p5", None, "T2", "M1", 0)
+
+        def convert(payload: bytes) -> bytes:
+            if payload == b"bad":
+                raise ValueError("Unable to convert")
+            return payload.upper()
+
+        self.assertEqual(table.migrate_payloads("T1", 0, 1, convert), 2)
+        got = table.get_payloads(["T1", "T2"], ["M1", "M2", "M3", "M4"])
+        self.assertEqual(
+            {key: (p.payload, p.error, p.version) for key, p in got.items()},
+            {
+                ("T1", "M1"): (b"P1", None, 1),
+                ("T1", "M2"): (None, b"e2", 1),
+                ("T1", "M3"): (b"bad", None, 0),
+                ("T1", "M4"): (b"p4", None, 1),
+                ("T2", "M1"): (b"p5", None, 0),
+            },
+        )
+        self.assertEqual(table.migrate_payloads("T1", 0, 1, convert), 0)
+
 
 if __name__ == "__main__":
     unittest.main()
@@ -161,6 +161,27 @@ class TestFilesTable(unittest.TestCase):
             ],
         )
 
+    def test_by_md5s(self) -> None:
+        table = FilesTable(connection())
+        table.add_or_update("bar", "wat", "og/bar", ManagedLifecycle.IMPORTED, None)
+        table.add_or_update("foo", "wat", None, ManagedLifecycle.NOT_MANAGED, None)
+        table.add_or_update("baz", "other", None, ManagedLifecycle.NOT_MANAGED, None)
+        table.add_or_update("should not be found", "random stuff", None, ManagedLifecycle.NOT_MANAGED, None)
+        ret = table.by_md5s(["wat", "other", "missing"])
+        self.assertListEqual(sorted(ret.keys()), ["missing", "other", "wat"])
+        for md5 in ["wat", "other", "missing"]:
+            self.assertListEqual(
+                sanitize_list(sorted(ret[md5], key=lambda x: x.file)),
+                sanitize_list(sorted(table.by_md5(md5), key=lambda x: x.file)),
+            )
+
+    def test_known_paths(self) -> None:
+        table = FilesTable(connection())
+        table.add_or_update("bar", "wat", None, ManagedLifecycle.NOT_MANAGED, None)
+        table.add_or_update("foo", "wat", None, ManagedLifecycle.NOT_MANAGED, None)
+        self.assertEqual(table.known_paths(["foo", "missing", "bar"]), {"foo", "bar"})
+        self.assertEqual(table.known_paths([]), set())
+
     def test_by_managed_lifecycle(self) -> None:
         table = FilesTable(connection())
         self.assert_table_without_paths(table, ["foo", "bar", "foobar"])
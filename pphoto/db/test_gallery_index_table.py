@@ -7,7 +7,7 @@ from pphoto.db.directories_table import DirectoriesTable
 from pphoto.db.gallery_index_table import GalleryIndexTable, WrongAggregateTypeReturned
 from pphoto.db.types_image import Image, ImageAddress, ImageAggregation, ImageDims
 from pphoto.db.types_location import LocPoint, LocationCluster, LocationBounds
-from pphoto.gallery.url import SearchQuery, GalleryPaging, SortParams
+from pphoto.gallery.url import SearchQuery, GalleryPaging, InvalidCursor, SortParams, SortBy, SortOrder
 
 
 def connection() -> GalleryConnection:
@@ -280,6 +280,137 @@ class TestGalleryIndexTable(unittest.TestCase):
         )
         self.assertListEqual(ret, [])
 
+    def test_full_text_search_matches_like(self) -> None:
+        con = connection()
+        table = GalleryIndexTable(con)
+        like_table = GalleryIndexTable(con, full_text_search=False)
+        table.add(_image("M1", tags={"dog": 0.9, "cat - tabby": 0.7}, camera=None))
+        table.add(_image("M2", tags={"cathedral": 0.8}, caption="Big Church", address="Praha, Czechia"))
+        table.add(_image("M3", tags={}, caption=None, camera="Nikon d80", address=None))
+        # Update should be also reflected in the index
+        table.add(
+            _image("M3", tags={"bird": 1.0}, caption=None, camera="Nikon d80", address=None, version=10)
+        )
+        queries = [
+            SearchQuery(tag="cat"),
+            SearchQuery(tag="ca"),
+            SearchQuery(tag="cat,tabby"),
+            SearchQuery(tag="bird"),
+            SearchQuery(cls="church"),
+            SearchQuery(cls="fishy", addr="portlandia"),
+            SearchQuery(addr="Praha, Cz"),
+            SearchQuery(camera="nikon"),
+            SearchQuery(camera="e-5"),
+            SearchQuery(tag="missing"),
+        ]
+        for query in queries:
+            self.assertListEqual(
+                sorted(table.get_matching_md5(query)),
+                sorted(like_table.get_matching_md5(query)),
+                query,
+            )
+        self.assertListEqual(sorted(table.get_matching_md5(SearchQuery(tag="cat"))), ["M1", "M2"])
+        self.assertListEqual(table.get_matching_md5(SearchQuery(tag="bird")), ["M3"])
+        self.assertListEqual(table.get_matching_md5(SearchQuery(camera="NIKON")), ["M3"])
+
+    def test_full_text_search_is_built_for_old_database(self) -> None:
+        con = connection()
+        table = GalleryIndexTable(con, full_text_search=False)
+        table.add(_image("M1", tags={"dog": 0.9}))
+        table.add(_image("M2", tags={"cat": 0.9}))
+        table = GalleryIndexTable(con)
+        self.assertListEqual(table.get_matching_md5(SearchQuery(tag="cat")), ["M2"])
+        table.add(_image("M3", tags={"cat": 0.9}))
+        self.assertListEqual(sorted(table.get_matching_md5(SearchQuery(tag="cat"))), ["M2", "M3"])
+
+    def test_identities_and_manual_features(self) -> None:
+        con = connection()
+        table = GalleryIndexTable(con)
+        table.add(_image("M1", identity=["Alice", "Bob"]))
+        table.add(_image("M2", identity=["Bob"]))
+        table.add(_image("M3", identity=["Bobby"]))
+        self.assertListEqual(sorted(table.get_matching_md5(SearchQuery(identity="Bob"))), ["M1", "M2"])
+        self.assertListEqual(table.get_matching_md5(SearchQuery(identity="Bob,Alice")), ["M1"])
+        self.assertListEqual(table.get_matching_md5(SearchQuery(identity="Ali")), [])
+        self.assertListEqual(
+            sorted(table.get_matching_md5(SearchQuery(), has_manual_location=True)), ["M1", "M2", "M3"]
+        )
+        self.assertListEqual(table.get_matching_md5(SearchQuery(), has_manual_location=False), [])
+        self.assertListEqual(table.get_matching_md5(SearchQuery(), has_manual_text=True), [])
+        self.assertEqual(
+            table.get_aggregate_stats(SearchQuery()).identities, {"Alice": 1, "Bob": 2, "Bobby": 1}
+        )
+        self.assertEqual(
+            table.get_aggregate_stats(SearchQuery(identity="Alice")).identities, {"Alice": 1, "Bob": 1}
+        )
+        # Updated image should replace old identities
+        table.add(_image("M1", identity=["Alice"], dependent_features_last_update=10))
+        self.assertListEqual(table.get_matching_md5(SearchQuery(identity="Bob")), ["M2"])
+        # Old data should be ignored
+        table.add(_image("M1", identity=["Bob"], dependent_features_last_update=5))
+        self.assertListEqual(table.get_matching_md5(SearchQuery(identity="Bob")), ["M2"])
+
+    def test_side_tables_are_filled_for_old_database(self) -> None:
+        con = connection()
+        table = GalleryIndexTable(con)
+        table.add(_image("M1", tags={"dog": 0.5, "cat": 0.25}, identity=["Alice"]))
+        table.add(_image("M2", tags={}, identity=[]))
+        table.add(_image("M3", tags={"bird": 0.5}, identity=[]))
+        table.add(_image("M4", tags={"fish": 0.5}, identity=[]))
+        # Rows with missing or malformed probabilities should not break the migration
+        con.execute("UPDATE gallery_index SET tags_probs = '' WHERE md5 = 'M3'")
+        con.execute("UPDATE gallery_index SET tags = 'fish:cow', tags_probs = 'bad:0.5' WHERE md5 = 'M4'")
+        for side_table in ["image_tags", "image_identities", "image_manual_features"]:
+            con.execute(f"DROP TABLE {side_table}")
+        table = GalleryIndexTable(con)
+        stats = table.get_aggregate_stats(SearchQuery())
+        self.assertEqual(stats.tag, {"dog": 1, "cat": 1, "cow": 1})
+        self.assertEqual(stats.identities, {"Alice": 1})
+        self.assertListEqual(table.get_matching_md5(SearchQuery(identity="Alice")), ["M1"])
+        self.assertListEqual(
+            sorted(table.get_matching_md5(SearchQuery(), has_manual_location=True)), ["M1", "M2", "M3", "M4"]
+        )
+
+    def test_cursor_paging(self) -> None:
+        table = GalleryIndexTable(connection())
+        for i in range(20):
+            table.add(_image(f"M{i:02}", datetm=None if i % 3 == 0 else datetime(2024, 1, 1 + i % 5)))
+        for order in [SortOrder.ASC, SortOrder.DESC]:
+            sort = SortParams(SortBy.TIMESTAMP, order)
+            expected = [
+                x.md5 for x in table.get_matching_images(SearchQuery(), sort, GalleryPaging(0, 1000))[0]
+            ]
+            self.assertEqual(len(expected), 20)
+            for paging in [1, 3, 7, 20]:
+                offset_paged: t.List[str] = []
+                cursor_paged: t.List[str] = []
+                cursor = None
+                for page in range(30):
+                    omgs, has_next_page, _ = table.get_matching_images(
+                        SearchQuery(), sort, GalleryPaging(page, paging)
+                    )
+                    offset_paged.extend(x.md5 for x in omgs)
+                    if not has_next_page:
+                        break
+                while True:
+                    omgs, has_next_page, cursor = table.get_matching_images(
+                        SearchQuery(), sort, GalleryPaging(0, paging, cursor)
+                    )
+                    cursor_paged.extend(x.md5 for x in omgs)
+                    if not has_next_page:
+                        self.assertIsNone(cursor)
+                        break
+                self.assertListEqual(offset_paged, expected, (order, paging))
+                self.assertListEqual(cursor_paged, expected, (order, paging))
+
+    def test_garbage_cursor(self) -> None:
+        table = GalleryIndexTable(connection())
+        table.add(_image("M1"))
+        sort = SortParams(SortBy.TIMESTAMP, SortOrder.DESC)
+        for cursor in ["garbage!", "bm90IGpzb24=", "WzFd", "eyJtZDUiOiAxfQ=="]:
+            with self.assertRaises(InvalidCursor):
+                table.get_matching_images(SearchQuery(), sort, GalleryPaging(0, 10, cursor))
+
     def test_errors_aggregate_states(self) -> None:
         table = GalleryIndexTable(connection())
         self.assertRaises(
@@ -0,0 +1,56 @@
+import unittest
+
+from pphoto.db.connection import PhotosConnection
+from pphoto.db.md5_cache_table import FileStat, Md5CacheTable
+
+
+def connection() -> PhotosConnection:
+    return PhotosConnection(":memory:")
+
+
+class TestMd5CacheTable(unittest.TestCase):
+    def test_create_and_migrate_table(self) -> None:
+        conn = connection()
+        Md5CacheTable(conn)
+        Md5CacheTable(conn)
+
+    def test_add_and_get(self) -> None:
+        table = Md5CacheTable(connection())
+        stat = FileStat(10, 1000, 5)
+        self.assertIsNone(table.get("foo", stat))
+        table.add("foo", stat, "M1")
+        self.assertEqual(table.get("foo", stat), "M1")
+        self.assertIsNone(table.get("bar", stat))
+        self.assertIsNone(table.get("foo", FileStat(11, 1000, 5)), "Size changed")
+        self.assertIsNone(table.get("foo", FileStat(10, 1001, 5)), "Mtime changed")
+        self.assertIsNone(table.get("foo", FileStat(10, 1000, 6)), "Inode changed")
+        table.add("foo", FileStat(10, 1001, 5), "M2")
+        self.assertIsNone(table.get("foo", stat))
+        self.assertEqual(table.get("foo", FileStat(10, 1001, 5)), "M2")
+
+    def test_remove_and_move(self) -> None:
+        table = Md5CacheTable(connection())
+        stat = FileStat(10, 1000, 5)
+        table.add("foo", stat, "M1")
+        table.add("bar", stat, "M2")
+        table.add("baz", stat, "M3")
+        table.move("foo", "bar")
+        self.assertIsNone(table.get("foo", stat))
+        self.assertEqual(table.get("bar", stat), "M1")
+        table.remove("bar")
+        self.assertIsNone(table.get("bar", stat))
+        table.remove_many(["baz"])
+        self.assertIsNone(table.get("baz", stat))
+
+    def test_paths_in_chunks(self) -> None:
+        table = Md5CacheTable(connection())
+        stat = FileStat(10, 1000, 5)
+        for path in ["c", "a", "d", "b"]:
+            table.add(path, stat, "M1")
+        self.assertEqual(table.paths("", 3), ["a", "b", "c"])
+        self.assertEqual(table.paths("c", 3), ["d"])
+        self.assertEqual(table.paths("d", 3), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
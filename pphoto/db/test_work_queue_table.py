@@ -0,0 +1,86 @@
+import datetime
+import unittest
+
+from pphoto.db.connection import JobsConnection
+from pphoto.db.work_queue_table import WorkQueueTable
+
+LEASE = datetime.timedelta(seconds=10)
+
+
+def connection() -> JobsConnection:
+    return JobsConnection(":memory:")
+
+
+class TestWorkQueueTable(unittest.TestCase):
+    def test_create_table(self) -> None:
+        conn = connection()
+        WorkQueueTable(conn)
+        WorkQueueTable(conn)
+
+    def test_add_deduplicates_by_key(self) -> None:
+        table = WorkQueueTable(connection())
+        self.assertTrue(table.add("q", 1, "a", b"p", 10, 0.0).added)
+        self.assertFalse(table.add("q", 1, "a", b"p", 10, 0.0).added)
+        self.assertTrue(table.add("q", 2, "a", b"p", 10, 0.0).added)
+        self.assertTrue(table.add("other", 1, "a", b"p", 10, 0.0).added)
+        self.assertTrue(table.add("q", 1, None, b"p", 10, 0.0).added)
+        self.assertTrue(table.add("q", 1, None, b"p", 10, 0.0).added)
+        self.assertEqual(table.pending("q"), 4)
+        self.assertEqual(sorted(table.pending_by_type_and_priority("q")), [(1, 10, 3), (2, 10, 1)])
+
+    def test_add_raises_priority_of_waiting_item(self) -> None:
+        table = WorkQueueTable(connection())
+        table.add("q", 1, "a", b"a", 10, 0.0)
+        table.add("q", 1, "b", b"b", 5, 0.0)
+        self.assertEqual(table.add("q", 1, "a", b"a", 0, 0.0), (False, 10))
+        # Lower priority does not demote the item
+        self.assertEqual(table.add("q", 1, "a", b"a", 20, 0.0), (False, None))
+        self.assertEqual(sorted(table.pending_by_type_and_priority("q")), [(1, 0, 1), (1, 5, 1)])
+        self.assertEqual([x.payload for x in table.claim("q", "o1", 1, LEASE)], [b"a"])
+
+    def test_claim_by_priority_and_rank(self) -> None:
+        table = WorkQueueTable(connection())
+        table.add("q", 1, "a", b"a", 10, 1.0)
+        table.add("q", 1, "b", b"b", 10, 0.5)
+        table.add("q", 1, "c", b"c", 5, 2.0)
+        table.add("other", 1, "d", b"d", 0, 0.0)
+        first = table.claim("q", "o1", 2, LEASE, now=100)
+        self.assertEqual([x.payload for x in first], [b"c", b"b"])
+        self.assertEqual([x.attempts for x in first], [1, 1])
+        second = table.claim("q", "o2", 2, LEASE, now=100)
+        self.assertEqual([x.payload for x in second], [b"a"])
+        self.assertEqual(table.claim("q", "o2", 2, LEASE, now=100), [])
+
+        table.done(first[0].id_)
+        self.assertEqual(table.pending("q", now=100), 2)
+        table.release([first[1].id_])
+        released = table.claim("q", "o2", 2, LEASE, now=100)
+        self.assertEqual([(x.payload, x.attempts) for x in released], [(b"b", 1)])
+
+    def test_expired_lease(self) -> None:
+        table = WorkQueueTable(connection(), max_attempts=2)
+        table.add("q", 1, "a", b"a", 10, 0.0)
+        self.assertEqual(len(table.claim("q", "o1", 1, LEASE, now=100)), 1)
+        self.assertEqual(table.claim("q", "o2", 1, LEASE, now=105), [])
+        table.renew_leases("o1", LEASE, now=105)
+        self.assertEqual(table.claim("q", "o2", 1, LEASE, now=111), [])
+        again = table.claim("q", "o2", 1, LEASE, now=116)
+        self.assertEqual([x.attempts for x in again], [2])
+        # Still counted while leased on the last attempt
+        self.assertEqual(table.pending("q", now=120), 1)
+        self.assertEqual(table.drop_exhausted("q", now=120), 0)
+        self.assertEqual(table.claim("q", "o3", 1, LEASE, now=130), [])
+        self.assertEqual(table.pending("q", now=130), 0)
+        self.assertEqual(table.drop_exhausted("q", now=130), 1)
+
+    def test_release_owner(self) -> None:
+        table = WorkQueueTable(connection())
+        table.add("q", 1, "a", b"a", 10, 0.0)
+        table.add("q", 1, "b", b"b", 10, 1.0)
+        table.claim("q", "o1", 2, LEASE, now=100)
+        table.release_owner("o1")
+        self.assertEqual([x.payload for x in table.claim("q", "o2", 2, LEASE, now=100)], [b"a", b"b"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,204 @@
+import dataclasses
+import datetime
+import time
+import typing as t
+
+from pphoto.db.connection import JobsConnection
+
+
+@dataclasses.dataclass
+class WorkItem:
+    id_: int
+    type_: int
+    priority: int
+    rank: float
+    payload: bytes
+    attempts: int
+
+
+class AddResult(t.NamedTuple):
+    added: bool
+    # Priority of the same item that was already waiting, if the new one raised it
+    raised_from: t.Optional[int]
+
+
+class WorkQueueTable:
+    """
+    Persistent priority queues. Items are claimed with lease and deleted once done. Items of crashed
+    processes are claimed again after their lease expires, at most `max_attempts` times.
+    """
+
+    def __init__(self, connection: JobsConnection, max_attempts: int = 3) -> None:
+        self._con = connection
+        self._max_attempts = max_attempts
+        self._init_db()
+
+    def _init_db(
+        self,
+    ) -> None:
+        self._con.execute(
+            """
+CREATE TABLE IF NOT EXISTS work_queue (
+  id INTEGER PRIMARY KEY AUTOINCREMENT,
+  queue TEXT NOT NULL,
+  type INTEGER NOT NULL,
+  key TEXT,
+  payload BLOB NOT NULL,
+  priority INTEGER NOT NULL,
+  rank REAL NOT NULL,
+  lease_owner TEXT,
+  lease_until INTEGER,
+  attempts INTEGER NOT NULL,
+  created INTEGER NOT NULL
+) STRICT;
+            """
+        )
+        self._con.execute(
+            """
+CREATE UNIQUE INDEX IF NOT EXISTS work_queue_idx_queue_type_key ON work_queue (queue, type, key);
+            """
+        )
+        self._con.execute(
+            """
+CREATE INDEX IF NOT EXISTS work_queue_idx_queue_priority_rank ON work_queue (queue, priority, rank);
+            """
+        )
+        self._con.execute(
+            """
+CREATE INDEX IF NOT EXISTS work_queue_idx_lease_owner ON work_queue (lease_owner);
+            """
+        )
+        self._con.commit()
+
+    def add(
+        self, queue: str, type_: int, key: t.Optional[str], payload: bytes, priority: int, rank: float
+    ) -> AddResult:
+        """
+        Adds item, unless item with same non null key is already in the queue. Such item gets the higher of
+        both priorities.
+        """
+        with self._con.transaction():
+            previous = None
+            if key is not None:
+                row = self._con.execute(
+                    "SELECT priority FROM work_queue WHERE queue = ? AND type = ? AND key = ?",
+                    (queue, type_, key),
+                ).fetchone()
+                previous = None if row is None else int(row[0])
+            self._con.execute(
+                """
+INSERT INTO work_queue (queue, type, key, payload, priority, rank, attempts, created)
+VALUES (?, ?, ?, ?, ?, ?, 0, strftime('%s'))
+ON CONFLICT (queue, type, key) DO UPDATE SET priority = MIN(priority, excluded.priority)
+                """,
+                (queue, type_, key, payload, priority, rank),
+            )
+        if previous is None:
+            return AddResult(True, None)
+        return AddResult(False, previous if priority < previous else None)
+
+    def claim(
+        self,
+        queue: str,
+        owner: str,
+        limit: int,
+        lease: datetime.timedelta,
+        now: t.Optional[int] = None,
+    ) -> t.List[WorkItem]:
+        """Leases up to `limit` items with highest priority, that are not leased by anyone."""
+        if now is None:
+            now = int(time.time())
+        with self._con.transaction():
+            res = self._con.execute(
+                """
+UPDATE work_queue
+SET lease_owner = ?, lease_until = ?, attempts = attempts + 1
+WHERE id IN (
+  SELECT id FROM work_queue
+  WHERE queue = ? AND (lease_until IS NULL OR lease_until < ?) AND attempts < ?
+  ORDER BY priority, rank, id
+  LIMIT ?
+)
+RETURNING id, type, priority, rank, payload, attempts
+                """,
+                (owner, now + int(lease.total_seconds()), queue, now, self._max_attempts, limit),
+            ).fetchall()
+        items = [WorkItem(*row) for row in res]
+        items.sort(key=lambda x: (x.priority, x.rank, x.id_))
+        return items
+
+    def done(self, id_: int) -> None:
+        self._con.execute("DELETE FROM work_queue WHERE id = ?", (id_,))
+        self._con.commit()
+
+    def release(self, ids: t.List[int]) -> None:
+        """Returns leased items back to the queue, without counting it as an attempt."""
+        if not ids:
+            return
+        self._con.execute(
+            f"""
+UPDATE work_queue
+SET lease_owner = NULL, lease_until = NULL, attempts = MAX(0, attempts - 1)
+WHERE id IN ({",".join("?" for _ in ids)})
+            """,
+            ids,
+        )
+        self._con.commit()
+
+    def release_owner(self, owner: str) -> None:
+        self._con.execute(
+            """
+UPDATE work_queue
+SET lease_owner = NULL, lease_until = NULL, attempts = MAX(0, attempts - 1)
+WHERE lease_owner = ?
+            """,
+            (owner,),
+        )
+        self._con.commit()
+
+    def renew_leases(self, owner: str, lease: datetime.timedelta, now: t.Optional[int] = None) -> None:
+        if now is None:
+            now = int(time.time())
+        self._con.execute(
+            "UPDATE work_queue SET lease_until = ? WHERE lease_owner = ?",
+            (now + int(lease.total_seconds()), owner),
+        )
+        self._con.commit()
+
+    def drop_exhausted(self, queue: str, now: t.Optional[int] = None) -> int:
+        """Deletes items that ran out of attempts and are not leased anymore, returns their count."""
+        if now is None:
+            now = int(time.time())
+        res = self._con.execute(
+            "DELETE FROM work_queue WHERE queue = ? AND attempts >= ? AND lease_until < ?",
+            (queue, self._max_attempts, now),
+        )
+        dropped = res.rowcount
+        self._con.commit()
+        return dropped
+
+    def pending(self, queue: str, now: t.Optional[int] = None) -> int:
+        """Number of items that are not done yet, including leased ones."""
+        if now is None:
+            now = int(time.time())
+        res = self._con.execute(
+            "SELECT COUNT(*) FROM work_queue WHERE queue = ? AND (attempts < ? OR lease_until >= ?)",
+            (queue, self._max_attempts, now),
+        ).fetchone()
+        return 0 if res is None else int(res[0])
+
+    def pending_by_type_and_priority(
+        self, queue: str, now: t.Optional[int] = None
+    ) -> t.List[t.Tuple[int, int, int]]:
+        """Returns (type, priority, count) of items that are not done yet."""
+        if now is None:
+            now = int(time.time())
+        res = self._con.execute(
+            """
+SELECT type, priority, COUNT(*) FROM work_queue
+WHERE queue = ? AND (attempts < ? OR lease_until >= ?)
+GROUP BY type, priority
+            """,
+            (queue, self._max_attempts, now),
+        ).fetchall()
+        return t.cast(t.List[t.Tuple[int, int, int]], res)
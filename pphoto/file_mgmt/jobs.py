@@ -7,14 +7,14 @@ import sys
 
 import tqdm
 
-from pphoto.annots.md5 import compute_md5
+from pphoto.annots.md5 import Md5Hasher
 from pphoto.annots.annotator import Annotator
-from pphoto.data_model.base import PathWithMd5
+from pphoto.data_model.base import PathWithMd5, StorableData
 from pphoto.data_model.manual import ManualIdentity
 from pphoto.remote_jobs.types import ManualAnnotationTask, RemoteTask
 from pphoto.remote_jobs.db import RemoteJobsTable
+from pphoto.db.annotation_status_table import AnnotationStatusTable
 from pphoto.db.files_table import FilesTable
-from pphoto.db.queries import PhotosQueries
 from pphoto.db.types_file import ManagedLifecycle
 from pphoto.communication.types import ImportMode
 from pphoto.utils import assert_never
@@ -48,20 +48,22 @@ class Jobs:
         managed_folder: str,
         files: FilesTable,
         jobs: RemoteJobsTable,
-        queries: PhotosQueries,
+        annotation_status: AnnotationStatusTable,
         annotator: Annotator,
+        hasher: Md5Hasher,
     ):
         self.photos_dir = managed_folder
+        self._hasher = hasher
         self._files = files
         self._jobs = jobs
-        self._queries = queries
+        self._annotation_status = annotation_status
         self._annotator = annotator
 
     async def image_to_text(self, path: PathWithMd5) -> None:
         # This is relatively simple job, does not wait
         await self._annotator.image_to_text(path)
 
-    def get_path_with_md5_to_enqueue(self, path: str, can_add: bool) -> t.Optional[PathWithMd5]:
+    async def get_path_with_md5_to_enqueue(self, path: str, can_add: bool) -> t.Optional[PathWithMd5]:
         if not _is_valid_file(path):
             return None
         file_row = self._files.by_path(path)
@@ -70,13 +72,13 @@ class Jobs:
                 # TODO: error?
                 return None
             # File does not exists
-            path_with_md5 = compute_md5(path)
+            path_with_md5 = await self._hasher.compute_async(path)
             # TODO: if path is in managed files, make it managed?
             self._files.add_if_not_exists(path, path_with_md5.md5, None, ManagedLifecycle.NOT_MANAGED, None)
         else:
             md5 = file_row.md5
             if md5 is None:
-                path_with_md5 = compute_md5(path)
+                path_with_md5 = await self._hasher.compute_async(path)
                 self._files.add_or_update(
                     file_row.file, path_with_md5.md5, file_row.og_file, file_row.managed, file_row.tmp_file
                 )
@@ -84,17 +86,27 @@ class Jobs:
                 path_with_md5 = PathWithMd5(path, md5)
         return path_with_md5
 
-    def import_file(self, path: str, mode: ImportMode) -> t.Optional[EnqueuePathAction]:
+    async def hash_files(self, paths: t.List[str]) -> None:
+        """Computes md5 of files in parallel, so that following jobs get it from cache"""
+        try:
+            await self._hasher.compute_many([path for path in paths if _is_valid_file(path)])
+        # pylint: disable-next = broad-exception-caught
+        except Exception as e:
+            # Files will be hashed one by one, so the error will be reported for the right file
+            print("Error while hashing files", e, file=sys.stderr)
+
+    async def import_file(self, path: str, mode: ImportMode) -> t.Optional[EnqueuePathAction]:
         if not _is_valid_file(path):
             return None
-        path_with_md5 = compute_md5(path)
+        path_with_md5 = await self._hasher.compute_async(path)
         if any(os.path.exists(x.file) and x.file != path for x in self._files.by_md5(path_with_md5.md5)):
             # There exists file with this md5, we can skip this file.
             if mode.should_delete_original_if_exists():
                 os.remove(path)
+                self._hasher.forget(path)
             return None
         # Do cheap annotation
-        (_path, exif, _dimensions, geo, path_date) = self._annotator.cheap_features(
+        (_path, exif, _dimensions, geo, path_date) = await self._annotator.cheap_features(
             path_with_md5, recompute_location=False
         )
         date = (None if exif.p is None or exif.p.date is None else exif.p.date.datetime) or path_date
@@ -115,6 +127,7 @@ class Jobs:
         # pylint: disable-next = consider-using-in
         if mode == ImportMode.MOVE or mode == ImportMode.MOVE_OR_DELETE:
             shutil.move(path_with_md5.path, new_path.path)
+            self._hasher.moved(path_with_md5.path, new_path.path)
         elif mode == ImportMode.COPY:
             shutil.copy2(path_with_md5.path, new_path.path)
         else:
@@ -123,9 +136,9 @@ class Jobs:
         # Schedule expensive annotation
         return EnqueuePathAction(new_path, IMPORT_PRIORITY, [JobType.IMAGE_TO_TEXT])
 
-    def cheap_features(self, path: PathWithMd5, recompute_location: bool) -> None:
+    async def cheap_features(self, path: PathWithMd5, recompute_location: bool) -> None:
         # Annotate features
-        (path, exif, _dimensions, geo, path_date) = self._annotator.cheap_features(
+        (path, exif, _dimensions, geo, path_date) = await self._annotator.cheap_features(
             path, recompute_location=recompute_location
         )
 
@@ -149,13 +162,16 @@ class Jobs:
         os.makedirs(new_dir, exist_ok=True)
         self._files.set_lifecycle(path.path, ManagedLifecycle.BEING_MOVED_AROUND, new_path.path)
         shutil.move(path.path, new_path.path)
+        self._hasher.moved(path.path, new_path.path)
         self._files.change_path(path.path, new_path.path)
         self._files.set_lifecycle(new_path.path, ManagedLifecycle.SYNCED, None)
 
-    def add_manual_annotation(self, task: RemoteTask[ManualAnnotationTask]) -> None:
+    async def add_manual_annotation(self, task: RemoteTask[ManualAnnotationTask]) -> None:
         (loc, _dt, _text) = self._annotator.manual_features(task)
         for file in self._files.by_md5(task.id_.md5):
-            self.cheap_features(PathWithMd5(file.file, task.id_.md5), recompute_location=loc is not None)
+            await self.cheap_features(
+                PathWithMd5(file.file, task.id_.md5), recompute_location=loc is not None
+            )
         self._jobs.finish_task(task.id_)
 
     def face_cluster_task(
@@ -186,9 +202,10 @@ class Jobs:
                 print("ERROR in BEING_MOVED_AROUND sync state", file_row, file=sys.stderr)
                 continue
             if old_path != new_path and (
-                not os.path.exists(new_path) or compute_md5(new_path).md5 != file_row.md5
+                not os.path.exists(new_path) or self._hasher.compute(new_path).md5 != file_row.md5
             ):
                 shutil.move(old_path, new_path)
+                self._hasher.moved(old_path, new_path)
             if old_path != new_path:
                 self._files.change_path(old_path, new_path)
             self._files.set_lifecycle(new_path, ManagedLifecycle.SYNCED, None)
@@ -204,7 +221,7 @@ class Jobs:
                 print("ERROR in IMPORTED sync state", file_row, file=sys.stderr)
                 continue
             if old_path != new_path and (
-                not os.path.exists(new_path) or compute_md5(new_path).md5 != file_row.md5
+                not os.path.exists(new_path) or self._hasher.compute(new_path).md5 != file_row.md5
             ):
                 print(
                     "WARNING: found in-progress imported file. Copying it instead of moving as I don't know what user wanted",
@@ -214,22 +231,30 @@ class Jobs:
                 shutil.copy2(old_path, new_path)
             self._files.set_lifecycle(new_path, ManagedLifecycle.SYNCED, None)
 
-    def find_unannotated_files(self) -> t.List[EnqueuePathAction]:
-        progress = tqdm.tqdm(desc="Getting files with missing annotations", total=3)
-        cheap = set(self._queries.get_not_annotated_files(self._annotator.cheap_features_types))
-        progress.update(1)
-        image_to_text = set(self._queries.get_not_annotated_files(self._annotator.image_to_text_types))
-        progress.update(1)
-        output = []
-        for path in cheap.union(image_to_text):
-            jobs: t.List[t.Literal[JobType.IMAGE_TO_TEXT] | t.Literal[JobType.CHEAP_FEATURES]] = []
-            if path in cheap:
-                jobs.append(JobType.CHEAP_FEATURES)
-            if path in image_to_text:
-                jobs.append(JobType.IMAGE_TO_TEXT)
-            output.append(EnqueuePathAction(path, DEFAULT_PRIORITY, jobs))
-        progress.update(1)
-        return output
+    async def prune_md5_cache(self) -> None:
+        """Drops cached md5 of files removed outside of the app, runs in background as it goes over all files"""
+        removed = await self._hasher.remove_missing()
+        if removed:
+            print("Removed cached md5 of missing files:", removed, file=sys.stderr)
+
+    def find_unannotated_files(self, chunk_size: int = 500) -> t.Iterable[t.List[EnqueuePathAction]]:
+        """Yields files with missing or outdated features in chunks. Takes long only after version change."""
+        job_types: t.List[
+            t.Tuple[
+                t.Literal[JobType.IMAGE_TO_TEXT] | t.Literal[JobType.CHEAP_FEATURES],
+                t.List[t.Type[StorableData]],
+            ]
+        ] = [
+            (JobType.CHEAP_FEATURES, self._annotator.cheap_features_types),
+            (JobType.IMAGE_TO_TEXT, self._annotator.image_to_text_types),
+        ]
+        for job_type, types in job_types:
+            self._annotation_status.set_required(
+                job_type.name, [(model.__name__, model.current_version()) for model in types]
+            )
+        for job_type, _types in job_types:
+            for paths in self._annotation_status.missing(job_type.name, chunk_size):
+                yield [EnqueuePathAction(path, DEFAULT_PRIORITY, [job_type]) for path in paths]
 
 
 def _is_valid_file(path: str) -> bool:
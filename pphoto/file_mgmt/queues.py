@@ -1,12 +1,16 @@
 import asyncio
 import datetime
 import itertools
+import json
 import random
+import sys
+import time
 import typing as t
 
-from pphoto.remote_jobs.types import RemoteTask, ManualAnnotationTask
+from pphoto.remote_jobs.types import RemoteTask, ManualAnnotationTask, RemoteJobType, TaskId
 from pphoto.data_model.base import PathWithMd5
 from pphoto.data_model.manual import ManualIdentity
+from pphoto.db.work_queue_table import AddResult, WorkQueueTable
 from pphoto.file_mgmt.jobs import JobType, IMPORT_PRIORITY, DEFAULT_PRIORITY
 from pphoto.utils import assert_never, DefaultDict, CacheTTL
 from pphoto.utils.progress_bar import ProgressBar
@@ -15,10 +19,11 @@ T = t.TypeVar("T")
 
 
 class QueueItem(t.Generic[T]):
-    def __init__(self, priority: int, rank: float, payload: T) -> None:
+    def __init__(self, priority: int, rank: float, payload: T, id_: int = 0) -> None:
         self.priority = priority
         self.rank = rank
         self.payload = payload
+        self.id_ = id_
 
     def __lt__(self, other: object) -> bool:
         if not isinstance(other, QueueItem):
@@ -36,17 +41,182 @@ QueueValue = t.Union[
     ],
 ]
 
-Queue = asyncio.PriorityQueue[QueueItem[QueueValue]]
+
+def _encode(value: QueueValue) -> t.Tuple[JobType, t.Optional[str], bytes]:
+    """Returns type, deduplication key and payload of the value."""
+    payload, type_ = value
+    # pylint: disable-next = consider-using-in
+    if type_ == JobType.CHEAP_FEATURES or type_ == JobType.IMAGE_TO_TEXT:
+        assert isinstance(payload, PathWithMd5)
+        # File can change while its item is waiting, item of the new content has to be kept too
+        return (
+            type_,
+            f"{payload.path}:{payload.md5}",
+            json.dumps({"path": payload.path, "md5": payload.md5}).encode(),
+        )
+    # pylint: disable-next = consider-using-in
+    if type_ == JobType.ADD_MANUAL_ANNOTATION or type_ == JobType.FACE_CLUSTER_ANNOTATION:
+        assert isinstance(payload, RemoteTask)
+        task_payload: t.Any
+        if isinstance(payload.payload, ManualAnnotationTask):
+            task_payload = payload.payload.to_dict(encode_json=True)
+        else:
+            task_payload = [x.to_json_dict() for x in payload.payload]
+        return (
+            type_,
+            f"{payload.id_.job_id}:{payload.id_.md5}",
+            json.dumps(
+                {
+                    "md5": payload.id_.md5,
+                    "job_id": payload.id_.job_id,
+                    "type": payload.type_.value,
+                    "payload": task_payload,
+                    "created": payload.created.timestamp(),
+                }
+            ).encode(),
+        )
+    if type_ == JobType.COMPUTE_FACE_EMBEDDING_FOR_MANUAL_ANNOTATION:
+        assert isinstance(payload, tuple)
+        path, identities = payload
+        return (
+            type_,
+            None,
+            json.dumps(
+                {"path": path.path, "md5": path.md5, "identities": [x.to_json_dict() for x in identities]}
+            ).encode(),
+        )
+    assert_never(type_)
+
+
+def _decode(type_: JobType, data: bytes) -> QueueValue:
+    d = json.loads(data)
+    # pylint: disable-next = consider-using-in
+    if type_ == JobType.CHEAP_FEATURES or type_ == JobType.IMAGE_TO_TEXT:
+        return (PathWithMd5(d["path"], d["md5"]), type_)
+    if type_ == JobType.ADD_MANUAL_ANNOTATION:
+        return (_decode_task(d).map(ManualAnnotationTask.from_dict), type_)
+    if type_ == JobType.FACE_CLUSTER_ANNOTATION:
+        return (_decode_task(d).map(lambda x: [ManualIdentity.from_json_dict(i) for i in x]), type_)
+    if type_ == JobType.COMPUTE_FACE_EMBEDDING_FOR_MANUAL_ANNOTATION:
+        identities = [ManualIdentity.from_json_dict(x) for x in d["identities"]]
+        return ((PathWithMd5(d["path"], d["md5"]), identities), type_)
+    assert_never(type_)
+
+
+def _decode_task(d: t.Dict[str, t.Any]) -> RemoteTask[t.Any]:
+    return RemoteTask(
+        TaskId(d["md5"], d["job_id"]),
+        RemoteJobType(d["type"]),
+        d["payload"],
+        datetime.datetime.fromtimestamp(d["created"]),
+        None,
+    )
+
+
+class Queue:
+    """
+    Priority queue persisted in `WorkQueueTable`. Items are claimed from the table in batches with lease,
+    so several processes can drain the same queue. Leases are renewed while process runs, items of crashed
+    process are claimed again once their lease expires.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        table: WorkQueueTable,
+        owner: str,
+        claim_size: int = 16,
+        lease: datetime.timedelta = datetime.timedelta(minutes=5),
+        poll_interval: datetime.timedelta = datetime.timedelta(seconds=5),
+    ) -> None:
+        self.name = name
+        self._table = table
+        self._owner = owner
+        self._claim_size = claim_size
+        self._lease = lease
+        self._poll_interval = poll_interval
+        self._claimed: t.List[QueueItem[QueueValue]] = []
+        self._new_items = asyncio.Event()
+        # Item more urgent than claimed ones was added
+        self._preempt = False
+
+    def put(self, value: QueueValue, priority: int, rank: float) -> AddResult:
+        """Adds value to the queue, if same item is already waiting, it gets the higher priority."""
+        type_, key, payload = _encode(value)
+        result = self._table.add(self.name, type_.value, key, payload, priority, rank)
+        if result.added or result.raised_from is not None:
+            if self._claimed and priority < self._claimed[-1].priority:
+                self._preempt = True
+            self._new_items.set()
+        return result
+
+    async def get(self) -> QueueItem[QueueValue]:
+        while True:
+            if self._preempt:
+                self._preempt = False
+                self._table.release([item.id_ for item in self._claimed])
+                self._claimed = []
+            if self._claimed:
+                return self._claimed.pop(0)
+            self._new_items.clear()
+            self._claim()
+            if self._claimed:
+                continue
+            try:
+                await asyncio.wait_for(self._new_items.wait(), self._poll_interval.total_seconds())
+            except asyncio.TimeoutError:
+                pass
+
+    def _claim(self) -> None:
+        dropped = self._table.drop_exhausted(self.name)
+        if dropped:
+            print(
+                f"Dropped {dropped} items from {self.name} queue, that failed too many times", file=sys.stderr
+            )
+        for item in self._table.claim(self.name, self._owner, self._claim_size, self._lease):
+            try:
+                value = _decode(JobType(item.type_), item.payload)
+            # pylint: disable-next = broad-exception-caught
+            except Exception as e:
+                print("Unable to decode queue item", self.name, item, e, file=sys.stderr)
+                self._table.done(item.id_)
+                continue
+            self._claimed.append(QueueItem(item.priority, item.rank, value, item.id_))
+
+    def task_done(self, item: QueueItem[QueueValue]) -> None:
+        self._table.done(item.id_)
+
+    def release(self, item: QueueItem[QueueValue]) -> None:
+        """Returns unfinished item back to the queue."""
+        self._table.release([item.id_])
+
+    def pending(self) -> int:
+        return self._table.pending(self.name)
+
+    def pending_by_type_and_priority(self) -> t.List[t.Tuple[int, int, int]]:
+        return self._table.pending_by_type_and_priority(self.name)
+
+    async def join(self) -> None:
+        """Waits until queue is empty, including items of other processes."""
+        while self.pending() > 0:
+            await asyncio.sleep(self._poll_interval.total_seconds())
+
+    def renew_leases(self) -> None:
+        self._table.renew_leases(self._owner, self._lease)
+
+    def close(self) -> None:
+        """Releases all items claimed by this process."""
+        self._claimed = []
+        self._table.release_owner(self._owner)
 
 
 class Queues:
-    def __init__(self) -> None:
-        self.cheap_features: Queue = asyncio.PriorityQueue()
-        self.image_to_text: Queue = asyncio.PriorityQueue()
+    def __init__(self, table: WorkQueueTable, owner: str) -> None:
+        self.cheap_features: Queue = Queue("cheap_features", table, owner)
+        self.image_to_text: Queue = Queue("image_to_text", table, owner)
         self.known_paths: CacheTTL[PathWithMd5] = CacheTTL(
             datetime.timedelta(days=7), datetime.timedelta(days=14)
         )
-        self._index = 0
 
         self._prio_progress: DefaultDict[JobType, ProgressBar] = DefaultDict(
             default_factory=lambda tp: ProgressBar(desc=f"Realtime ingest {tp.name}", permanent=True)
@@ -65,6 +235,13 @@ class Queues:
             return self._import_progress[type_]
         return self._prio_progress[type_]
 
+    def add_pending_to_progress_bars(self) -> None:
+        """Adds items persisted in queues, e.g. from previous run, to progress bars."""
+        for queue in [self.cheap_features, self.image_to_text]:
+            for type_, priority, count in queue.pending_by_type_and_priority():
+                self.get_progress_bar(JobType(type_), priority).add_to_total(count)
+        self.update_progress_bars()
+
     def update_progress_bars(self) -> None:
         for p in itertools.chain(
             self._prio_progress.values(), self._import_progress.values(), self._default_progress.values()
@@ -74,23 +251,32 @@ class Queues:
     def enqueue_path(self, values: t.Iterable[QueueValue], priority: int) -> None:
         for value in values:
             _payload, type_ = value
-            self.get_progress_bar(type_, priority).add_to_total(1)
+            # Time keeps FIFO order also across restarts
             if type_ == JobType.CHEAP_FEATURES:
-                self.cheap_features.put_nowait(QueueItem(priority, self._index, value))
-                self._index += 1
+                result = self.cheap_features.put(value, priority, time.time())
             elif type_ == JobType.IMAGE_TO_TEXT:
-                self.image_to_text.put_nowait(QueueItem(priority, random.random(), value))
+                result = self.image_to_text.put(value, priority, random.random())
             elif type_ == JobType.ADD_MANUAL_ANNOTATION:
-                self.cheap_features.put_nowait(QueueItem(priority, self._index, value))
-                self._index += 1
+                result = self.cheap_features.put(value, priority, time.time())
             elif type_ == JobType.FACE_CLUSTER_ANNOTATION:
-                self.cheap_features.put_nowait(QueueItem(priority, self._index, value))
-                self._index += 1
+                result = self.cheap_features.put(value, priority, time.time())
             elif type_ == JobType.COMPUTE_FACE_EMBEDDING_FOR_MANUAL_ANNOTATION:
-                self.image_to_text.put_nowait(QueueItem(priority, self._index, value))
-                self._index += 1
+                result = self.image_to_text.put(value, priority, time.time())
             else:
                 assert_never(type_)
+            if result.added:
+                self.get_progress_bar(type_, priority).add_to_total(1)
+            elif result.raised_from is not None:
+                self.get_progress_bar(type_, result.raised_from).add_to_total(-1)
+                self.get_progress_bar(type_, priority).add_to_total(1)
+
+    def renew_leases(self) -> None:
+        self.cheap_features.renew_leases()
+        self.image_to_text.renew_leases()
+
+    def close(self) -> None:
+        self.cheap_features.close()
+        self.image_to_text.close()
 
     def enqueue_path_skipped_known(self, path: PathWithMd5, priority: int) -> None:
         if not self.known_paths.mutable_should_update(path):
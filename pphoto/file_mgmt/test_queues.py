@@ -0,0 +1,111 @@
+import asyncio
+import datetime
+import typing as t
+import unittest
+
+from pphoto.data_model.base import PathWithMd5
+from pphoto.data_model.face import Position
+from pphoto.data_model.manual import ManualIdentity
+from pphoto.db.connection import JobsConnection
+from pphoto.db.work_queue_table import WorkQueueTable
+from pphoto.file_mgmt.jobs import JobType, DEFAULT_PRIORITY, REALTIME_PRIORITY
+from pphoto.file_mgmt.queues import Queues, QueueValue, _decode, _encode
+from pphoto.remote_jobs.types import ManualAnnotationTask, RemoteJobType, RemoteTask, TaskId, TextAnnotation
+
+
+class TestQueues(unittest.TestCase):
+    def test_encode_decode(self) -> None:
+        created = datetime.datetime(2024, 1, 2, 3, 4, 5)
+        identities = [ManualIdentity("Foo", None, Position(1, 2, 3, 4, None))]
+        values: t.List[QueueValue] = [
+            (PathWithMd5("a.jpg", "M1"), JobType.CHEAP_FEATURES),
+            (PathWithMd5("a.jpg", "M1"), JobType.IMAGE_TO_TEXT),
+            (
+                RemoteTask(
+                    TaskId("M1", 3),
+                    RemoteJobType.MASS_MANUAL_ANNOTATION,
+                    ManualAnnotationTask(None, TextAnnotation("desc", None), True, None),
+                    created,
+                    None,
+                ),
+                JobType.ADD_MANUAL_ANNOTATION,
+            ),
+            (
+                RemoteTask(TaskId("M1", 4), RemoteJobType.FACE_CLUSTER_ANNOTATION, identities, created, None),
+                JobType.FACE_CLUSTER_ANNOTATION,
+            ),
+            ((PathWithMd5("a.jpg", "M1"), identities), JobType.COMPUTE_FACE_EMBEDDING_FOR_MANUAL_ANNOTATION),
+        ]
+        for value in values:
+            type_, _key, payload = _encode(value)
+            self.assertEqual(_decode(type_, payload), value)
+
+    def test_persisted_across_instances(self) -> None:
+        async def run() -> None:
+            table = WorkQueueTable(JobsConnection(":memory:"))
+            queues = Queues(table, "first")
+            path = PathWithMd5("a.jpg", "M1")
+            queues.enqueue_path(
+                [(path, JobType.CHEAP_FEATURES), (path, JobType.IMAGE_TO_TEXT)], DEFAULT_PRIORITY
+            )
+            queues.enqueue_path([(path, JobType.CHEAP_FEATURES)], DEFAULT_PRIORITY)
+            other = PathWithMd5("b.jpg", "M2")
+            queues.enqueue_path([(other, JobType.CHEAP_FEATURES)], REALTIME_PRIORITY)
+            self.assertEqual(queues.cheap_features.pending(), 2)
+
+            item = await queues.cheap_features.get()
+            self.assertEqual(item.payload, (other, JobType.CHEAP_FEATURES))
+            queues.cheap_features.task_done(item)
+            # Process crashed or was stopped, other process continues
+            queues.close()
+            queues = Queues(table, "second")
+            item = await queues.cheap_features.get()
+            self.assertEqual(item.payload, (path, JobType.CHEAP_FEATURES))
+            queues.cheap_features.task_done(item)
+            await asyncio.wait_for(queues.cheap_features.join(), 1)
+            self.assertEqual(queues.image_to_text.pending(), 1)
+
+        asyncio.run(run())
+
+    def test_changed_file_is_queued_again(self) -> None:
+        async def run() -> None:
+            queues = Queues(WorkQueueTable(JobsConnection(":memory:")), "first")
+            old = PathWithMd5("a.jpg", "M1")
+            new = PathWithMd5("a.jpg", "M2")
+            queues.enqueue_path([(old, JobType.CHEAP_FEATURES)], DEFAULT_PRIORITY)
+            queues.enqueue_path([(new, JobType.CHEAP_FEATURES)], DEFAULT_PRIORITY)
+            self.assertEqual(queues.cheap_features.pending(), 2)
+            got = []
+            for _ in range(2):
+                item = await queues.cheap_features.get()
+                got.append(item.payload)
+                queues.cheap_features.task_done(item)
+            self.assertCountEqual(got, [(old, JobType.CHEAP_FEATURES), (new, JobType.CHEAP_FEATURES)])
+
+        asyncio.run(run())
+
+    def test_realtime_enqueue_raises_priority(self) -> None:
+        async def run() -> None:
+            queues = Queues(WorkQueueTable(JobsConnection(":memory:")), "first")
+            path = PathWithMd5("a.jpg", "M1")
+            other = PathWithMd5("b.jpg", "M2")
+            queues.enqueue_path([(other, JobType.CHEAP_FEATURES)], DEFAULT_PRIORITY)
+            queues.enqueue_path([(path, JobType.CHEAP_FEATURES)], DEFAULT_PRIORITY)
+            queues.enqueue_path([(path, JobType.CHEAP_FEATURES)], REALTIME_PRIORITY)
+            self.assertEqual(queues.cheap_features.pending(), 2)
+            item = await queues.cheap_features.get()
+            self.assertEqual(
+                (item.payload, item.priority), ((path, JobType.CHEAP_FEATURES), REALTIME_PRIORITY)
+            )
+            self.assertEqual(
+                queues.get_progress_bar(JobType.CHEAP_FEATURES, DEFAULT_PRIORITY).get_progress().total, 1
+            )
+            self.assertEqual(
+                queues.get_progress_bar(JobType.CHEAP_FEATURES, REALTIME_PRIORITY).get_progress().total, 1
+            )
+
+        asyncio.run(run())
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -7,7 +7,9 @@ from pphoto.db.gallery_index_table import GalleryIndexTable
 from pphoto.db.connection import PhotosConnection, GalleryConnection, JobsConnection
 from pphoto.db.cache import SQLiteCache
 from pphoto.data_model.manual import ManualIdentities
-from pphoto.data_model.face import FaceEmbeddings
+from pphoto.data_model.face import FaceEmbeddings, Position
+from pphoto.db.face_clusters_table import FaceClustersTable
+from pphoto.db.face_index import FaceIndex
 from pphoto.db.files_table import FilesTable
 from pphoto.db.features_table import FeaturesTable
 from pphoto.db.identity_table import IdentityTable
@@ -30,17 +32,19 @@ class ImageSqlDB:
         photos_connection: PhotosConnection,
         gallery_connection: GalleryConnection,
         jobs_connection: JobsConnection,
+        face_index_path: str,
     ) -> None:
         self._connections = [photos_connection, gallery_connection, jobs_connection]
         self._files_table = FilesTable(photos_connection)
         features_table = FeaturesTable(photos_connection)
+        self._features_table = features_table
         self._manual_identities = SQLiteCache(
             features_table, ManualIdentities, lambda x: ManualIdentities.from_json_dict(json.loads(x)), None
         )
         self.identities = IdentityTable(photos_connection)
-        self._faces_embeddings = SQLiteCache(
-            features_table, FaceEmbeddings, lambda x: FaceEmbeddings.from_json_dict(json.loads(x)), None
-        )
+        self._faces_embeddings = SQLiteCache(features_table, FaceEmbeddings, FaceEmbeddings.from_bytes, None)
+        self.face_index = FaceIndex(photos_connection, face_index_path)
+        self._face_clusters = FaceClustersTable(photos_connection)
         self._gallery_index = GalleryIndexTable(gallery_connection)
         self.jobs = RemoteJobsTable(jobs_connection)
         self._directories_table = DirectoriesTable(gallery_connection)
@@ -115,19 +119,52 @@ class ImageSqlDB:
             return None
         return r.payload.p
 
+    def get_faces_with_identities(
+        self, md5s: t.Sequence[str]
+    ) -> t.Dict[str, t.Tuple[t.Optional[FaceEmbeddings], t.Optional[ManualIdentities]]]:
+        """Face embeddings and manual identities of each md5, both are fetched in a single query"""
+        payloads = self._features_table.get_payloads(
+            [FaceEmbeddings.__name__, ManualIdentities.__name__], md5s
+        )
+        faces = self._faces_embeddings.parse_many(md5s, payloads)
+        identities = self._manual_identities.parse_many(md5s, payloads)
+        out = {}
+        for md5 in md5s:
+            fcs = faces.get(md5)
+            idents = identities.get(md5)
+            out[md5] = (
+                None if fcs is None or fcs.payload is None else fcs.payload.p,
+                None if idents is None or idents.payload is None else idents.payload.p,
+            )
+        return out
+
+    def get_face_clusters(self, md5s: t.Sequence[str]) -> t.Dict[t.Tuple[str, Position], int]:
+        return self._face_clusters.clusters_of(md5s)
+
     def get_manual_identities(self, md5: str) -> t.Optional[ManualIdentities]:
         r = self._manual_identities.get(md5)
         if r is None or r.payload is None:
             return None
         return r.payload.p
 
+    def get_many_manual_identities(self, md5s: t.Sequence[str]) -> t.Dict[str, ManualIdentities]:
+        """Manual identities of md5s that have them, fetched in a single query"""
+        out = {}
+        for md5, r in self._manual_identities.get_many(md5s).items():
+            if r.payload is not None and r.payload.p is not None:
+                out[md5] = r.payload.p
+        return out
+
     def get_matching_images(
         self,
         query: SearchQuery,
         sort_params: SortParams,
         gallery_paging: GalleryPaging,
-    ) -> t.Tuple[t.List[Image], bool]:
+    ) -> t.Tuple[t.List[Image], bool, t.Optional[str]]:
         return self._gallery_index.get_matching_images(query, sort_params, gallery_paging)
 
+    def get_extensions(self, md5s: t.Sequence[str]) -> t.Dict[str, str]:
+        return self._gallery_index.get_extensions(md5s)
+
     def mark_annotated(self, md5s: t.List[str]) -> None:
         self._gallery_index.mark_annotated(md5s)
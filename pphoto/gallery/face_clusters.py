@@ -0,0 +1,177 @@
+import collections
+import typing as t
+
+import numpy as np
+import numpy.typing as npt
+
+from pphoto.data_model.face import Position
+from pphoto.data_model.manual import ManualIdentities
+from pphoto.db.cache import SQLiteCache
+from pphoto.db.connection import PhotosConnection
+from pphoto.db.face_clusters_table import FaceClustersTable
+from pphoto.db.face_index import FaceIndex
+from pphoto.db.features_table import FeaturesTable
+
+# Used when there are not enough manual identities to fit the distance, lower than tolerance of
+# `face_recognition`, as clusters should rather be split than mixed
+_DEFAULT_THRESHOLD = 0.45
+_MIN_THRESHOLD = 0.25
+_MAX_THRESHOLD = 0.6
+# Faces with manual identity used to fit the distance, pairwise distances of all of them are computed
+_MAX_FIT_FACES = 2000
+# New faces are compared with centers of clusters in batches
+_BATCH_SIZE = 1024
+
+Embeddings = npt.NDArray[np.float32]
+Clusters = npt.NDArray[np.int64]
+
+
+def _distances(a: Embeddings, b: Embeddings) -> npt.NDArray[np.float32]:
+    """Euclidean distances of each row of `a` to each row of `b`"""
+    squared = (a * a).sum(axis=1)[:, None] + (b * b).sum(axis=1)[None, :] - 2 * (a @ b.T)
+    return t.cast(npt.NDArray[np.float32], np.sqrt(np.maximum(squared, 0)))
+
+
+def fit_threshold(
+    embeddings: Embeddings, identities: t.Sequence[t.Optional[str]], default: float = _DEFAULT_THRESHOLD
+) -> float:
+    """
+    Distance from cluster center which best separates faces of the same identity from faces of different
+    identities, among faces with manual identity. Distances are to centers, not between faces, as in
+    `cluster_faces`, own center of face is computed without it. Falls back to `default` without such faces.
+    """
+    anchored = np.array([i for i, identity in enumerate(identities) if identity is not None], dtype=np.int64)
+    if len(anchored) > _MAX_FIT_FACES:
+        anchored = np.random.default_rng(0).choice(anchored, _MAX_FIT_FACES, replace=False)
+    if len(anchored) < 2:
+        return default
+    (names, labels) = np.unique([identities[i] for i in anchored], return_inverse=True)
+    faces = embeddings[anchored]
+    sums = np.zeros((len(names), faces.shape[1]), dtype=np.float64)
+    np.add.at(sums, labels, faces)
+    counts = np.bincount(labels, minlength=len(names))
+    distances = _distances(faces, (sums / counts[:, None]).astype(np.float32))
+    same = labels[:, None] == np.arange(len(names))[None, :]
+    own_centers = (sums[labels] - faces) / np.maximum(counts[labels] - 1, 1)[:, None]
+    distances[same] = np.linalg.norm(faces - own_centers, axis=1)
+    # Single face of identity has no center to compare with
+    valid = ~same | (counts[labels] > 1)[:, None]
+    (distances, same) = (distances[valid], same[valid])
+    if same.all() or not same.any():
+        return default
+    order = np.argsort(distances)
+    (distances, same) = (distances[order], same[order])
+    # With threshold at k-th closest distance, further faces of the same identity and closer faces of
+    # different identities are wrong
+    errors = (same.sum() - np.cumsum(same)) + np.cumsum(~same)
+    return float(np.clip(distances[int(np.argmin(errors))], _MIN_THRESHOLD, _MAX_THRESHOLD))
+
+
+def _apply_anchors(clusters: Clusters, identities: t.Sequence[t.Optional[str]]) -> Clusters:
+    """
+    Moves faces with manual identity to cluster of that identity, which is the most common identity of its
+    faces, and merges clusters of the same identity.
+    """
+    clusters = clusters.copy()
+    votes: t.Dict[int, t.Counter[str]] = collections.defaultdict(collections.Counter)
+    for index, identity in enumerate(identities):
+        if identity is not None and clusters[index] >= 0:
+            votes[int(clusters[index])][identity] += 1
+    cluster_identity = {cluster: counter.most_common(1)[0][0] for cluster, counter in votes.items()}
+    identity_cluster: t.Dict[str, int] = {}
+    for cluster, identity in sorted(cluster_identity.items()):
+        identity_cluster.setdefault(identity, cluster)
+    next_cluster = int(clusters.max(initial=-1)) + 1
+    for index, identity in enumerate(identities):
+        if identity is None or (
+            clusters[index] >= 0 and cluster_identity.get(int(clusters[index])) == identity
+        ):
+            continue
+        if identity not in identity_cluster:
+            identity_cluster[identity] = next_cluster
+            next_cluster += 1
+        clusters[index] = identity_cluster[identity]
+    for cluster, identity in cluster_identity.items():
+        if identity_cluster[identity] != cluster:
+            clusters[clusters == cluster] = identity_cluster[identity]
+    return clusters
+
+
+def cluster_faces(
+    embeddings: Embeddings, clusters: Clusters, identities: t.Sequence[t.Optional[str]], threshold: float
+) -> Clusters:
+    """
+    Assigns faces without cluster (-1) to clusters, assigned faces keep their clusters. Faces with manual
+    identity are anchors, see `_apply_anchors`. Other faces join the closest cluster if its center is within
+    `threshold`, the rest form new clusters of faces within `threshold` from the first face. Threshold is a
+    distance from center, see `fit_threshold`.
+    """
+    clusters = _apply_anchors(clusters, identities)
+    dimensions = embeddings.shape[1]
+    cluster_count = int(clusters.max(initial=-1)) + 1
+    assigned = clusters >= 0
+    sums = np.zeros((cluster_count, dimensions), dtype=np.float64)
+    np.add.at(sums, clusters[assigned], embeddings[assigned])
+    counts = np.bincount(clusters[assigned], minlength=cluster_count)
+    unassigned = np.flatnonzero(~assigned)
+    for start in range(0, len(unassigned), _BATCH_SIZE):
+        batch = unassigned[start : start + _BATCH_SIZE]
+        existing = np.flatnonzero(counts > 0)
+        rest = batch
+        if len(existing):
+            centers = (sums[existing] / counts[existing, None]).astype(np.float32)
+            distances = _distances(embeddings[batch], centers)
+            nearest = distances.argmin(axis=1)
+            close = distances[np.arange(len(batch)), nearest] <= threshold
+            clusters[batch[close]] = existing[nearest[close]]
+            rest = batch[~close]
+        while len(rest):
+            distances = np.linalg.norm(embeddings[rest] - embeddings[rest[0]], axis=1)
+            clusters[rest[distances <= threshold]] = cluster_count
+            cluster_count += 1
+            rest = rest[distances > threshold]
+        sums = np.concatenate([sums, np.zeros((cluster_count - len(sums), dimensions))])
+        counts = np.concatenate([counts, np.zeros(cluster_count - len(counts), dtype=counts.dtype)])
+        np.add.at(sums, clusters[batch], embeddings[batch])
+        np.add.at(counts, clusters[batch], 1)
+    return clusters
+
+
+class FaceClusterer:
+    """
+    Clusters faces from face index incrementally, manual identities are used as anchors and to fit the
+    distance of faces in the same cluster. Faces skipped by user are not clustered.
+    """
+
+    def __init__(self, connection: PhotosConnection, index: FaceIndex) -> None:
+        self._index = index
+        self._table = FaceClustersTable(connection)
+        self._features = FeaturesTable(connection)
+        self._identities = SQLiteCache(self._features, ManualIdentities, ManualIdentities.from_json_bytes)
+        self._state: t.Optional[t.Tuple[t.Tuple[int, int, int], int]] = None
+
+    def update(self) -> int:
+        """Clusters new faces, if faces or manual identities changed. Returns number of changed faces."""
+        state = (self._index.state(), self._features.last_update(ManualIdentities.__name__))
+        if state == self._state:
+            return 0
+        indexed = self._index.faces()
+        anchors: t.Dict[t.Tuple[str, Position], t.Optional[str]] = {}
+        identities = self._identities.get_many(sorted({md5 for md5, _ in indexed.faces}))
+        for md5, payload in identities.items():
+            if payload.payload is None or payload.payload.p is None:
+                continue
+            for identity in payload.payload.p.identities:
+                anchors[(md5, identity.position)] = identity.identity
+        keep = [i for i, face in enumerate(indexed.faces) if face not in anchors or anchors[face] is not None]
+        rows = indexed.rows[keep]
+        face_identities = [anchors.get(indexed.faces[i]) for i in keep]
+        stored = self._table.clusters()
+        old = np.array([stored.get(int(row), -1) for row in rows], dtype=np.int64)
+        embeddings = indexed.embeddings[keep]
+        new = cluster_faces(embeddings, old, face_identities, fit_threshold(embeddings, face_identities))
+        changed = {int(row): int(cluster) for row, cluster in zip(rows[old != new], new[old != new])}
+        removed = set(stored).difference(int(row) for row in rows)
+        self._table.update(changed, removed)
+        self._state = state
+        return len(changed) + len(removed)
@@ -1,4 +1,7 @@
 import asyncio
+import concurrent.futures as cfut
+import dataclasses as dc
+import datetime
 import itertools
 import os
 import sys
@@ -17,30 +20,35 @@ from pphoto.db.gallery_index_table import GalleryIndexTable
 from pphoto.db.connection import PhotosConnection, GalleryConnection
 from pphoto.db.files_table import FilesTable
 from pphoto.db.cache import SQLiteCache
+from pphoto.db.change_log_table import ChangeLogTable
 from pphoto.db.directories_table import DirectoriesTable
 from pphoto.gallery.image import make_image
 from pphoto.utils.progress_bar import ProgressBar
 
 from pphoto.db.types import FeaturePayload
+from pphoto.db.types_file import FileRow
+from pphoto.db.types_image import Image
+from pphoto.utils import Lazy, batched
 
 
 Ser = t.TypeVar("Ser", bound=StorableData)
 
 
-class Reindexer:
-    def __init__(
-        self,
-        path_to_date: PathDateExtractor,
-        photos_connection: PhotosConnection,
-        gallery_connection: GalleryConnection,
-    ) -> None:
-        # TODO: this should be a feature with loader
+@dc.dataclass
+class ReindexedImage:
+    image: Image
+    directories: t.List[str]
+    max_last_update: float
+    max_dir_last_update: float
+
+
+class ImageComputer:
+    """Reads features and files from photos db and computes gallery index rows, does not write anything."""
+
+    def __init__(self, path_to_date: PathDateExtractor, photos_connection: PhotosConnection) -> None:
         self._path_to_date = path_to_date
-        self._p_con = photos_connection
-        self._g_con = gallery_connection
-        self._features_table = FeaturesTable(self._p_con)
-        self._files_table = FilesTable(self._p_con)
-        self._directories_table = DirectoriesTable(self._g_con)
+        self._features_table = FeaturesTable(photos_connection)
+        self._files_table = FilesTable(photos_connection)
         self._exif = SQLiteCache(self._features_table, ImageExif, ImageExif.from_json_bytes)
         self._dimensions = SQLiteCache(self._features_table, ImageDimensions, ImageDimensions.from_json_bytes)
         self._address = SQLiteCache(self._features_table, GeoAddress, GeoAddress.from_json_bytes)
@@ -55,6 +63,151 @@ class Reindexer:
         )
         self._manual_text = SQLiteCache(self._features_table, ManualText, ManualText.from_json_bytes)
         self._manual_date = SQLiteCache(self._features_table, ManualDate, ManualDate.from_json_bytes)
+
+    def compute(self, md5s: t.Sequence[str]) -> t.List[ReindexedImage]:
+        exif = self._exif.get_many(md5s)
+        dimensions = self._dimensions.get_many(md5s)
+        addr = self._address.get_many(md5s)
+        text_cls = self._text_classification.get_many(md5s)
+        manual_location = self._manual_location.get_many(md5s)
+        manual_text = self._manual_text.get_many(md5s)
+        manual_date = self._manual_date.get_many(md5s)
+        manual_identity = self._manual_identity.get_many(md5s)
+        files = self._files_table.by_md5s(md5s)
+        return [
+            self._compute_one(
+                md5,
+                exif.get(md5),
+                dimensions.get(md5),
+                addr.get(md5),
+                text_cls.get(md5),
+                manual_location.get(md5),
+                manual_text.get(md5),
+                manual_date.get(md5),
+                manual_identity.get(md5),
+                files[md5],
+            )
+            for md5 in md5s
+        ]
+
+    def _compute_one(
+        self,
+        md5: str,
+        exif_payload: t.Optional[FeaturePayload[WithMD5[ImageExif], None]],
+        dimensions_payload: t.Optional[FeaturePayload[WithMD5[ImageDimensions], None]],
+        addr_payload: t.Optional[FeaturePayload[WithMD5[GeoAddress], None]],
+        text_cls_payload: t.Optional[FeaturePayload[WithMD5[ImageClassification], None]],
+        manual_location_payload: t.Optional[FeaturePayload[WithMD5[ManualLocation], None]],
+        manual_text_payload: t.Optional[FeaturePayload[WithMD5[ManualText], None]],
+        manual_date_payload: t.Optional[FeaturePayload[WithMD5[ManualDate], None]],
+        manual_identity_payload: t.Optional[FeaturePayload[WithMD5[ManualIdentities], None]],
+        files: t.List[FileRow],
+    ) -> ReindexedImage:
+        max_last_update = 0.0
+
+        def extract_data(x: t.Optional[FeaturePayload[WithMD5[Ser], None]]) -> t.Optional[Ser]:
+            nonlocal max_last_update
+            if x is None or x.payload is None:
+                return None
+            max_last_update = max(max_last_update, x.last_update)
+            return x.payload.p
+
+        exif = extract_data(exif_payload)
+        dimensions = extract_data(dimensions_payload)
+        addr = extract_data(addr_payload)
+        text_cls = extract_data(text_cls_payload)
+        manual_location = extract_data(manual_location_payload)
+        manual_text = extract_data(manual_text_payload)
+        manual_date = extract_data(manual_date_payload)
+        manual_identity = extract_data(manual_identity_payload)
+        directories = set()
+        max_dir_last_update = 0.0
+        extensions: t.Dict[str, int] = {}
+        for file in files:
+            max_dir_last_update = max(max_dir_last_update, file.last_update)
+            ext: str = os.path.splitext(file.file)[1].lstrip(".")
+            extensions[ext] = extensions.get(ext, 0) + 1
+            for path in [file.file, file.og_file]:
+                if path is not None:
+                    directories.add(os.path.dirname(path))
+        if not extensions:
+            top_extension = "jpg"
+        else:
+            top_extension = sorted(extensions.items(), key=lambda x: x[1])[-1][0]
+
+        effective_max_last_update = max(max_last_update, max_dir_last_update)
+        omg = make_image(
+            md5,
+            top_extension,
+            exif,
+            dimensions,
+            addr,
+            text_cls,
+            manual_location,
+            manual_text,
+            manual_date,
+            manual_identity,
+            [
+                x
+                for x in itertools.chain.from_iterable(
+                    [
+                        self._path_to_date.extract_date(file.file),
+                        None if file.og_file is None else self._path_to_date.extract_date(file.og_file),
+                    ]
+                    for file in files
+                )
+                if x is not None
+            ],
+            effective_max_last_update,
+        )
+
+        assert effective_max_last_update > 0.0
+
+        return ReindexedImage(omg, sorted(directories), max_last_update, max_dir_last_update)
+
+
+_CHANGE_LOG_CONSUMER = "gallery_index"
+_POOL_COMPUTER: t.Optional[ImageComputer] = None
+
+
+def _init_pool(path_to_date: PathDateExtractor, photos_db: str) -> None:
+    # pylint: disable-next = global-statement
+    global _POOL_COMPUTER
+    _POOL_COMPUTER = ImageComputer(path_to_date, PhotosConnection(photos_db))
+
+
+def _compute_in_pool(md5s: t.Sequence[str]) -> t.List[ReindexedImage]:
+    assert _POOL_COMPUTER is not None, "Pool was not initialized"
+    return _POOL_COMPUTER.compute(md5s)
+
+
+def _close_pool(pool: cfut.ProcessPoolExecutor) -> None:
+    pool.shutdown(wait=False, cancel_futures=False)
+
+
+class Reindexer:
+    """
+    Recomputes gallery index from photos db. With `workers` > 0, images are computed in process pool, in
+    batches of `batch_size` md5s, and written to gallery db from this process. Workers read from
+    `photos_connection.path`, so it can't be in-memory db.
+    """
+
+    def __init__(
+        self,
+        path_to_date: PathDateExtractor,
+        photos_connection: PhotosConnection,
+        gallery_connection: GalleryConnection,
+        workers: int = 0,
+        batch_size: int = 100,
+    ) -> None:
+        # TODO: this should be a feature with loader
+        self._p_con = photos_connection
+        self._g_con = gallery_connection
+        self._features_table = FeaturesTable(self._p_con)
+        self._files_table = FilesTable(self._p_con)
+        self._directories_table = DirectoriesTable(self._g_con)
+        self._change_log = ChangeLogTable(self._p_con)
+        self._computer = ImageComputer(path_to_date, self._p_con)
         self._gallery_index = GalleryIndexTable(self._g_con)
         self._feature_types = [
             ImageExif.__name__,
@@ -66,6 +219,18 @@ class Reindexer:
             ManualIdentities.__name__,
         ]
         self._queue: t.Set[str] = set()
+        # Position in change log up to which changes are in `self._queue` or already reindexed
+        self._queue_position = self._change_log.position(_CHANGE_LOG_CONSUMER)
+        self._workers = workers
+        self._batch_size = batch_size
+        self._pool = Lazy(
+            # pylint: disable-next = consider-using-with
+            lambda: cfut.ProcessPoolExecutor(
+                max_workers=workers, initializer=_init_pool, initargs=(path_to_date, photos_connection.path)
+            ),
+            ttl=datetime.timedelta(minutes=20),
+            destructor=_close_pool,
+        )
 
     def reconnect(self) -> None:
         self._p_con.reconnect()
@@ -75,40 +240,29 @@ class Reindexer:
         self._p_con.check_unused()
         self._g_con.check_unused()
 
+    def enqueue_all(self) -> None:
+        """Reindex all images, e.g. for full rebuild of gallery db."""
+        self._queue.update(self._files_table.all_md5s())
+
     async def load(self, progress: t.Optional[ProgressBar]) -> int:
         reindexed = 0
-        # TODO:
-        # If queue does not exists
-        #     Pull queue from the DB
-        # If queue is empty:
-        #     check newest items from source tables, save queue index
-        #     put and store them into queue
-        # Additionally, make the DB to automatically batch inserts in transactions.
-        # Why?
-        # 1. photo table will be again read only.
-        # 2. Ability to have more clients reindexing / reacting to changes
-        # 3. Faster reingest -- only one table is locking
         if not self._queue:
-            if progress is not None:
-                # TODO: this is wrong?
-                todo = (
-                    self._files_table.dirty_md5s_total()
-                    + self._features_table.dirty_md5s_total(self._feature_types)
-                    + self._gallery_index.old_versions_md5_total()
-                )
-                progress.update_what_is_left(todo)
             fetch_limit = 100000
-            for md5, _last_update in set(
-                itertools.chain(
-                    self._features_table.dirty_md5s(self._feature_types, limit=fetch_limit),
-                    ((x, None) for x in self._files_table.dirty_md5s(limit=fetch_limit)),
-                    ((x, None) for x in self._gallery_index.old_versions_md5(limit=fetch_limit)),
-                )
-            ):
-                self._queue.add(md5)
-        to_do_this_round = list(itertools.islice(self._queue, 1000))
-        for md5s in batched(to_do_this_round, 100):
+            changed, self._queue_position = self._change_log.changes(
+                self._change_log.position(_CHANGE_LOG_CONSUMER), self._feature_types, limit=fetch_limit
+            )
+            self._queue.update(changed)
+            self._queue.update(self._gallery_index.old_versions_md5(limit=fetch_limit))
+        if progress is not None:
+            progress.update_what_is_left(len(self._queue) + self._change_log.left(self._queue_position))
+        to_do_this_round = list(
+            itertools.islice(self._queue, max(1000, 4 * self._workers * self._batch_size))
+        )
+        computed = self._start_computing_in_pool(to_do_this_round) if self._workers > 0 else {}
+        for md5s in batched(to_do_this_round, self._batch_size):
             try:
+                # Await before transaction, so other tasks don't write into it in the meantime
+                computed_batch = await computed[md5s] if md5s in computed else None
                 with (
                     # pylint: disable-next = protected-access
                     self._files_table._con.transaction(),
@@ -119,8 +273,7 @@ class Reindexer:
                     # pylint: disable-next = protected-access
                     self._gallery_index._con.transaction(),
                 ):
-                    for md5 in md5s:
-                        self._reindex(md5)
+                    self._reindex(md5s, computed_batch)
                 for md5 in md5s:
                     self._queue.remove(md5)
                 if progress is not None:
@@ -135,92 +288,39 @@ class Reindexer:
                     file=sys.stderr,
                 )
                 for md5 in md5s:
-                    self._reindex(md5)
+                    self._reindex((md5,), None)
                     self._queue.remove(md5)
                     if progress is not None:
                         progress.update(1)
                     reindexed += 1
             await asyncio.sleep(0.001)
 
+        if not self._queue:
+            # Everything up to this position is in gallery db
+            self._change_log.set_position(_CHANGE_LOG_CONSUMER, self._queue_position)
+            self._change_log.prune()
         if progress is not None:
             progress.refresh()
         return reindexed
 
-    def _reindex(self, md5: str) -> None:
-        max_last_update = 0.0
-
-        def extract_data(x: t.Optional[FeaturePayload[WithMD5[Ser], None]]) -> t.Optional[Ser]:
-            nonlocal max_last_update
-            if x is None or x.payload is None:
-                return None
-            max_last_update = max(max_last_update, x.last_update)
-            return x.payload.p
-
-        exif = extract_data(self._exif.get(md5))
-        dimensions = extract_data(self._dimensions.get(md5))
-        addr = extract_data(self._address.get(md5))
-        text_cls = extract_data(self._text_classification.get(md5))
-        manual_location = extract_data(self._manual_location.get(md5))
-        manual_text = extract_data(self._manual_text.get(md5))
-        manual_date = extract_data(self._manual_date.get(md5))
-        manual_identity = extract_data(self._manual_identity.get(md5))
-        files = self._files_table.by_md5(md5)
-        directories = set()
-        max_dir_last_update = 0.0
-        extensions: t.Dict[str, int] = {}
-        for file in files:
-            max_dir_last_update = max(max_dir_last_update, file.last_update)
-            ext: str = os.path.splitext(file.file)[1].lstrip(".")
-            extensions[ext] = extensions.get(ext, 0) + 1
-            for path in [file.file, file.og_file]:
-                if path is not None:
-                    directories.add(os.path.dirname(path))
-        if not extensions:
-            top_extension = "jpg"
-        else:
-            top_extension = sorted(extensions.items(), key=lambda x: x[1])[-1][0]
-
-        effective_max_last_update = max(max_last_update, max_dir_last_update)
-        omg = make_image(
-            md5,
-            top_extension,
-            exif,
-            dimensions,
-            addr,
-            text_cls,
-            manual_location,
-            manual_text,
-            manual_date,
-            manual_identity,
-            [
-                x
-                for x in itertools.chain.from_iterable(
-                    [
-                        self._path_to_date.extract_date(file.file),
-                        None if file.og_file is None else self._path_to_date.extract_date(file.og_file),
-                    ]
-                    for file in files
-                )
-                if x is not None
-            ],
-            effective_max_last_update,
-        )
-
-        assert effective_max_last_update > 0.0
-
-        self._directories_table.multi_add([(d, md5) for d in directories])
-        self._files_table.undirty(md5, max_dir_last_update)
-        self._gallery_index.add(omg)
-        self._features_table.undirty(md5, self._feature_types, max_last_update)
-
-
-T = t.TypeVar("T")
-
+    def _start_computing_in_pool(
+        self, md5s: t.List[str]
+    ) -> t.Dict[t.Tuple[str, ...], asyncio.Future[t.List[ReindexedImage]]]:
+        # Workers see only committed data
+        self._p_con.flush()
+        loop = asyncio.get_running_loop()
+        pool = self._pool.get()
+        return {
+            batch: loop.run_in_executor(pool, _compute_in_pool, batch)
+            for batch in batched(md5s, self._batch_size)
+        }
 
-def batched(iterable: t.Iterable[T], n: int) -> t.Iterable[t.Tuple[T, ...]]:
-    # batched('ABCDEFG', 3) → ABC DEF G
-    if n < 1:
-        raise ValueError("n must be at least one")
-    iterator = iter(iterable)
-    while batch := tuple(itertools.islice(iterator, n)):
-        yield batch
+    def _reindex(self, md5s: t.Sequence[str], computed: t.Optional[t.List[ReindexedImage]]) -> None:
+        if computed is None:
+            computed = self._computer.compute(md5s)
+        for item in computed:
+            md5 = item.image.md5
+            self._directories_table.multi_add([(d, md5) for d in item.directories])
+            self._files_table.undirty(md5, item.max_dir_last_update)
+            self._gallery_index.add(item.image)
+            self._features_table.undirty(md5, self._feature_types, item.max_last_update)
@@ -0,0 +1,44 @@
+import json
+import os
+import tempfile
+import unittest
+
+from pphoto.data_model.face import Face, FaceEmbeddings, ImageResolution, Position
+from pphoto.data_model.manual import ManualIdentities, ManualIdentity
+from pphoto.db.connection import GalleryConnection, JobsConnection, PhotosConnection
+from pphoto.db.features_table import FeaturesTable
+from pphoto.gallery.db import ImageSqlDB
+
+
+class TestImageSqlDB(unittest.TestCase):
+    def test_get_faces_with_identities(self) -> None:
+        with tempfile.TemporaryDirectory() as directory:
+            photos = PhotosConnection(os.path.join(directory, "photos.db"))
+            db = ImageSqlDB(
+                photos,
+                GalleryConnection(os.path.join(directory, "gallery.db")),
+                JobsConnection(os.path.join(directory, "jobs.db")),
+                os.path.join(directory, "faces.f32"),
+            )
+            features = FeaturesTable(photos)
+            position = Position(0, 0, 10, 10, None)
+            embeddings = FaceEmbeddings(ImageResolution(100, 100), [Face(position, [1.0] * 128)])
+            identities = ManualIdentities([ManualIdentity("Alice", None, position)])
+            features.add(
+                embeddings.to_bytes(), None, "FaceEmbeddings", "M1", FaceEmbeddings.current_version()
+            )
+            features.add(
+                embeddings.to_bytes(), None, "FaceEmbeddings", "M2", FaceEmbeddings.current_version()
+            )
+            features.add(
+                json.dumps(identities.to_json_dict()).encode("utf-8"),
+                None,
+                "ManualIdentities",
+                "M2",
+                ManualIdentities.current_version(),
+            )
+
+            got = db.get_faces_with_identities(["M1", "M2", "M3"])
+            self.assertEqual(got["M1"], (embeddings, None))
+            self.assertEqual(got["M2"], (embeddings, identities))
+            self.assertEqual(got["M3"], (None, None))
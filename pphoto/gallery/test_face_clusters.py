@@ -0,0 +1,102 @@
+import json
+import os
+import tempfile
+import unittest
+
+import numpy as np
+
+from pphoto.data_model.face import Face, FaceEmbeddings, ImageResolution, Position
+from pphoto.data_model.manual import IdentitySkipReason, ManualIdentities, ManualIdentity
+from pphoto.db.connection import PhotosConnection
+from pphoto.db.face_clusters_table import FaceClustersTable
+from pphoto.db.face_index import FaceIndex
+from pphoto.db.features_table import FeaturesTable
+from pphoto.gallery.face_clusters import FaceClusterer, cluster_faces, fit_threshold
+
+
+def blobs(*centers: float, size: int = 5, spread: float = 0.05) -> np.ndarray:  # type: ignore[type-arg]
+    """Faces around given centers, center is the value of the first dimension"""
+    rng = np.random.default_rng(0)
+    out = []
+    for center in centers:
+        base = np.zeros(128, dtype=np.float32)
+        base[0] = center
+        out.append(base + rng.normal(0, spread / np.sqrt(128), (size, 128)).astype(np.float32))
+    return np.concatenate(out)
+
+
+class TestClustering(unittest.TestCase):
+    def test_fit_threshold(self) -> None:
+        embeddings = blobs(0.0, 1.0)
+        identities = ["A"] * 5 + ["B"] * 5
+        threshold = fit_threshold(embeddings, identities)
+        self.assertGreater(threshold, 0.1)
+        self.assertLess(threshold, 0.9)
+        self.assertEqual(fit_threshold(embeddings, [None] * 10, default=0.3), 0.3)
+        self.assertEqual(fit_threshold(embeddings, ["A"] * 10, default=0.3), 0.3)
+
+    def test_threshold_is_distance_from_center(self) -> None:
+        embeddings = blobs(0.0, 1.0, size=20, spread=0.3)
+        identities = ["A"] * 20 + ["B"] * 20
+        threshold = fit_threshold(embeddings, identities)
+        pairwise = 0.0
+        from_center = 0.0
+        for faces in [embeddings[:20], embeddings[20:]]:
+            pairwise = max(pairwise, float(np.linalg.norm(faces[:, None] - faces[None, :], axis=2).max()))
+            for i, face in enumerate(faces):
+                center = np.delete(faces, i, axis=0).mean(axis=0)
+                from_center = max(from_center, float(np.linalg.norm(face - center)))
+        # Separating distance is the furthest face from center of the rest of its identity
+        self.assertAlmostEqual(threshold, from_center, places=5)
+        self.assertLess(threshold, pairwise)
+
+    def test_new_faces_form_clusters(self) -> None:
+        clusters = cluster_faces(blobs(0.0, 1.0, 2.0), np.full(15, -1), [None] * 15, 0.4)
+        self.assertEqual(len(set(clusters[:5])), 1)
+        self.assertEqual(len(set(clusters[5:10])), 1)
+        self.assertEqual(len(set(clusters)), 3)
+
+    def test_existing_clusters_are_kept(self) -> None:
+        existing = np.array([7] * 5 + [3] * 5 + [-1] * 5)
+        clusters = cluster_faces(blobs(0.0, 1.0, 0.01), existing, [None] * 15, 0.4)
+        self.assertListEqual(clusters.tolist(), [7] * 5 + [3] * 5 + [7] * 5)
+
+    def test_anchors_merge_and_move_faces(self) -> None:
+        existing = np.array([0] * 5 + [1] * 5)
+        identities = ["A", None, None, None, "B", "A", None, None, None, None]
+        clusters = cluster_faces(blobs(0.0, 1.0), existing, identities, 0.4)
+        # Clusters with the same identity are merged, face of other identity gets its own cluster
+        self.assertListEqual(clusters.tolist(), [0, 0, 0, 0, 2, 0, 0, 0, 0, 0])
+
+
+class TestFaceClusterer(unittest.TestCase):
+    def test_update(self) -> None:
+        with tempfile.TemporaryDirectory() as directory:
+            connection = PhotosConnection(os.path.join(directory, "photos.db"))
+            index = FaceIndex(connection, os.path.join(directory, "faces.f32"))
+            clusterer = FaceClusterer(connection, index)
+            embeddings = blobs(0.0, 1.0, size=2)
+            positions = [Position(i, 0, i + 10, 10, None) for i in range(2)]
+            for md5, rows in [("M1", embeddings[[0, 2]]), ("M2", embeddings[[1, 3]])]:
+                index.add(
+                    md5,
+                    FaceEmbeddings(
+                        ImageResolution(100, 100), [Face(p, e.tolist()) for p, e in zip(positions, rows)]
+                    ),
+                )
+            identities = ManualIdentities([ManualIdentity(None, IdentitySkipReason.NOT_FACE, positions[1])])
+            FeaturesTable(connection).add(
+                json.dumps(identities.to_json_dict()).encode("utf-8"),
+                None,
+                "ManualIdentities",
+                "M2",
+                ManualIdentities.current_version(),
+            )
+
+            self.assertEqual(clusterer.update(), 3)
+            self.assertEqual(clusterer.update(), 0)
+            clusters = FaceClustersTable(connection).clusters_of(["M1", "M2"])
+            self.assertEqual(len(clusters), 3)
+            self.assertEqual(clusters[("M1", positions[0])], clusters[("M2", positions[0])])
+            self.assertNotEqual(clusters[("M1", positions[0])], clusters[("M1", positions[1])])
+            self.assertNotIn(("M2", positions[1]), clusters)
@@ -1,4 +1,6 @@
+import base64
 import datetime as dt
+import json
 import typing as t
 from dataclasses import dataclass
 import enum
@@ -26,6 +28,38 @@ class SortParams:
 class GalleryPaging:
     page: int = 0
     paging: int = 100
+    # Opaque cursor returned with previous page. If set, `page` is ignored and query seeks right after the cursor.
+    cursor: t.Optional[str] = None
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+@dataclass
+class GalleryCursor(DataClassJsonMixin):
+    """Position of the last returned image, in the (timestamp, md5) order."""
+
+    timestamp: t.Optional[float]
+    md5: str
+
+    def encode(self) -> str:
+        return base64.urlsafe_b64encode(self.to_json().encode("utf-8")).decode("ascii")
+
+    @staticmethod
+    def decode(cursor: str) -> "GalleryCursor":
+        """Raises `InvalidCursor` for cursors that were not returned by `encode`"""
+        try:
+            data = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+        except ValueError as e:
+            raise InvalidCursor(f"Invalid cursor: {cursor!r}") from e
+        if (
+            not isinstance(data, dict)
+            or not isinstance(data.get("md5"), str)
+            or not isinstance(data.get("timestamp", ""), (float, int, type(None)))
+        ):
+            raise InvalidCursor(f"Invalid cursor: {cursor!r}")
+        return GalleryCursor(data["timestamp"], data["md5"])
 
 
 @dataclass
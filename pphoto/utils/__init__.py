@@ -1,6 +1,7 @@
 import typing as t
 import datetime
 import gc
+import itertools
 import random
 import sys
 import traceback
@@ -21,15 +22,27 @@ V = t.TypeVar("V")
 _LAZY_WITH_TTL: "t.List[Lazy[t.Any]]" = []
 
 
+def batched(iterable: t.Iterable[T], n: int) -> t.Iterable[t.Tuple[T, ...]]:
+    # batched('ABCDEFG', 3) → ABC DEF G
+    if n < 1:
+        raise ValueError("n must be at least one")
+    iterator = iter(iterable)
+    while batch := tuple(itertools.islice(iterator, n)):
+        yield batch
+
+
 class Lazy(t.Generic[T]):
     def __init__(
         self,
         constructor: t.Callable[[], T],
         ttl: t.Optional[datetime.timedelta] = None,
         destructor: t.Optional[t.Callable[[T], None]] = None,
+        keep_alive: t.Optional[t.Callable[[], bool]] = None,
     ) -> None:
+        """Value is freed once it was not used for `ttl`, time while `keep_alive` returns True counts as use"""
         self._constructor = constructor
         self._destructor = destructor
+        self._keep_alive = keep_alive
         self._value: t.Optional[T] = None
         self._ttl = ttl
         self._last_use = datetime.datetime.now()
@@ -46,6 +59,8 @@ class Lazy(t.Generic[T]):
             gc.collect()
 
     def internal_check_ttl(self, now: datetime.datetime) -> bool:
+        if self._value is not None and self._keep_alive is not None and self._keep_alive():
+            self._last_use = now
         if self._value is not None and self._ttl is not None and self._last_use + self._ttl < now:
             gc.collect()
             if len(gc.get_referrers(self._value)) > 1:
@@ -73,6 +88,17 @@ class Lazy(t.Generic[T]):
             del self._constructor
         return self._value
 
+    def discard(self, value: T) -> None:
+        """
+        Frees broken value, so that next `get()` constructs a new one. Does nothing if value was already
+        replaced. Only for values with `ttl`, as otherwise constructor is not kept.
+        """
+        if self._value is not value:
+            return
+        if self._destructor is not None:
+            self._destructor(value)
+        self._value = None
+
 
 class DefaultDict(dict[K, V]):
     def __init__(self, default_factory: t.Callable[[K], V]):
@@ -0,0 +1,62 @@
+import asyncio
+import datetime
+import typing as t
+
+I = t.TypeVar("I")
+O = t.TypeVar("O")
+
+
+class Batcher(t.Generic[I, O]):
+    """
+    Collects items from concurrent `process` calls into batches. Batch is processed once it has `batch_size`
+    items, or `max_wait` after its first item arrived.
+    """
+
+    def __init__(
+        self,
+        process_batch: t.Callable[[t.List[I]], t.Awaitable[t.List[O]]],
+        batch_size: int,
+        max_wait: datetime.timedelta,
+    ) -> None:
+        self._process_batch = process_batch
+        self._batch_size = batch_size
+        self._max_wait = max_wait
+        self._pending: t.List[t.Tuple[I, asyncio.Future[O]]] = []
+        self._timer: t.Optional[asyncio.TimerHandle] = None
+        self._running: t.Set[asyncio.Task[None]] = set()
+
+    async def process(self, item: I) -> O:
+        loop = asyncio.get_running_loop()
+        future: asyncio.Future[O] = loop.create_future()
+        self._pending.append((item, future))
+        if len(self._pending) >= self._batch_size:
+            self._flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self._max_wait.total_seconds(), self._flush)
+        return await future
+
+    def _flush(self) -> None:
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        batch, self._pending = self._pending, []
+        if not batch:
+            return
+        task = asyncio.create_task(self._run(batch))
+        # Keep reference, so the task is not garbage collected
+        self._running.add(task)
+        task.add_done_callback(self._running.discard)
+
+    async def _run(self, batch: t.List[t.Tuple[I, asyncio.Future[O]]]) -> None:
+        try:
+            results = await self._process_batch([item for item, _ in batch])
+            assert len(results) == len(batch), "Batch processing returned wrong number of results"
+        # pylint: disable-next = broad-exception-caught
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        for (_, future), result in zip(batch, results):
+            if not future.done():
+                future.set_result(result)
@@ -2,6 +2,7 @@ import enum
 import glob
 import os
 import re
+import time
 import typing as t
 
 from pphoto.utils.typing_support import assert_never
@@ -82,6 +83,74 @@ def get_paths(input_patterns: t.List[str], input_directories: t.List[str]) -> t.
         yield from walk_tree(expand_vars_in_path(directory))
 
 
+class DirectorySnapshot(t.NamedTuple):
+    mtime_ns: int
+    scanned_at_ns: int
+
+
+# Directory modified this long before scan might be modified again without mtime change, on file systems
+# with coarse timestamps.
+_RACY_MTIME_NS = 2 * 10**9
+
+
+def walk_changed_tree(
+    path: str,
+    snapshots: t.Mapping[str, DirectorySnapshot],
+    new_snapshots: t.Dict[str, DirectorySnapshot],
+) -> t.Iterable[str]:
+    """
+    Like `walk_tree`, but skips listing of directories with the same mtime as in `snapshots`. Their known
+    subdirectories are still checked. Snapshots of all visited directories are stored in `new_snapshots`.
+    """
+    # Configured path can end with slash, it has to match parents of its subdirectories
+    snapshots = {os.path.normpath(directory): snapshot for directory, snapshot in snapshots.items()}
+    subdirectories: t.Dict[str, t.List[str]] = {}
+    for directory in snapshots:
+        subdirectories.setdefault(os.path.dirname(directory), []).append(directory)
+    stack = [os.path.normpath(path)]
+    while stack:
+        directory = stack.pop()
+        try:
+            stat = os.stat(directory)
+        except OSError:
+            continue
+        old = snapshots.get(directory)
+        if (
+            old is not None
+            and old.mtime_ns == stat.st_mtime_ns
+            and stat.st_mtime_ns < old.scanned_at_ns - _RACY_MTIME_NS
+        ):
+            new_snapshots[directory] = old
+            stack.extend(subdirectories.get(directory, []))
+            continue
+        new_snapshots[directory] = DirectorySnapshot(stat.st_mtime_ns, time.time_ns())
+        try:
+            with os.scandir(directory) as entries:
+                for entry in entries:
+                    if entry.is_dir():
+                        # Same as os.walk, symlinks to directories are not followed
+                        if not entry.is_symlink():
+                            stack.append(entry.path)
+                    elif supported_media(entry.name) is not None:
+                        yield entry.path
+        except OSError:
+            # Directory will be listed again next time
+            del new_snapshots[directory]
+
+
+def get_changed_paths(
+    input_patterns: t.List[str],
+    input_directories: t.List[str],
+    snapshots: t.Mapping[str, DirectorySnapshot],
+    new_snapshots: t.Dict[str, DirectorySnapshot],
+) -> t.Iterable[str]:
+    """Like `get_paths`, but lists only changed directories, see `walk_changed_tree`. Patterns are always globbed."""
+    for pattern in input_patterns:
+        yield from glob.glob(expand_vars_in_path(pattern), recursive=True)
+    for directory in input_directories:
+        yield from walk_changed_tree(expand_vars_in_path(directory), snapshots, new_snapshots)
+
+
 def expand_vars_in_path(path: str) -> str:
     return re.sub("^~/", os.environ["HOME"] + "/", path)
 
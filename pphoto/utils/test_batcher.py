@@ -0,0 +1,32 @@
+import asyncio
+import datetime
+import typing as t
+import unittest
+
+from pphoto.utils.batcher import Batcher
+
+
+class TestBatcher(unittest.IsolatedAsyncioTestCase):
+    async def test_batches_concurrent_calls(self) -> None:
+        batches: t.List[t.List[int]] = []
+
+        async def process(items: t.List[int]) -> t.List[int]:
+            batches.append(items)
+            return [x * 2 for x in items]
+
+        batcher = Batcher(process, 3, datetime.timedelta(seconds=0.01))
+        ret = await asyncio.gather(*(batcher.process(x) for x in range(5)))
+        self.assertListEqual(list(ret), [0, 2, 4, 6, 8])
+        self.assertListEqual(batches, [[0, 1, 2], [3, 4]])
+
+    async def test_exception_is_propagated(self) -> None:
+        async def process(_items: t.List[int]) -> t.List[int]:
+            raise ValueError("Nope")
+
+        batcher = Batcher(process, 3, datetime.timedelta(seconds=0.01))
+        with self.assertRaises(ValueError):
+            await batcher.process(1)
+
+
+if __name__ == "__main__":
+    unittest.main()
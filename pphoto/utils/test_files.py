@@ -0,0 +1,68 @@
+import os
+import tempfile
+import typing as t
+import unittest
+
+from pphoto.utils.files import DirectorySnapshot, walk_changed_tree
+
+
+def touch(path: str) -> None:
+    with open(path, "wb"):
+        pass
+
+
+def set_mtime(path: str, mtime_ns: int) -> None:
+    os.utime(path, ns=(mtime_ns, mtime_ns))
+
+
+class TestWalkChangedTree(unittest.TestCase):
+    def test_lists_only_changed_directories(self) -> None:
+        with tempfile.TemporaryDirectory() as root:
+            os.makedirs(f"{root}/a/b")
+            touch(f"{root}/x.jpg")
+            touch(f"{root}/a/b/y.jpg")
+            touch(f"{root}/a/b/ignored.txt")
+            for directory in [root, f"{root}/a", f"{root}/a/b"]:
+                set_mtime(directory, 10**9)
+
+            snapshots: t.Dict[str, DirectorySnapshot] = {}
+            found = set(walk_changed_tree(root, {}, snapshots))
+            self.assertEqual(found, {f"{root}/x.jpg", f"{root}/a/b/y.jpg"})
+            self.assertEqual(set(snapshots), {root, f"{root}/a", f"{root}/a/b"})
+
+            touch(f"{root}/a/b/z.jpg")
+            set_mtime(f"{root}/a/b", 10**9)
+            new_snapshots: t.Dict[str, DirectorySnapshot] = {}
+            self.assertEqual(list(walk_changed_tree(root, snapshots, new_snapshots)), [])
+            self.assertEqual(new_snapshots, snapshots)
+
+            set_mtime(f"{root}/a/b", 2 * 10**9)
+            self.assertEqual(
+                set(walk_changed_tree(root, snapshots, {})), {f"{root}/a/b/y.jpg", f"{root}/a/b/z.jpg"}
+            )
+
+    def test_path_with_trailing_slash(self) -> None:
+        with tempfile.TemporaryDirectory() as root:
+            os.makedirs(f"{root}/a")
+            touch(f"{root}/a/y.jpg")
+            for directory in [root, f"{root}/a"]:
+                set_mtime(directory, 10**9)
+            snapshots: t.Dict[str, DirectorySnapshot] = {}
+            self.assertEqual(list(walk_changed_tree(f"{root}/", {}, snapshots)), [f"{root}/a/y.jpg"])
+
+            touch(f"{root}/a/z.jpg")
+            set_mtime(f"{root}/a", 2 * 10**9)
+            self.assertEqual(
+                set(walk_changed_tree(f"{root}/", snapshots, {})), {f"{root}/a/y.jpg", f"{root}/a/z.jpg"}
+            )
+
+    def test_recently_modified_directory_is_listed_again(self) -> None:
+        with tempfile.TemporaryDirectory() as root:
+            touch(f"{root}/x.jpg")
+            snapshots: t.Dict[str, DirectorySnapshot] = {}
+            self.assertEqual(list(walk_changed_tree(root, {}, snapshots)), [f"{root}/x.jpg"])
+            self.assertEqual(list(walk_changed_tree(root, snapshots, {})), [f"{root}/x.jpg"])
+
+
+if __name__ == "__main__":
+    unittest.main()
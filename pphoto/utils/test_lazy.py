@@ -0,0 +1,42 @@
+import datetime
+import typing as t
+import unittest
+
+from pphoto.utils import Lazy
+
+
+class TestLazy(unittest.TestCase):
+    def test_keep_alive_postpones_ttl(self) -> None:
+        freed: t.List[t.List[int]] = []
+        busy = [True]
+        lazy = Lazy(
+            lambda: [1],
+            ttl=datetime.timedelta(seconds=10),
+            destructor=freed.append,
+            keep_alive=lambda: busy[0],
+        )
+        value = lazy.get()
+        del value
+        now = datetime.datetime.now() + datetime.timedelta(seconds=60)
+        self.assertFalse(lazy.internal_check_ttl(now))
+        busy[0] = False
+        self.assertFalse(lazy.internal_check_ttl(now + datetime.timedelta(seconds=5)))
+        self.assertTrue(lazy.internal_check_ttl(now + datetime.timedelta(seconds=11)))
+        self.assertEqual(freed, [[1]])
+
+    def test_discard(self) -> None:
+        freed: t.List[t.List[int]] = []
+        lazy = Lazy(lambda: [1], ttl=datetime.timedelta(seconds=10), destructor=freed.append)
+        old = lazy.get()
+        lazy.discard(old)
+        self.assertEqual(freed, [old])
+        new = lazy.get()
+        self.assertIsNot(new, old)
+        # Value replaced in meantime is kept
+        lazy.discard(old)
+        self.assertIs(lazy.get(), new)
+        self.assertEqual(freed, [old])
+
+
+if __name__ == "__main__":
+    unittest.main()
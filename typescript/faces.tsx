@@ -459,10 +459,32 @@ function doClustering(
     faces: FaceWithMeta[],
 ): Array<Array<FaceWithMeta>> {
     const clusters: Array<Array<FaceWithMeta>> = [];
+    // Faces clustered by server are grouped by cluster id, the rest are clustered here
+    const byId = new Map<number, Array<FaceWithMeta>>();
     faces.forEach((face) => {
+        if (face.cluster === undefined || face.cluster === null) {
+            return;
+        }
+        const cluster = byId.get(face.cluster);
+        if (cluster === undefined) {
+            const newCluster = [face];
+            byId.set(face.cluster, newCluster);
+            clusters.push(newCluster);
+        } else {
+            cluster.push(face);
+        }
+    });
+    faces.forEach((face) => {
+        if (face.cluster !== undefined && face.cluster !== null) {
+            return;
+        }
+        const embedding = face.embedding;
         const closest = clusters.find((cluster) => {
             const center = cluster[0];
-            const dist = distance(center.embedding, face.embedding);
+            if (embedding === null || center.embedding === null) {
+                return false;
+            }
+            const dist = distance(center.embedding, embedding);
             return dist <= threshold;
         });
         if (closest === undefined) {
@@ -60,6 +60,7 @@ export function GalleryComponent({
             omgs: [],
             has_next_page: false,
             some_location: null,
+            next_cursor: null,
         },
         md5ToIndex: new Map(),
         lastFetchedPage: -1,
@@ -98,12 +99,17 @@ export function GalleryComponent({
         let ignore = false;
         const requestBody = {
             query,
-            paging: { paging: paging.paging, page: pageToFetch },
+            paging: {
+                paging: paging.paging,
+                page: pageToFetch,
+                // Cursor makes backend seek after the last image instead of skipping previous pages
+                cursor: pageToFetch > 0 ? data.response.next_cursor : null,
+            },
             sort,
         };
         backend
             .fetchImages(requestBody)
-            .then(({ has_next_page, omgs, some_location }) => {
+            .then(({ has_next_page, omgs, some_location, next_cursor }) => {
                 if (!ignore) {
                     const response =
                         pageToFetch > 0
@@ -112,11 +118,13 @@ export function GalleryComponent({
                                   has_next_page,
                                   omgs: [],
                                   some_location,
+                                  next_cursor,
                               };
                     if (some_location !== null) {
                         response.some_location = some_location;
                     }
                     response.has_next_page = has_next_page;
+                    response.next_cursor = next_cursor;
                     // Images are used as dependency, we need to change it
                     response.omgs = [...response.omgs, ...omgs];
                     // This is ok, as md5ToIndex is not used as dependency for useEffect
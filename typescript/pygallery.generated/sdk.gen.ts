@@ -3,7 +3,7 @@
 import type { CancelablePromise } from './core/CancelablePromise';
 import { OpenAPI } from './core/OpenAPI';
 import { request as __request } from './core/request';
-import type { RecentLocationClustersFromManualAnnotationsEndpointGetResponse, MassManualAnnotationEndpointPostData, MassManualAnnotationEndpointPostResponse, ManualIdentityAnnotationEndpointPostData, ManualIdentityAnnotationEndpointPostResponse, JobProgressStatePostData, JobProgressStatePostResponse, RemoteJobsGetResponse, SystemStatusGetResponse, ConfigExportDirsEndpointGetResponse, ExportPhotosGetData, ExportPhotosGetResponse, ExportPhotosToDirGetData, ExportPhotosToDirGetResponse, FindLocationPostData, FindLocationPostResponse, GetAddressPostData, GetAddressPostResponse, ImageEndpointGetData, ImageEndpointGetResponse, VideoEndpointGetData, VideoEndpointGetResponse, LocationClustersEndpointPostData, LocationClustersEndpointPostResponse, LocationBoundsEndpointPostData, LocationBoundsEndpointPostResponse, DateClustersEndpointPostData, DateClustersEndpointPostResponse, ImagePagePostData, ImagePagePostResponse, MatchingDirectoriesPostData, MatchingDirectoriesPostResponse, TopIdentitiesPostResponse, AggregateImagesPostData, AggregateImagesPostResponse, FacesOnPagePostData, FacesOnPagePostResponse, FaceFeaturesForImagePostData, FaceFeaturesForImagePostResponse, ReadIndexGetResponse, ReadIndexGet1Response } from './types.gen';
+import type { RecentLocationClustersFromManualAnnotationsEndpointGetResponse, MassManualAnnotationEndpointPostData, MassManualAnnotationEndpointPostResponse, ManualIdentityAnnotationEndpointPostData, ManualIdentityAnnotationEndpointPostResponse, JobProgressStatePostData, JobProgressStatePostResponse, RemoteJobsGetResponse, SystemStatusGetResponse, ConfigExportDirsEndpointGetResponse, ExportPhotosGetData, ExportPhotosGetResponse, ExportPhotosToDirGetData, ExportPhotosToDirGetResponse, FindLocationPostData, FindLocationPostResponse, GetAddressPostData, GetAddressPostResponse, ImageEndpointGetData, ImageEndpointGetResponse, VideoEndpointGetData, VideoEndpointGetResponse, LocationClustersEndpointPostData, LocationClustersEndpointPostResponse, LocationBoundsEndpointPostData, LocationBoundsEndpointPostResponse, DateClustersEndpointPostData, DateClustersEndpointPostResponse, ImagePagePostData, ImagePagePostResponse, MatchingDirectoriesPostData, MatchingDirectoriesPostResponse, TopIdentitiesPostResponse, AggregateImagesPostData, AggregateImagesPostResponse, FacesOnPagePostData, FacesOnPagePostResponse, SimilarFacesPostData, SimilarFacesPostResponse, FaceFeaturesForImagePostData, FaceFeaturesForImagePostResponse, ReadIndexGetResponse, ReadIndexGet1Response } from './types.gen';
 
 /**
  * Recent Location Clusters From Manual Annotations Endpoint
@@ -390,6 +390,25 @@ export const facesOnPagePost = (data: FacesOnPagePostData): CancelablePromise<Fa
     });
 };
 
+/**
+ * Similar Faces
+ * @param data The data for the request.
+ * @param data.requestBody
+ * @returns SimilarFacesResponse Successful Response
+ * @throws ApiError
+ */
+export const similarFacesPost = (data: SimilarFacesPostData): CancelablePromise<SimilarFacesPostResponse> => {
+    return __request(OpenAPI, {
+        method: 'POST',
+        url: '/api/web/faces/similar',
+        body: data.requestBody,
+        mediaType: 'application/json',
+        errors: {
+            422: 'Validation Error'
+        }
+    });
+};
+
 /**
  * Face Features For Image
  * @param data The data for the request.
@@ -72,6 +72,13 @@ export type FaceIdentifier = {
     position: Position;
 };
 
+export type FacesRequest = {
+    query: SearchQuery;
+    paging: GalleryPaging;
+    sort: SortParams;
+    include_embeddings?: boolean;
+};
+
 export type FacesResponse = {
     has_next_page: boolean;
     faces: Array<FaceWithMeta>;
@@ -84,7 +91,8 @@ export type FaceWithMeta = {
     extension: string;
     identity: (string | null);
     skip_reason: (IdentitySkipReason | null);
-    embedding: Array<(number)>;
+    embedding: (Array<(number)> | null);
+    cluster?: (number | null);
 };
 
 export type FoundLocation = {
@@ -96,6 +104,7 @@ export type FoundLocation = {
 export type GalleryPaging = {
     page?: number;
     paging?: number;
+    cursor?: (string | null);
 };
 
 export type GalleryRequest = {
@@ -123,6 +132,12 @@ export type IdentityRowPayload = {
 
 export type IdentitySkipReason = 'not_face' | 'not_poi';
 
+export type IdentitySuggestion = {
+    identity: string;
+    distance: number;
+    faces: number;
+};
+
 export type Image = {
     md5: string;
     extension: string;
@@ -181,6 +196,7 @@ export type ImageResponse = {
     has_next_page: boolean;
     omgs: Array<ImageWithMeta>;
     some_location: (ManualLocation | null);
+    next_cursor: (string | null);
 };
 
 export type ImageSize = 'original' | 'medium' | 'preview';
@@ -376,6 +392,26 @@ export type SearchQuery = {
     timestamp_trans?: (string | null);
 };
 
+export type SimilarFace = {
+    position: Position;
+    md5: string;
+    extension: string;
+    identity: (string | null);
+    distance: number;
+};
+
+export type SimilarFacesRequest = {
+    md5: string;
+    position: Position;
+    limit?: number;
+    distance?: 'l2' | 'cosine';
+};
+
+export type SimilarFacesResponse = {
+    faces: Array<SimilarFace>;
+    suggestions: Array<IdentitySuggestion>;
+};
+
 export type SortBy = 'TIMESTAMP' | 'RANDOM';
 
 export type SortOrder = 'DESC' | 'ASC';
@@ -546,11 +582,17 @@ export type AggregateImagesPostData = {
 export type AggregateImagesPostResponse = (ImageAggregation);
 
 export type FacesOnPagePostData = {
-    requestBody: GalleryRequest;
+    requestBody: FacesRequest;
 };
 
 export type FacesOnPagePostResponse = (FacesResponse);
 
+export type SimilarFacesPostData = {
+    requestBody: SimilarFacesRequest;
+};
+
+export type SimilarFacesPostResponse = (SimilarFacesResponse);
+
 export type FaceFeaturesForImagePostData = {
     requestBody: FaceFeatureRequest;
 };
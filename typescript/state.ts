@@ -164,6 +164,12 @@ function update_gallery_paging_value(
         } else {
             query[key] = val;
         }
+    } else if (key === "cursor") {
+        if (typeof value === "string" && value) {
+            query[key] = value;
+        } else {
+            delete query[key];
+        }
     } else {
         impissible(key);
     }